@@ -1,17 +1,44 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from pydantic import BaseModel
+from types import SimpleNamespace
+from typing import List, Optional
+import asyncio
+import hmac
+import json
 import os
+import shutil
+import tempfile
+import threading
 
 
 from utils.config import Config
-from utils.extractors import PDFTextExtractor, DOCXTextExtractor, TXTTextExtractor
-from utils.embeddings import EmbeddingsManager
-from utils.text_processing import TextProcessor
-from utils.compliance_agent import ComplianceAgent
-from langchain_openai import AzureOpenAIEmbeddings
+from utils.extractors import PDFTextExtractor, DOCXTextExtractor, TXTTextExtractor, shutdown_process_pool
+from utils.jobs import JobManager
+from utils.metrics import REGISTRY, Counter, Gauge, start_request_timings, stage
+from utils.uploads import UploadSizeLimit, expand_zip, upload_size
+from utils.startup import Startup
 
-app = FastAPI()
+# The corpus, index, Azure clients and chunker (and langchain, faiss and
+# openai with them) are loaded in the background once the server is up
+startup = Startup()
+app = FastAPI(lifespan=startup.lifespan)
+
+ 
+
+# Load environment/config
+
+config = Config()
+
+ 
+
+# Oversized uploads are refused while they arrive (added before CORS, so
+
+# the 413 still carries the CORS headers)
+
+app.add_middleware(UploadSizeLimit, max_bytes=config.max_upload_mb * 1024 * 1024)
 
  
 
@@ -19,13 +46,13 @@ app = FastAPI()
 
 origins = [
 
-    http://localhost:3000,
+    "http://localhost:3000",
 
-    http://127.0.0.1:3000,
+    "http://127.0.0.1:3000",
 
-    http://localhost:5173,
+    "http://localhost:5173",
 
-    http://127.0.0.1:5173
+    "http://127.0.0.1:5173"
 
 ]
 
@@ -45,56 +72,12 @@ app.add_middleware(
 
  
 
-# Load environment/config
-
-config = Config()
-
- 
-
-# Initialize EmbeddingsManager
+# Retrieval data files
 
 INDEX_FILE = 'embeddings/faiss_index_2.index'
 
 EMBEDDINGS_FILE = 'embeddings/test_case_2.json'
 
-embeddings_manager = EmbeddingsManager(
-
-    embeddings_file_path=EMBEDDINGS_FILE,
-
-    faiss_index_path=INDEX_FILE
-
-)
-
-embeddings_manager.load_data_and_index()
-
- 
-
-# Initialize the embedding model for chunk splitting
-
-azure_embedding_model = AzureOpenAIEmbeddings(
-
-    model="text-embedding-ada-002",
-
-    api_key=config.model_api_key,
-
-    api_version=config.api_version
-
-)
-
- 
-
-# Initialize TextProcessor
-
-text_processor = TextProcessor(
-
-    embedding_model=azure_embedding_model,
-
-    threshold_type="percentile",
-
-    threshold_amount=88.0
-
-)
-
  
 
 # System prompt
@@ -207,78 +190,1306 @@ Example HTML structure for feedback:
 
  
 
-# Initialize ComplianceAgent
+@startup.builder
 
-compliance_agent = ComplianceAgent(
+def build_services():
 
-    azure_endpoint=config.model_endpoint,
+    """
 
-    api_key=config.model_api_key,
+    Loads the corpus and index and builds the Azure clients, chunker and
 
-    api_version=config.api_version,
+    ComplianceAgent. Runs in a background thread after the server has
 
-    embedding_model="text-embedding-ada-002",  # for embeddings creation
+    started; the heavy modules are only imported here.
 
-    chat_model="gpt-4o",                      # for chat completions
+    """
 
-    system_prompt=SYSTEM_PROMPT,
+    from openai import AzureOpenAI, AsyncAzureOpenAI
 
-    embeddings_manager=embeddings_manager,
+    from langchain_openai import AzureOpenAIEmbeddings
 
-    text_processor=text_processor
+    from utils.embeddings import EmbeddingsManager
 
-)
+    from utils.text_processing import TextProcessor
 
- 
+    from utils.compliance_agent import ComplianceAgent
 
-@app.post("/upload")
+    from utils.embedding_cache import EmbeddingCache, CachedEmbeddings
 
-async def upload_document(file: UploadFile = File(...)):
+    from utils.verdict_cache import VerdictCache
 
-    """
+    from utils.near_duplicates import NearDuplicateStore
 
-    Endpoint to handle file upload, extract text, chunk, run compliance check, return results.
+    from utils.context_builder import ContextBuilder
 
-    """
+    from utils.llm_scheduler import LLMScheduler, ScheduledEmbeddings
 
-    file_bytes = await file.read()
+    from utils.triage import ChunkTriage
 
-    filename = file.filename.lower()
 
- 
 
-    # Identify file type by extension
+    # Initialize EmbeddingsManager
 
-    extractor = None
+    embeddings_manager = EmbeddingsManager(
 
-    if filename.endswith(".pdf"):
+        embeddings_file_path=EMBEDDINGS_FILE,
 
-        extractor = PDFTextExtractor()
+        faiss_index_path=INDEX_FILE,
 
-    elif filename.endswith(".docx"):
+        corpus_store_path=config.corpus_store_path,
 
-        extractor = DOCXTextExtractor()
+        index_type=config.faiss_index_type,
 
-    elif filename.endswith(".txt"):
+        index_params={"nprobe": config.faiss_nprobe, "ef_search": config.faiss_ef_search},
 
-        extractor = TXTTextExtractor()
+        # Memory-mapped index: with the corpus store, workers share one copy of the retrieval data
 
-    else:
+        mmap_index=config.faiss_mmap,
 
-        return {"error": "Unsupported file type."}
+        reload_interval=config.index_reload_interval
 
- 
+    )
 
-    # Extract text using the chosen extractor
+    embeddings_manager.load_data_and_index()
 
-    extracted_text = extractor.extract_text(file_bytes)
 
- 
 
-    # Run compliance check
+    # Persistent embedding cache shared by the chunker and the ComplianceAgent
+
+    embedding_cache = None
+
+    if config.embedding_cache_path:
+
+        embedding_cache = EmbeddingCache(
+
+            path=config.embedding_cache_path,
+
+            max_bytes=config.embedding_cache_max_mb * 1024 * 1024,
+
+            dtype=config.embedding_cache_dtype
+
+        )
+
+
+
+    # Verdict cache, re-uploaded revisions only send changed chunks to the model
+
+    verdict_cache = None
+
+    if config.verdict_cache_path:
+
+        verdict_cache = VerdictCache(
+
+            path=config.verdict_cache_path,
+
+            max_entries=config.verdict_cache_max_entries
+
+        )
+
+
+
+    # Near-duplicate store, boilerplate that differs only by a fund name, a date
+
+    # or a figure reuses the comment of an already checked paragraph
+
+    near_duplicates = None
+
+    if config.near_duplicate_path:
+
+        near_duplicates = NearDuplicateStore(
+
+            path=config.near_duplicate_path,
+
+            threshold=config.near_duplicate_threshold,
+
+            max_entries=config.near_duplicate_max_entries
+
+        )
+
+
+
+    # Shared gate for all Azure OpenAI calls: per-deployment RPM/TPM budgets
+
+    # (0 = unlimited), retries with backoff and adaptive concurrency
+
+    llm_scheduler = LLMScheduler(
+
+        limits={
+
+            "gpt-4o": {"rpm": config.chat_rpm, "tpm": config.chat_tpm},
+
+            "text-embedding-ada-002": {"rpm": config.embedding_rpm, "tpm": config.embedding_tpm},
+
+        },
+
+        max_concurrency=config.max_concurrency,
+
+        min_concurrency=config.min_concurrency,
+
+        max_retries=config.llm_max_retries
+
+    )
+
+
+
+    # One sync and one async Azure client (and their connection pools) shared by
+
+    # the chunker and the ComplianceAgent. Retries are left to the scheduler.
+
+    azure_client = AzureOpenAI(
+
+        azure_endpoint=config.model_endpoint,
+
+        api_key=config.model_api_key,
+
+        api_version=config.api_version,
+
+        max_retries=0
+
+    )
+
+    azure_async_client = AsyncAzureOpenAI(
+
+        azure_endpoint=config.model_endpoint,
+
+        api_key=config.model_api_key,
+
+        api_version=config.api_version,
+
+        max_retries=0
+
+    )
+
+
+
+    # Initialize the embedding model for chunk splitting
+
+    azure_embedding_model = AzureOpenAIEmbeddings(
+
+        model="text-embedding-ada-002",
+
+        api_key=config.model_api_key,
+
+        api_version=config.api_version,
+
+        max_retries=0,
+
+        check_embedding_ctx_length=config.embedding_check_ctx_length,
+
+        client=azure_client.embeddings,
+
+        async_client=azure_async_client.embeddings
+
+    )
+
+    azure_embedding_model = ScheduledEmbeddings(azure_embedding_model, llm_scheduler, "text-embedding-ada-002")
+
+    if embedding_cache is not None:
 
-    results = compliance_agent.compliance_check(extracted_text)
+        azure_embedding_model = CachedEmbeddings(azure_embedding_model, embedding_cache, "text-embedding-ada-002")
+
+
+
+    # Initialize TextProcessor
+
+    text_processor = TextProcessor(
+
+        embedding_model=azure_embedding_model,
+
+        threshold_type="percentile",
+
+        threshold_amount=88.0,
+
+        chunking_mode=config.chunking_mode,
+
+        structural_min_chars=config.structural_min_chars,
+
+        structural_max_chars=config.structural_max_chars
+
+    )
+
+
+
+    # Score cutoff, dedup and token budget for the rule sections put in each prompt
+
+    # (off by default: CONTEXT_TOKEN_BUDGET=0 keeps the plain concatenation of all neighbours)
+
+    context_builder = None
+
+    if config.context_token_budget > 0:
+
+        context_builder = ContextBuilder(
+
+            chat_model="gpt-4o",
+
+            min_score=config.context_min_score,
+
+            token_budget=config.context_token_budget,
+
+            overlap_threshold=config.context_overlap_threshold
+
+        )
+
+        # Load the tokenizer here rather than on the first request (estimates are used if it cannot be loaded)
+
+        context_builder.encoding
+
+
+
+    # Local pre-triage: headings, page numbers and fragments skip the model,
+
+    # short and weakly matching chunks get a cheaper check
+
+    triage = None
+
+    if config.triage:
+
+        triage = ChunkTriage(
+
+            min_words=config.triage_min_words,
+
+            skip_score=config.triage_skip_score,
+
+            numeric_density=config.triage_numeric_density,
+
+            cheap_max_chars=config.triage_cheap_max_chars,
+
+            full_min_score=config.triage_full_min_score,
+
+            cheap_model=config.triage_cheap_model,
+
+            cheap_max_tokens=config.triage_cheap_max_tokens,
+
+            cheap_sections=config.triage_cheap_sections
+
+        )
+
+
+
+    # Disclosure-presence index: which required disclosures of the corpus a
+
+    # document already contains, found locally and added to the prompts
+
+    disclosure_options = None
+
+    if config.disclosure_index:
+
+        disclosure_options = {
+
+            "min_words": config.disclosure_min_words,
+
+            "shingle": config.disclosure_shingle,
+
+            "present_threshold": config.disclosure_present,
+
+            "near_threshold": config.disclosure_near,
+
+        }
+
+
+
+    # Initialize ComplianceAgent
+
+    compliance_agent = ComplianceAgent(
+
+        azure_endpoint=config.model_endpoint,
+
+        api_key=config.model_api_key,
+
+        api_version=config.api_version,
+
+        embedding_model="text-embedding-ada-002",  # for embeddings creation
+
+        chat_model="gpt-4o",                      # for chat completions
+
+        system_prompt=SYSTEM_PROMPT,
+
+        embeddings_manager=embeddings_manager,
+
+        text_processor=text_processor,
+
+        max_concurrency=config.max_concurrency,
+
+        embedding_batch_size=config.embedding_batch_size,
+
+        embedding_cache=embedding_cache,
+
+        verdict_cache=verdict_cache,
+
+        context_builder=context_builder,
+
+        chat_batch_size=config.chat_batch_size,
+
+        chat_batch_min_overlap=config.chat_batch_min_overlap,
+
+        scheduler=llm_scheduler,
+
+        stream_window_chars=config.stream_window_chars,
+
+        stream_queue_size=config.stream_queue_size,
+
+        stream_max_in_flight=config.stream_max_in_flight,
+
+        client=azure_client,
+
+        async_client=azure_async_client,
+
+        triage=triage,
+
+        disclosure_options=disclosure_options,
+
+        disclosure_bypass=config.disclosure_bypass,
+
+        near_duplicates=near_duplicates,
+
+        near_duplicate_adapt=config.near_duplicate_adapt
+
+    )
+
+    # Built now rather than on the first upload
+
+    compliance_agent.disclosure_index()
+
+
+
+    # Background jobs: uploads return a job id and are checked by a local worker pool
+
+    job_manager = JobManager(
+
+        compliance_agent=compliance_agent,
+
+        get_extractor=get_extractor,
+
+        upload_dir=config.job_upload_dir,
+
+        workers=config.job_workers,
+
+        max_queued=config.job_queue_size
+
+    )
+
+
+
+    return SimpleNamespace(
+
+        embeddings_manager=embeddings_manager,
+
+        embedding_cache=embedding_cache,
+
+        verdict_cache=verdict_cache,
+
+        near_duplicates=near_duplicates,
+
+        llm_scheduler=llm_scheduler,
+
+        azure_client=azure_client,
+
+        azure_async_client=azure_async_client,
+
+        text_processor=text_processor,
+
+        compliance_agent=compliance_agent,
+
+        job_manager=job_manager
+
+    )
 
  
 
-    return {"chunks": results}
\ No newline at end of file
+def get_extractor(filename: str):
+
+    """
+
+    Identify file type by extension, returns None for unsupported files.
+
+    """
+
+    filename = filename.lower()
+
+    if filename.endswith(".pdf"):
+
+        # Large PDFs are extracted page range by page range in a process pool
+
+        return PDFTextExtractor(
+
+            workers=config.pdf_extract_workers,
+
+            parallel_min_pages=config.pdf_parallel_min_pages
+
+        )
+
+    elif filename.endswith(".docx"):
+
+        return DOCXTextExtractor()
+
+    elif filename.endswith(".txt"):
+
+        return TXTTextExtractor()
+
+    return None
+
+ 
+
+def upload_suffix(filename: str) -> str:
+
+    return os.path.splitext(filename or "")[1].lower()
+
+ 
+
+def resolve_chunking(chunking: Optional[str]) -> str:
+
+    """
+
+    Chunking mode of a request: the ?chunking= parameter or CHUNKING_MODE.
+
+    """
+
+    from utils.text_processing import CHUNKING_MODES
+
+    chunking = chunking or config.chunking_mode
+
+    if chunking not in CHUNKING_MODES:
+
+        raise HTTPException(status_code=400, detail=f"chunking must be one of {CHUNKING_MODES}.")
+
+    return chunking
+
+ 
+
+@startup.on_loaded
+
+async def start_job_workers(services):
+
+    await services.job_manager.start()
+
+ 
+
+@startup.on_loaded
+
+async def register_metrics(services):
+
+    """
+
+    Process-wide metrics read from the components' own counters at scrape time.
+
+    """
+
+    llm_scheduler = services.llm_scheduler
+
+    REGISTRY.register(Gauge(
+
+        "compliance_llm_in_flight",
+
+        "Azure OpenAI calls currently in flight.",
+
+        function=lambda: llm_scheduler.stats()["in_flight"]
+
+    ))
+
+    REGISTRY.register(Gauge(
+
+        "compliance_llm_concurrency_limit",
+
+        "Current adaptive concurrency limit of the LLM scheduler.",
+
+        function=lambda: llm_scheduler.stats()["concurrency_limit"]
+
+    ))
+
+    REGISTRY.register(Counter(
+
+        "compliance_llm_scheduler_events_total",
+
+        "Calls, retries, throttled (429) responses and failures seen by the LLM scheduler.",
+
+        ["event"],
+
+        function=lambda: {(name,): value for name, value in llm_scheduler.counters.items()}
+
+    ))
+
+    caches = (
+
+        ("embedding", services.embedding_cache),
+
+        ("verdict", services.verdict_cache),
+
+        ("near_duplicate", services.near_duplicates),
+
+    )
+
+    for cache_name, cache in caches:
+
+        if cache is None:
+
+            continue
+
+        REGISTRY.register(Counter(
+
+            f"compliance_{cache_name}_cache_lookups_total",
+
+            f"Lookups in the {cache_name} cache by result (hit, miss).",
+
+            ["result"],
+
+            function=lambda cache=cache: {("hit",): cache.hits, ("miss",): cache.misses}
+
+        ))
+
+        REGISTRY.register(Gauge(
+
+            f"compliance_{cache_name}_cache_hit_ratio",
+
+            f"Share of {cache_name} cache lookups that were hits.",
+
+            function=lambda cache=cache: cache.hits / max(1, cache.hits + cache.misses)
+
+        ))
+
+    REGISTRY.register(Counter(
+
+        "compliance_chat_batching_total",
+
+        "Chat batching counters (see /chat-batching/stats).",
+
+        ["counter"],
+
+        function=lambda: {(name,): value for name, value in services.compliance_agent.chat_stats.stats().items()}
+
+    ))
+
+    REGISTRY.register(Gauge(
+
+        "compliance_jobs_queued",
+
+        "Background jobs waiting for a worker.",
+
+        function=lambda: services.job_manager.stats()["queued"]
+
+    ))
+
+ 
+
+def warm_index(embeddings_manager):
+
+    """
+
+    Runs a few searches so the index pages (memory-mapped or not) and the
+
+    corpus texts are resident before the first request. A flat index is
+
+    scanned whole; IVF indexes only touch the probed lists.
+
+    """
+
+    import numpy as np
+
+    queries = np.random.default_rng(0).standard_normal(
+
+        (8, embeddings_manager.manifest["dimension"]), dtype="float32"
+
+    )
+
+    for neighbours in embeddings_manager.batch_search(queries):
+
+        embeddings_manager.get_context([neighbour["rule_id"] for neighbour in neighbours])
+
+ 
+
+@startup.on_loaded
+
+async def warmup(services):
+
+    """
+
+    With STARTUP_WARMUP=true, primes the FAISS index and opens the sync and
+
+    async Azure connections before the service reports ready. Failures are
+
+    logged and do not block readiness.
+
+    """
+
+    if not config.startup_warmup:
+
+        return
+
+    try:
+
+        await run_in_threadpool(warm_index, services.embeddings_manager)
+
+    except Exception as exc:
+
+        print(f"Index warmup failed: {exc}")
+
+    # Direct client calls, so a cached embedding does not skip the connection
+
+    try:
+
+        await asyncio.gather(
+
+            run_in_threadpool(services.azure_client.embeddings.create,
+
+                              model="text-embedding-ada-002", input=["warmup"]),
+
+            services.azure_async_client.embeddings.create(model="text-embedding-ada-002", input=["warmup"])
+
+        )
+
+    except Exception as exc:
+
+        print(f"Azure OpenAI warmup failed: {exc}")
+
+ 
+
+@startup.on_shutdown
+
+async def stop_job_workers(services):
+
+    if services is not None:
+
+        await services.job_manager.stop()
+
+    shutdown_process_pool()
+
+ 
+
+@app.get("/healthz")
+
+async def healthz():
+
+    """
+
+    Liveness: the process is up and serving, whether or not the services are loaded.
+
+    """
+
+    return {"status": "ok"}
+
+ 
+
+@app.get("/readyz")
+
+async def readyz():
+
+    """
+
+    Readiness: 200 once the corpus, index and clients are loaded (and warmed
+
+    up), 503 with status "starting" or "failed" (and the error) before that.
+
+    """
+
+    status = startup.status()
+
+    if status["status"] != "ready":
+
+        return JSONResponse(status_code=503, content=status)
+
+    return status
+
+ 
+
+@app.post("/upload")
+
+async def upload_document(file: UploadFile = File(...), chunking: Optional[str] = None, timings: bool = False,
+
+                          services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Endpoint to handle file upload, extract text, chunk, run compliance check, return results.
+
+    chunking selects "semantic" or "structural" chunking (default: CHUNKING_MODE).
+
+    With timings=true the response also has a per-stage timing and token breakdown.
+
+    """
+
+    chunking = resolve_chunking(chunking)
+
+    request_timings = start_request_timings()
+
+ 
+
+    # Identify file type by extension
+
+    extractor = get_extractor(file.filename)
+
+    if extractor is None:
+
+        return {"error": "Unsupported file type."}
+
+ 
+
+    # Extract text using the chosen extractor (CPU bound, keep it off the event loop),
+
+    # from the file the upload was spooled to rather than its bytes in memory.
+
+    # Structural chunking needs the heading markup.
+
+    extract = extractor.extract_structured_text if chunking == "structural" else extractor.extract_text
+
+    with stage("extraction"):
+
+        extracted_text = await run_in_threadpool(extract, file.file)
+
+ 
+
+    # Run compliance check
+
+    results = await services.compliance_agent.acompliance_check(extracted_text, chunking)
+
+ 
+
+    if timings:
+
+        return {"chunks": results, "timings": request_timings.to_dict()}
+
+    return {"chunks": results}
+
+ 
+
+@app.post("/upload/stream")
+
+async def upload_document_stream(file: UploadFile = File(...), chunking: Optional[str] = None, timings: bool = False,
+
+                                 services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Streaming version of /upload. Returns newline-delimited JSON events:
+
+    extraction/chunking progress first, then one {"type": "result", "index", "chunk", "comment"}
+
+    line per chunk as soon as it is checked, and a final {"type": "done"} line
+
+    (with the timing breakdown when timings=true).
+
+    Pages are extracted, chunked and checked as a pipeline, so the first
+
+    results arrive before the whole document has been extracted.
+
+    """
+
+    chunking = resolve_chunking(chunking)
+
+    extractor = get_extractor(file.filename)
+
+    if extractor is None:
+
+        return {"error": "Unsupported file type."}
+
+
+
+    async def events():
+
+        try:
+
+            request_timings = start_request_timings()
+
+            yield json.dumps({"type": "progress", "stage": "extracting"}) + "\n"
+
+            # The upload's spooled file is closed once the response is done
+
+            pages = extractor.iter_pages_for(chunking, file.file)
+
+            async for event in services.compliance_agent.astream_compliance_check_pages(pages, chunking):
+
+                yield json.dumps(event) + "\n"
+
+            if timings:
+
+                yield json.dumps({"type": "done", "timings": request_timings.to_dict()}) + "\n"
+
+            else:
+
+                yield json.dumps({"type": "done"}) + "\n"
+
+        except Exception as exc:
+
+            yield json.dumps({"type": "error", "error": str(exc)}) + "\n"
+
+
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+ 
+
+async def spool_batch(files: List[UploadFile], batch_dir: str):
+
+    """
+
+    Expands the zip archives of a batch into batch_dir; other files are
+
+    extracted from their upload's spooled file. The documents of the whole
+
+    request, expanded, may hold MAX_UPLOAD_MB in total.
+
+    Returns [(filename, source)] in submission order.
+
+    """
+
+    documents = []
+
+    max_bytes = config.max_upload_mb * 1024 * 1024
+
+    total = 0
+
+    for file in files:
+
+        if upload_suffix(file.filename) == ".zip":
+
+            try:
+
+                members = await run_in_threadpool(
+
+                    expand_zip, file.file, batch_dir, config.batch_max_files, max_bytes - total
+
+                )
+
+            except ValueError as exc:
+
+                raise HTTPException(status_code=400, detail=f"{file.filename}: {exc}")
+
+            documents.extend(members)
+
+            total += sum(os.path.getsize(path) for _, path in members)
+
+        else:
+
+            documents.append((file.filename, file.file))
+
+            total += await run_in_threadpool(upload_size, file.file)
+
+        if len(documents) > config.batch_max_files:
+
+            raise HTTPException(status_code=400, detail=f"At most {config.batch_max_files} files per batch.")
+
+        if total > max_bytes:
+
+            raise HTTPException(status_code=400, detail=f"Batch larger than {config.max_upload_mb} MB uncompressed.")
+
+    return documents
+
+
+
+@app.post("/upload/batch")
+
+async def upload_batch(files: List[UploadFile] = File(...), chunking: Optional[str] = None, timings: bool = False,
+
+                       services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Checks several related documents at once: any number of files and/or zip
+
+    archives of them (up to BATCH_MAX_FILES documents). The documents are
+
+    extracted in parallel and every chunk shared between them is embedded,
+
+    searched and checked once (see ComplianceAgent.acompliance_check_batch).
+
+    Returns {"documents": [{"filename", "chunks"} or {"filename", "error"}],
+
+    "dedup": {chunks, unique_chunks, checked_chunks, dedup_ratio, calls_saved}}.
+
+    """
+
+    chunking = resolve_chunking(chunking)
+
+    request_timings = start_request_timings()
+
+    batch_dir = tempfile.mkdtemp(prefix="batch-", dir=config.upload_spool_dir or None)
+
+    try:
+
+        documents = await spool_batch(files, batch_dir)
+
+        limit = asyncio.Semaphore(config.batch_extract_concurrency)
+
+
+
+        async def extract(filename: str, source):
+
+            extractor = get_extractor(filename)
+
+            if extractor is None:
+
+                return None, "Unsupported file type."
+
+            extract_text = extractor.extract_structured_text if chunking == "structural" else extractor.extract_text
+
+            async with limit:
+
+                try:
+
+                    with stage("extraction"):
+
+                        return await run_in_threadpool(extract_text, source), None
+
+                except Exception as exc:
+
+                    return None, f"Extraction failed: {exc}"
+
+
+
+        extracted = await asyncio.gather(*(extract(filename, source) for filename, source in documents))
+
+    finally:
+
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+
+
+    texts = [text for text, error in extracted if error is None]
+
+    results, dedup = await services.compliance_agent.acompliance_check_batch(texts, chunking)
+
+    results = iter(results)
+
+    response = {
+
+        "documents": [
+
+            {"filename": filename, "error": error} if error else {"filename": filename, "chunks": next(results)}
+
+            for (filename, _), (_, error) in zip(documents, extracted)
+
+        ],
+
+        "dedup": dedup,
+
+    }
+
+    if timings:
+
+        response["timings"] = request_timings.to_dict()
+
+    return response
+
+ 
+
+@app.post("/disclosures/check")
+
+async def check_disclosures(file: UploadFile = File(...), include_absent: bool = False,
+
+                            services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Which required disclosures of the compliance guide the document contains,
+
+    found locally without any model call: present, near (partly matching,
+
+    with their coverage) and absent (a count unless include_absent=true).
+
+    """
+
+    if services.compliance_agent.disclosure_index() is None:
+
+        raise HTTPException(status_code=400, detail="The disclosure index is disabled (DISCLOSURE_INDEX).")
+
+    extractor = get_extractor(file.filename)
+
+    if extractor is None:
+
+        return {"error": "Unsupported file type."}
+
+    with stage("extraction"):
+
+        text = await run_in_threadpool(extractor.extract_text, file.file)
+
+    disclosures = await run_in_threadpool(services.compliance_agent.scan_disclosures, text)
+
+    return disclosures.report(include_absent)
+
+ 
+
+@app.get("/embedding-cache/stats")
+
+async def embedding_cache_stats(services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Hit/miss counters of the persistent embedding cache.
+
+    """
+
+    if services.embedding_cache is None:
+
+        return {"enabled": False}
+
+    return {"enabled": True, **services.embedding_cache.stats()}
+
+ 
+
+@app.get("/verdict-cache/stats")
+
+async def verdict_cache_stats(services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Hit/miss counters of the verdict cache.
+
+    """
+
+    if services.verdict_cache is None:
+
+        return {"enabled": False}
+
+    return {"enabled": True, **services.verdict_cache.stats()}
+
+ 
+
+@app.get("/near-duplicates/stats")
+
+async def near_duplicate_stats(services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Hit/miss counters and size of the near-duplicate store.
+
+    """
+
+    if services.near_duplicates is None:
+
+        return {"enabled": False}
+
+    return {"enabled": True, **services.near_duplicates.stats()}
+
+ 
+
+@app.get("/chat-batching/stats")
+
+async def chat_batching_stats(services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Chat calls and input tokens used so far, and how many were saved by
+
+    checking chunks that share rules in one call.
+
+    """
+
+    return {"enabled": services.compliance_agent.chat_batch_size > 1, **services.compliance_agent.chat_stats.stats()}
+
+ 
+
+@app.get("/scheduler/stats")
+
+async def scheduler_stats(services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Calls, retries and throttling seen by the LLM scheduler, its current
+
+    concurrency limit and the remaining RPM/TPM budgets.
+
+    """
+
+    return services.llm_scheduler.stats()
+
+ 
+
+@app.get("/metrics")
+
+async def metrics():
+
+    """
+
+    Prometheus metrics: per-stage timing histograms, token counts,
+
+    cache hit rates, LLM concurrency and retries.
+
+    """
+
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+
+@app.post("/jobs")
+
+async def submit_job(file: UploadFile = File(...), chunking: Optional[str] = None,
+
+                     services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Stores the upload and queues it for the background workers.
+
+    Returns the job id right away; poll /jobs/{job_id} for progress and results.
+
+    """
+
+    if get_extractor(file.filename) is None:
+
+        raise HTTPException(status_code=400, detail="Unsupported file type.")
+
+    chunking = resolve_chunking(chunking)
+
+    try:
+
+        job = await services.job_manager.submit(file.filename, file.file, chunking)
+
+    except asyncio.QueueFull:
+
+        raise HTTPException(status_code=503, detail="Too many queued jobs, try again later.")
+
+    return {"job_id": job.job_id, "status": job.status}
+
+ 
+
+@app.get("/jobs/{job_id}")
+
+async def get_job(job_id: str, include_results: bool = True, services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Status, per-stage progress and (partial) results of a background job.
+
+    """
+
+    job = services.job_manager.get(job_id)
+
+    if job is None:
+
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    return job.to_dict(include_results=include_results)
+
+ 
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+
+    """
+
+    Admin endpoints require the X-Admin-Token header to match ADMIN_TOKEN.
+
+    Without ADMIN_TOKEN they are disabled (404), they can rewrite the rule corpus.
+
+    """
+
+    if not config.admin_token:
+
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), config.admin_token.encode()):
+
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+ 
+
+class RuleSection(BaseModel):
+
+    doc_text: str
+
+    chunk_summary: str = ""
+
+    file_name: str = ""
+
+    embedding: Optional[List[float]] = None
+
+ 
+
+@app.get("/admin/index", dependencies=[Depends(require_admin)])
+
+async def index_status(services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Manifest of the index currently serving searches and the state of the last rebuild.
+
+    """
+
+    return {
+
+        "manifest": services.embeddings_manager.manifest,
+
+        "rebuild": services.embeddings_manager.rebuild_status,
+
+    }
+
+ 
+
+@app.post("/admin/index/rebuild", status_code=202, dependencies=[Depends(require_admin)])
+
+async def rebuild_index(index_type: Optional[str] = None, services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Rebuilds the index from the current corpus in a background thread and swaps
+
+    it in when done. Searches keep using the current index in the meantime.
+
+    """
+
+    if services.embeddings_manager.rebuild_status["state"] == "running":
+
+        raise HTTPException(status_code=409, detail="A rebuild is already running.")
+
+    from utils.embeddings import INDEX_TYPES
+
+    if index_type is not None and index_type not in INDEX_TYPES:
+
+        raise HTTPException(status_code=400, detail=f"index_type must be one of {INDEX_TYPES}.")
+
+
+
+    def run():
+
+        try:
+
+            services.embeddings_manager.rebuild_index(index_type)
+
+        except Exception as exc:
+
+            print(f"Index rebuild failed: {exc}")
+
+
+
+    threading.Thread(target=run, daemon=True).start()
+
+    return {"status": "started", "index_type": index_type or services.embeddings_manager.index_type}
+
+ 
+
+@app.post("/admin/index/rules", dependencies=[Depends(require_admin)])
+
+async def add_rules(rules: List[RuleSection], services: SimpleNamespace = Depends(startup.require)):
+
+    """
+
+    Adds new rule sections to the corpus store and the live index without
+
+    retraining the index (see EmbeddingsManager.add_rules); the other workers
+
+    load the new version within INDEX_RELOAD_INTERVAL seconds.
+
+    Sections without an embedding are embedded with the chunk embedding model.
+
+    """
+
+    missing = [i for i, rule in enumerate(rules) if rule.embedding is None]
+
+    if missing:
+
+        embeddings = await services.compliance_agent.acreate_embeddings([rules[i].doc_text for i in missing])
+
+        for i, embedding in zip(missing, embeddings):
+
+            rules[i].embedding = [float(value) for value in embedding]
+
+    try:
+
+        manifest = await run_in_threadpool(services.embeddings_manager.add_rules, [rule.dict() for rule in rules])
+
+    except ValueError as exc:
+
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    except RuntimeError as exc:
+
+        raise HTTPException(status_code=409, detail=str(exc))
+
+    return {"manifest": manifest}
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""
+Recall/latency/memory benchmark of the FAISS index types in utils.embeddings.
+
+Builds every index type over a synthetic, clustered corpus of normalized
+vectors and reports, against the exact flat index:
+    recall@k, p50/p99 single-query latency, batched throughput,
+    build time and serialized index size.
+
+Run from backend/:
+    python -m benchmarks.bench_ann --n 200000 --dim 1536 --queries 500
+"""
+import argparse
+import time
+import faiss
+import numpy as np
+from utils.embeddings import INDEX_TYPES, create_faiss_index, search_faiss_index, search_faiss_index_batch
+
+def synthetic_corpus(n: int, dim: int, clusters: int, seed: int = 0):
+    # Rule sections cluster by topic, uniform random vectors would flatter IVF/PQ less than reality
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.5 * rng.normal(size=(n, dim)).astype("float32")
+    return vectors.astype("float32")
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, help="corpus size")
+    parser.add_argument("--dim", type=int, default=1536, help="vector dimension (ada-002 is 1536)")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=128)
+    parser.add_argument("--types", nargs="+", default=INDEX_TYPES, choices=INDEX_TYPES)
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.n + args.queries, args.dim, args.clusters)
+    vectors, queries = corpus[:args.n], corpus[args.n:]
+    print(f"corpus: {args.n} x {args.dim}, {args.queries} queries, k={args.k}")
+
+    truth = None
+    header = f"{'index':<10}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'batch q/s':>12}{'build s':>10}{'size MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for index_type in ["flat"] + [t for t in args.types if t != "flat"]:
+        start = time.perf_counter()
+        index = create_faiss_index(vectors, index_type, nprobe=args.nprobe, ef_search=args.ef_search)
+        build_s = time.perf_counter() - start
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            search_faiss_index(index, query, args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        _, found = search_faiss_index_batch(index, queries, args.k)
+        batch_qps = len(queries) / (time.perf_counter() - start)
+
+        if truth is None:
+            truth = found
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+        print(f"{index_type:<10}{recall_at_k(found, truth):>10.3f}"
+              f"{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 99):>10.3f}"
+              f"{batch_qps:>12.0f}{build_s:>10.2f}{size_mb:>10.1f}")
+
+if __name__ == "__main__":
+    main()
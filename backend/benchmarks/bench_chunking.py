@@ -0,0 +1,106 @@
+"""
+Semantic vs structural chunking benchmark for utils.text_processing.
+
+Generates a synthetic compliance document (bold **headings** followed by
+wrapped paragraphs, as PDFTextExtractor.extract_text2 produces) and chunks
+it with both modes. The semantic mode embeds every sentence; here that goes
+to a simulated embedding model with a per-request latency (batches of
+2048 inputs, like AzureOpenAIEmbeddings) and a per-input cost.
+Reports chunk count, chunk length, embedding requests and latency.
+
+Run from backend/:
+    python -m benchmarks.bench_chunking --sections 50 200 --request-ms 300
+"""
+import argparse
+import hashlib
+import random
+import textwrap
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from utils.text_processing import TextProcessor
+
+WORDS = (
+    "fund investment return risk performance disclosure portfolio manager "
+    "market index equity bond yield fee expense ratio benchmark volatility "
+    "client account statement distribution capital gain past future results"
+).split()
+
+class SimulatedEmbeddings(Embeddings):
+    """
+    Deterministic vectors (hash of the text), with simulated network latency.
+    """
+    def __init__(self, request_ms: float, per_input_ms: float, dim: int = 256, batch_size: int = 2048):
+        self.request_ms = request_ms
+        self.per_input_ms = per_input_ms
+        self.dim = dim
+        self.batch_size = batch_size
+        self.requests = 0
+
+    def _vector(self, text):
+        seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).normal(size=self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            self.requests += 1
+            time.sleep((self.request_ms + self.per_input_ms * len(batch)) / 1000)
+            vectors.extend(self._vector(text) for text in batch)
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def synthetic_document(sections: int, seed: int = 0):
+    """
+    Returns (structured_text, plain_text): the same document with and
+    without the ** heading markup.
+    """
+    rng = random.Random(seed)
+    structured, plain = [], []
+    for number in range(sections):
+        heading = f"Section {number + 1}: {rng.choice(WORDS).title()} {rng.choice(WORDS).title()} disclosures"
+        structured.append(f"**{heading}**")
+        plain.append(heading)
+        for _ in range(rng.randint(1, 4)):
+            sentences = [
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "."
+                for _ in range(rng.randint(2, 6))
+            ]
+            lines = textwrap.wrap(" ".join(sentences), 90)
+            structured.extend(lines)
+            plain.extend(lines)
+    return "\n".join(structured), "\n".join(plain)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sections", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--request-ms", type=float, default=300.0, help="simulated latency per embedding request")
+    parser.add_argument("--per-input-ms", type=float, default=0.5, help="simulated cost per embedded sentence")
+    parser.add_argument("--min-chars", type=int, default=200)
+    parser.add_argument("--max-chars", type=int, default=1500)
+    args = parser.parse_args()
+
+    print(f"{'sections':>8} {'mode':<11} {'chunks':>6} {'mean len':>9} {'max len':>8} {'requests':>8} {'seconds':>8}")
+    for sections in args.sections:
+        structured, plain = synthetic_document(sections)
+        for mode, text in (("semantic", plain), ("structural", structured)):
+            embeddings = SimulatedEmbeddings(args.request_ms, args.per_input_ms)
+            processor = TextProcessor(
+                embeddings,
+                chunking_mode=mode,
+                structural_min_chars=args.min_chars,
+                structural_max_chars=args.max_chars
+            )
+            start = time.perf_counter()
+            chunks = [chunk for chunk, _ in processor.chunk_document(text)]
+            elapsed = time.perf_counter() - start
+            lengths = [len(chunk) for chunk in chunks]
+            print(f"{sections:>8} {mode:<11} {len(chunks):>6} {np.mean(lengths):>9.0f} {max(lengths):>8} "
+                  f"{embeddings.requests:>8} {elapsed:>8.3f}")
+
+if __name__ == "__main__":
+    main()
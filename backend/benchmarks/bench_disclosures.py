@@ -0,0 +1,99 @@
+"""
+Local disclosure-presence scan (utils.disclosures) over large documents.
+
+Builds a synthetic corpus of rule sections with quoted disclosures, then
+documents of the given sizes with some disclosures copied word for word,
+some reworded (near) and the rest absent. Reports the index build time,
+the scan throughput, the detection accuracy, and the time of a naive scan
+(one normalized substring search per disclosure) for comparison.
+
+Run from backend/:
+    python -m benchmarks.bench_disclosures --disclosures 2000 --sizes 1 10 50
+"""
+import argparse
+import random
+import time
+from utils.disclosures import DisclosureIndex, words
+
+VOCABULARY = [f"w{i}" for i in range(5000)]
+
+def sentence(rng: random.Random, length: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(length))
+
+def make_corpus(rng: random.Random, count: int):
+    doc_texts = [
+        f"Rule {i}: {sentence(rng, 30)}. Include the following: \"{sentence(rng, rng.randint(15, 40))}.\""
+        for i in range(count)
+    ]
+    return doc_texts, ["rules.pdf"] * count
+
+def reword(rng: random.Random, text: str) -> str:
+    """
+    Replaces every 12th word: 7 of every 12 five-word shingles avoid the
+    replaced words, so a little over half of the disclosure still matches.
+    """
+    tokens = text.split()
+    return " ".join(rng.choice(VOCABULARY) if i % 12 == 6 else token for i, token in enumerate(tokens))
+
+def make_document(rng: random.Random, index: DisclosureIndex, megabytes: int, exact: int, near: int):
+    ids = rng.sample(range(len(index.disclosures)), exact + near)
+    expected = {i: "present" for i in ids[:exact]}
+    expected.update({i: "near" for i in ids[exact:]})
+    inserts = [index.disclosures[i]["text"] for i in ids[:exact]]
+    inserts += [reword(rng, index.disclosures[i]["text"]) for i in ids[exact:]]
+    paragraphs, size = [], 0
+    while size < megabytes * 1024 * 1024:
+        paragraph = sentence(rng, 80) + "."
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    for insert in inserts:
+        paragraphs.insert(rng.randrange(len(paragraphs)), insert)
+    return "\n\n".join(paragraphs), expected
+
+def naive_scan(index: DisclosureIndex, text: str):
+    normalized = " ".join(words(text))
+    return {
+        disclosure["disclosure_id"] for disclosure in index.disclosures
+        if " ".join(words(disclosure["text"])) in normalized
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--disclosures", type=int, default=2000, help="rule sections, one disclosure each")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50], help="document sizes in MB")
+    parser.add_argument("--exact", type=int, default=50, help="disclosures copied word for word")
+    parser.add_argument("--near", type=int, default=50, help="reworded disclosures")
+    parser.add_argument("--shingle", type=int, default=5)
+    parser.add_argument("--skip-naive", action="store_true")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    doc_texts, file_names = make_corpus(rng, args.disclosures)
+    started = time.perf_counter()
+    index = DisclosureIndex.from_corpus(doc_texts, file_names, min_words=12, shingle=args.shingle)
+    print(f"{len(index.disclosures)} disclosures, {len(index.shingle_hashes)} shingles, "
+          f"built in {time.perf_counter() - started:.2f} s")
+    print(f"{'MB':>4} {'scan s':>8} {'MB/s':>7} {'present':>8} {'near':>6} {'errors':>7} {'naive s':>8}")
+    for megabytes in args.sizes:
+        text, expected = make_document(rng, index, megabytes, args.exact, args.near)
+        scanner = index.scanner()
+        started = time.perf_counter()
+        scanner.feed(text)
+        scanner.finish()
+        seconds = time.perf_counter() - started
+        report = scanner.report()
+        found = {entry["disclosure_id"]: "present" for entry in report["present"]}
+        found.update({entry["disclosure_id"]: "near" for entry in report["near"]})
+        errors = len(set(found.items()) ^ set(expected.items()))
+        naive = "-"
+        if not args.skip_naive:
+            started = time.perf_counter()
+            naive_found = naive_scan(index, text)
+            naive = f"{time.perf_counter() - started:.2f}"
+            assert naive_found == {i for i, status in expected.items() if status == "present"}
+        size = len(text.encode()) / (1024 * 1024)
+        print(f"{megabytes:>4} {seconds:>8.2f} {size / seconds:>7.1f} {len(report['present']):>8} "
+              f"{len(report['near']):>6} {errors:>7} {naive:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Lookup latency and recall of the near-duplicate store
+(utils.near_duplicates.NearDuplicateStore) at millions of stored chunks.
+
+Fills a store with synthetic paragraphs spread over a number of scopes
+(rule sets), then looks up:
+    near     stored paragraphs with a name, a figure and a date changed
+             (should reuse the stored comment)
+    fresh    unseen paragraphs (should miss)
+and reports the insert rate, the lookup latency percentiles, the near
+duplicate recall and the false matches among fresh paragraphs.
+
+Run from backend/:
+    python -m benchmarks.bench_near_duplicates --entries 1000000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import numpy as np
+from utils.near_duplicates import NearDuplicateStore
+
+# Letters only: words with digits are masked as figures
+VOCABULARY = ["".join(random.Random(i).choices("abcdefghijklmnopqrstuvwxyz", k=7)) for i in range(20000)]
+NAMES = ["Alpha", "Beta", "Gamma", "Delta", "Omega", "Sigma", "Kappa", "Zeta"]
+MONTHS = ["January", "March", "June", "September", "December"]
+
+def paragraph(rng: random.Random, words: int) -> str:
+    tokens = [rng.choice(VOCABULARY) for _ in range(words)]
+    tokens[5:5] = [rng.choice(NAMES), "Fund", "returned", f"{rng.uniform(0, 20):.1f}%", "to",
+                   rng.choice(MONTHS), str(rng.randint(2015, 2025))]
+    return " ".join(tokens) + "."
+
+def variant(rng: random.Random, text: str) -> str:
+    tokens = text.split()
+    tokens[5] = rng.choice([name for name in NAMES if name != tokens[5]])
+    tokens[8] = f"{rng.uniform(0, 20):.1f}%"
+    tokens[10] = rng.choice([month for month in MONTHS if month != tokens[10]])
+    return " ".join(tokens)
+
+def percentiles(seconds):
+    values = np.array(seconds) * 1000
+    return f"p50 {np.percentile(values, 50):.3f} ms  p99 {np.percentile(values, 99):.3f} ms"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1000000, help="stored paragraphs")
+    parser.add_argument("--scopes", type=int, default=1000, help="distinct rule sets")
+    parser.add_argument("--words", type=int, default=60, help="words per paragraph")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--path", default=None, help="store file (default: a temporary one)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    workdir = tempfile.mkdtemp(prefix="compliance-near-duplicates-")
+    path = args.path or os.path.join(workdir, "near_duplicates.db")
+    try:
+        store = NearDuplicateStore(path, threshold=args.threshold, max_entries=args.entries)
+        scopes = [NearDuplicateStore.scope("prompt", "gpt-4o", [scope]) for scope in range(args.scopes)]
+        samples = []
+        started = time.perf_counter()
+        batch = []
+        for i in range(args.entries - store.stats()["entries"]):
+            text, scope = paragraph(rng, args.words), rng.choice(scopes)
+            batch.append((text, scope, f"<ul><li>comment {i}</li></ul>"))
+            if len(samples) < args.lookups and rng.random() < 2 * args.lookups / args.entries:
+                samples.append((text, scope))
+            if len(batch) == 10000:
+                store.put_many(batch)
+                batch = []
+        if batch:
+            store.put_many(batch)
+        seconds = time.perf_counter() - started
+        print(f"{store.stats()['entries']} entries in {args.scopes} scopes, "
+              f"inserted at {args.entries / max(seconds, 1e-9):.0f}/s, "
+              f"{os.path.getsize(path) / (1024 * 1024):.0f} MB")
+
+        for name, queries in (
+            ("near", [(variant(rng, text), scope) for text, scope in samples]),
+            ("fresh", [(paragraph(rng, args.words), rng.choice(scopes)) for _ in range(len(samples))]),
+        ):
+            latencies, matched = [], 0
+            for text, scope in queries:
+                started = time.perf_counter()
+                matched += store.get(text, scope) is not None
+                latencies.append(time.perf_counter() - started)
+            print(f"{name:<6} {len(queries)} lookups  {percentiles(latencies)}  matched {matched / len(queries):.1%}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
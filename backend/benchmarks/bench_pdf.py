@@ -0,0 +1,101 @@
+"""
+Serial vs process-pool PDF extraction benchmark for utils.extractors.
+
+Writes synthetic text PDFs (a bold heading and body paragraphs per page,
+plus a header/footer line that the extractor crops away) and times
+PDFTextExtractor.extract_text and extract_text2, serially and with the
+page-range process pool, checking that both give the same text.
+
+Run from backend/:
+    python -m benchmarks.bench_pdf --pages 100 300 --workers 4
+"""
+import argparse
+import os
+import random
+import time
+from utils.extractors import PDFTextExtractor, shutdown_process_pool
+
+WORDS = (
+    "fund investment return risk performance disclosure portfolio manager "
+    "market index equity bond yield fee expense ratio benchmark volatility "
+    "client account statement distribution capital gain past future results"
+).split()
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def synthetic_pdf(pages: int, lines_per_page: int = 45, seed: int = 0) -> bytes:
+    """
+    Minimal PDF writer: Letter pages, Helvetica body, Helvetica-Bold headings.
+    """
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>",
+    ]
+    page_ids = []
+    for number in range(pages):
+        lines = [f"BT /F2 14 Tf 72 700 Td (Section {number + 1}: {rng.choice(WORDS).title()} disclosures) Tj ET"]
+        y = 680
+        for _ in range(lines_per_page):
+            sentence = " ".join(rng.choice(WORDS) for _ in range(12))
+            lines.append(f"BT /F1 10 Tf 72 {y} Td ({_escape(sentence)}) Tj ET")
+            y -= 13
+        # Header and footer, inside the 50pt bands the extractor crops
+        lines.append(f"BT /F1 8 Tf 72 770 Td (Internal header page {number + 1}) Tj ET")
+        lines.append(f"BT /F1 8 Tf 72 20 Td (Footer {number + 1}) Tj ET")
+        stream = "\n".join(lines).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 300])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--pages-per-task", type=int, default=8)
+    args = parser.parse_args()
+
+    serial = PDFTextExtractor(workers=1)
+    parallel = PDFTextExtractor(workers=args.workers, parallel_min_pages=1, pages_per_task=args.pages_per_task)
+    # Spawn the pool before timing
+    parallel.extract_text(synthetic_pdf(args.workers * args.pages_per_task))
+
+    print(f"workers={args.workers} (cpus={os.cpu_count()})")
+    print(f"{'pages':>6} {'method':<14} {'serial s':>9} {'parallel s':>11} {'speedup':>8} {'same':>5}")
+    for pages in args.pages:
+        file_bytes = synthetic_pdf(pages)
+        for method in ("extract_text", "extract_text2"):
+            expected, serial_time = timed(getattr(serial, method), file_bytes)
+            text, parallel_time = timed(getattr(parallel, method), file_bytes)
+            print(f"{pages:>6} {method:<14} {serial_time:>9.2f} {parallel_time:>11.2f} "
+                  f"{serial_time / parallel_time:>7.2f}x {str(text == expected):>5}")
+    shutdown_process_pool()
+
+if __name__ == "__main__":
+    main()
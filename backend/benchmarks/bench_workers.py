@@ -0,0 +1,103 @@
+"""
+Memory per worker of the retrieval data (corpus + FAISS index) when
+several server processes load it, as uvicorn --workers N does.
+
+For each mode, starts N processes that each load an EmbeddingsManager the
+way app.py does and run a batch of searches, then reads their memory from
+/proc/<pid>/smaps_rollup (Linux only):
+    RSS  resident pages, counting shared pages in full in every process
+    PSS  shared pages divided among the processes mapping them
+    USS  pages private to the process
+Modes:
+    json         corpus parsed from JSON, index read into memory
+    store        memory-mapped corpus store, index read into memory
+    store+mmap   memory-mapped corpus store and index (FAISS_MMAP=true)
+
+Run from backend/:
+    python -m benchmarks.bench_workers --rules 50000 --dim 1536 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+from benchmarks.load_test import write_corpus
+from utils.embeddings import EmbeddingsManager
+
+MODES = {
+    "json": {"corpus_store": False, "mmap_index": False},
+    "store": {"corpus_store": True, "mmap_index": False},
+    "store+mmap": {"corpus_store": True, "mmap_index": True},
+}
+
+def memory_mb(pid: int):
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss": values["Rss"],
+        "pss": values["Pss"],
+        "uss": values["Private_Clean"] + values["Private_Dirty"],
+    }
+
+def worker(workdir: str, index_type: str, corpus_store: bool, mmap_index: bool, queries, ready, done):
+    manager = EmbeddingsManager(
+        embeddings_file_path=os.path.join(workdir, "embeddings", "test_case_2.json"),
+        faiss_index_path=os.path.join(workdir, "embeddings", f"{index_type}.index"),
+        corpus_store_path=os.path.join(workdir, "embeddings", "test_case_2.corpus") if corpus_store else None,
+        index_type=index_type,
+        mmap_index=mmap_index
+    )
+    manager.load_data_and_index()
+    # Touch what a request touches: the index and the texts of the neighbours
+    for neighbours in manager.batch_search(queries):
+        manager.get_context([neighbour["rule_id"] for neighbour in neighbours])
+    ready.set()
+    done.wait()
+
+def measure(workdir: str, index_type: str, workers: int, queries, options: dict):
+    context = multiprocessing.get_context("spawn")
+    done = context.Event()
+    processes, events = [], []
+    for _ in range(workers):
+        ready = context.Event()
+        process = context.Process(target=worker, args=(workdir, index_type, options["corpus_store"],
+                                                       options["mmap_index"], queries, ready, done))
+        process.start()
+        processes.append(process)
+        events.append(ready)
+        # Workers load one after the other, the first one builds the files
+        ready.wait()
+    usage = [memory_mb(process.pid) for process in processes]
+    done.set()
+    for process in processes:
+        process.join()
+    return {key: float(np.mean([u[key] for u in usage])) for key in ("rss", "pss", "uss")}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=50000, help="corpus size")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="compliance-workers-")
+    try:
+        write_corpus(workdir, args.rules, args.dim)
+        queries = np.random.default_rng(0).normal(size=(64, args.dim)).astype("float32")
+        print(f"{args.rules} rules, dim {args.dim}, {args.index_type} index, {args.workers} workers")
+        print(f"{'mode':<11} {'RSS MB':>8} {'PSS MB':>8} {'USS MB':>8}   (mean per worker)")
+        for mode in args.modes:
+            usage = measure(workdir, args.index_type, args.workers, queries, MODES[mode])
+            print(f"{mode:<11} {usage['rss']:>8.0f} {usage['pss']:>8.0f} {usage['uss']:>8.0f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
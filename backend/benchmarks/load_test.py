@@ -0,0 +1,301 @@
+"""
+End-to-end load test of the backend against the offline mock Azure server.
+
+Starts benchmarks.mock_azure and the app (uvicorn app:app) in a temporary
+working directory holding a synthetic rule corpus, then sends concurrent
+uploads of generated PDF, DOCX and TXT documents. Reports docs/min,
+chunks/sec and p50/p95/p99 latency per stage, read from the /upload/stream
+events (with --endpoint upload only the total is known), and the app's
+own per-stage totals from /metrics. No network access
+or Azure quota is needed, so it can run in CI.
+
+Run from backend/:
+    python -m benchmarks.load_test --docs 40 --concurrency 8 --pages 10
+    python -m benchmarks.load_test --docs 8 --concurrency 4 --pages 2 \\
+        --chat-latency fixed:50 --json load.json      # quick CI run
+Extra app settings can be passed with --env, e.g. --env CHUNKING_MODE=structural.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import docx
+import httpx
+import numpy as np
+from benchmarks.bench_pdf import synthetic_pdf, WORDS
+from benchmarks.mock_azure import embedding
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ["upload", "first_chunk", "first_result", "rest", "total"]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def write_corpus(workdir: str, rules: int, dim: int):
+    """
+    Synthetic rule corpus in the app's JSON format, at the relative path app.py loads.
+    """
+    rng = random.Random(1)
+    data = []
+    for i in range(rules):
+        text = f"Rule {i}: " + " ".join(rng.choice(WORDS) for _ in range(60)) + "."
+        data.append({
+            "embedding": embedding(text, dim),
+            "chunk_summary": f"Summary of rule {i}",
+            "doc_text": text,
+            "file_name": f"guide_{i % 5}.pdf",
+        })
+    os.makedirs(os.path.join(workdir, "embeddings"))
+    with open(os.path.join(workdir, "embeddings", "test_case_2.json"), "w") as f:
+        json.dump(data, f)
+
+def synthetic_docx(paragraphs: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    document = docx.Document()
+    for number in range(paragraphs):
+        if number % 5 == 0:
+            document.add_heading(f"Section {number // 5 + 1}: {rng.choice(WORDS).title()} disclosures", level=1)
+        document.add_paragraph(" ".join(rng.choice(WORDS) for _ in range(rng.randint(30, 80))).capitalize() + ".")
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+def synthetic_txt(paragraphs: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    return "\n\n".join(
+        ". ".join(" ".join(rng.choice(WORDS) for _ in range(12)).capitalize() for _ in range(rng.randint(3, 7))) + "."
+        for _ in range(paragraphs)
+    ).encode("utf-8")
+
+def make_documents(count: int, kinds, pages: int):
+    documents = []
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        if kind == "pdf":
+            documents.append((f"doc_{i}.pdf", synthetic_pdf(pages, seed=i)))
+        elif kind == "docx":
+            documents.append((f"doc_{i}.docx", synthetic_docx(pages * 8, seed=i)))
+        else:
+            documents.append((f"doc_{i}.txt", synthetic_txt(pages * 8, seed=i)))
+    return documents
+
+def start_process(args, cwd: str, env: dict, log_path: str):
+    log = open(log_path, "w")
+    return subprocess.Popen(args, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def wait_ready(url: str, process, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+async def upload(client: httpx.AsyncClient, base_url: str, endpoint: str, name: str, content: bytes):
+    """
+    Uploads one document. Returns {ok, chunks, errors, marks}, marks being the
+    seconds since the request started at which each stage was reached.
+    """
+    start = time.perf_counter()
+    marks = {}
+    files = {"file": (name, content)}
+    if endpoint == "upload":
+        response = await client.post(f"{base_url}/upload", files=files)
+        marks["done"] = time.perf_counter() - start
+        body = response.json() if response.status_code == 200 else {}
+        chunks = body.get("chunks", [])
+        return {
+            "ok": response.status_code == 200 and "chunks" in body,
+            "chunks": len(chunks),
+            "errors": sum(1 for chunk in chunks if chunk.get("error")),
+            "marks": marks,
+        }
+
+    chunks, errors, ok = 0, 0, False
+    async with client.stream("POST", f"{base_url}/upload/stream", files=files) as response:
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            elapsed = time.perf_counter() - start
+            if event["type"] == "progress":
+                marks.setdefault(event["stage"], elapsed)
+            elif event["type"] == "result":
+                marks.setdefault("first_result", elapsed)
+                chunks += 1
+                errors += bool(event.get("error"))
+            elif event["type"] == "done":
+                marks["done"] = elapsed
+                ok = True
+            elif event["type"] == "error":
+                break
+    return {"ok": ok, "chunks": chunks, "errors": errors, "marks": marks}
+
+def stage_durations(marks: dict):
+    """
+    Splits one streamed upload into consecutive stages:
+      upload        request start -> server sent "extracting"
+      first_chunk   -> first chunk ready for embedding (extraction + chunking of the first window)
+      first_result  -> first checked chunk
+      rest          -> last chunk checked
+    """
+    points = [0.0, marks.get("extracting"), marks.get("embedding"), marks.get("first_result"), marks.get("done")]
+    durations = {}
+    for stage, begin, end in zip(STAGES, points, points[1:]):
+        if begin is not None and end is not None:
+            durations[stage] = end - begin
+    if marks.get("done") is not None:
+        durations["total"] = marks["done"]
+    return durations
+
+async def run_load(base_url: str, endpoint: str, documents, concurrency: int, timeout: float):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        async def one(name, content):
+            async with semaphore:
+                try:
+                    return await upload(client, base_url, endpoint, name, content)
+                except httpx.HTTPError as exc:
+                    return {"ok": False, "chunks": 0, "errors": 0, "marks": {}, "exception": str(exc)}
+        return await asyncio.gather(*(one(name, content) for name, content in documents))
+
+def report(results, elapsed: float):
+    ok = [result for result in results if result["ok"]]
+    chunks = sum(result["chunks"] for result in ok)
+    durations = {stage: [] for stage in STAGES}
+    for result in ok:
+        for stage, duration in stage_durations(result["marks"]).items():
+            durations[stage].append(duration)
+    summary = {
+        "docs": len(results),
+        "docs_ok": len(ok),
+        "docs_failed": len(results) - len(ok),
+        "chunk_errors": sum(result["errors"] for result in ok),
+        "chunks": chunks,
+        "elapsed_s": elapsed,
+        "docs_per_min": len(ok) / elapsed * 60 if elapsed else 0.0,
+        "chunks_per_s": chunks / elapsed if elapsed else 0.0,
+        "latency_s": {
+            stage: {
+                f"p{q}": float(np.percentile(values, q)) for q in (50, 95, 99)
+            }
+            for stage, values in durations.items() if values
+        },
+    }
+    print(f"docs: {summary['docs_ok']} ok, {summary['docs_failed']} failed, "
+          f"{summary['chunk_errors']} chunk errors, {chunks} chunks in {elapsed:.1f}s")
+    print(f"throughput: {summary['docs_per_min']:.1f} docs/min, {summary['chunks_per_s']:.1f} chunks/s")
+    print(f"{'stage':<13} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8}")
+    for stage, latency in summary["latency_s"].items():
+        print(f"{stage:<13} {latency['p50']:>8.2f} {latency['p95']:>8.2f} {latency['p99']:>8.2f}")
+    return summary
+
+def server_stages(metrics_text: str):
+    """
+    Seconds and calls per stage from the app's compliance_stage_seconds
+    histogram (/metrics), summed over all requests.
+    """
+    stages = {}
+    for line in metrics_text.splitlines():
+        for suffix, field in (("_sum", "seconds"), ("_count", "calls")):
+            prefix = f"compliance_stage_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                name, value = line[len(prefix):].split("\"} ")
+                stages.setdefault(name, {})[field] = float(value)
+    for name, stage in stages.items():
+        print(f"server {name:<17} {stage['seconds']:>9.2f}s over {int(stage['calls'])} calls")
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=5, help="pages per PDF (DOCX/TXT get a similar amount of text)")
+    parser.add_argument("--types", default="pdf,docx,txt")
+    parser.add_argument("--endpoint", choices=["stream", "upload"], default="stream")
+    parser.add_argument("--rules", type=int, default=2000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=256, help="embedding dimension of the mock and the corpus")
+    parser.add_argument("--embed-latency", default="lognormal:80:0.3")
+    parser.add_argument("--chat-latency", default="lognormal:800:0.4")
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE app setting, repeatable")
+    parser.add_argument("--with-caches", action="store_true", help="keep the embedding and verdict caches on")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--json", help="also write the summary to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the working directory and server logs")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="compliance-load-")
+    mock_port, app_port = free_port(), free_port()
+    mock_url, app_url = f"http://127.0.0.1:{mock_port}", f"http://127.0.0.1:{app_port}"
+    write_corpus(workdir, args.rules, args.dim)
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [BACKEND_DIR, env.get("PYTHONPATH")]))
+    env.update({
+        "AZURE_OPENAI_ENDPOINT": mock_url,
+        "AZURE_OPENAI_API_KEY": "mock",
+        # Needs tiktoken's encoding files, which are downloaded on first use
+        "EMBEDDING_CHECK_CTX_LENGTH": "false",
+    })
+    if not args.with_caches:
+        env.update({"EMBEDDING_CACHE_PATH": "", "VERDICT_CACHE_PATH": ""})
+    env.update(setting.split("=", 1) for setting in args.env)
+
+    processes = []
+    summary = None
+    try:
+        mock = start_process([
+            sys.executable, "-m", "benchmarks.mock_azure", "--port", str(mock_port), "--dim", str(args.dim),
+            "--embed-latency", args.embed_latency, "--chat-latency", args.chat_latency,
+            "--throttle-rate", str(args.throttle_rate), "--rpm", str(args.rpm),
+        ], BACKEND_DIR, env, os.path.join(workdir, "mock.log"))
+        processes.append(mock)
+        wait_ready(f"{mock_url}/mock/stats", mock, 30)
+
+        app = start_process([
+            sys.executable, "-m", "uvicorn", "app:app", "--port", str(app_port), "--log-level", "warning",
+        ], workdir, env, os.path.join(workdir, "app.log"))
+        processes.append(app)
+        wait_ready(f"{app_url}/readyz", app, 300)
+
+        documents = make_documents(args.docs, args.types.split(","), args.pages)
+        start = time.perf_counter()
+        results = asyncio.run(run_load(app_url, args.endpoint, documents, args.concurrency, args.timeout))
+        summary = report(results, time.perf_counter() - start)
+        summary["mock"] = httpx.get(f"{mock_url}/mock/stats").json()
+        summary["scheduler"] = httpx.get(f"{app_url}/scheduler/stats").json()
+        summary["server_stages"] = server_stages(httpx.get(f"{app_url}/metrics").text)
+        print(f"mock: {summary['mock']}")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(summary, f, indent=2)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+        if args.keep:
+            print(f"working directory: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if summary is None or summary["docs_failed"] else 0)
+
+if __name__ == "__main__":
+    main()
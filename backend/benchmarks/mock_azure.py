@@ -0,0 +1,199 @@
+"""
+Offline stand-in for the Azure OpenAI embeddings and chat completions
+endpoints, for load tests that should not spend quota or need a network.
+
+    POST /openai/deployments/{deployment}/embeddings
+    POST /openai/deployments/{deployment}/chat/completions
+
+Outputs are deterministic: embeddings are unit vectors seeded by a hash of
+the input, chat comments are picked by a hash of the prompt, and batched
+(response_format json_object) requests get one entry per "Paragraph N:".
+Latency is drawn from a configurable distribution per endpoint, and
+requests are throttled with 429 + retry-after-ms at a configurable rate
+and/or above a requests-per-minute quota.
+
+Run from backend/:
+    python -m benchmarks.mock_azure --port 8100 --chat-latency lognormal:800:0.4 --throttle-rate 0.02
+and point the app at it with AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8100.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from collections import deque
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+COMMENTS = [
+    "All criteria met.",
+    "<ul>\n  <li id=\"{snippet}\"><strong>Missing disclosure:</strong> Add the past performance disclosure "
+    "from the compliance guide.</li>\n</ul>",
+    "<ul>\n  <li id=\"{snippet}\"><strong>Ambiguous language:</strong> State the fee terms explicitly.</li>\n"
+    "  <li id=\"{snippet}\"><strong>Unlabelled chart:</strong> Label both axes of the chart.</li>\n</ul>",
+]
+
+def parse_latency(spec: str):
+    """
+    "fixed:MS", "uniform:LOW_MS:HIGH_MS" or "lognormal:MEDIAN_MS:SIGMA".
+    Returns a function rng -> seconds.
+    """
+    kind, *params = spec.split(":")
+    params = [float(param) for param in params]
+    if kind == "fixed":
+        return lambda rng: params[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1]) / 1000
+    if kind == "lognormal":
+        return lambda rng: params[0] * rng.lognormvariate(0, params[1]) / 1000
+    raise ValueError(f"Unknown latency distribution {spec!r}")
+
+def stable_hash(value) -> int:
+    return int(hashlib.sha256(json.dumps(value).encode("utf-8")).hexdigest()[:16], 16)
+
+def embedding(value, dim: int):
+    vector = np.random.default_rng(stable_hash(value)).normal(size=dim)
+    return (vector / np.linalg.norm(vector)).astype("float32").tolist()
+
+def comment_for(text: str) -> str:
+    words = text.split()
+    snippet = " ".join(words[:6]).replace('"', "")
+    return COMMENTS[stable_hash(text) % len(COMMENTS)].format(snippet=snippet)
+
+def count_tokens(value) -> int:
+    # Token-id inputs count as they are, text at ~4 characters per token
+    if isinstance(value, list) and value and isinstance(value[0], int):
+        return len(value)
+    return len(str(value)) // 4 + 1
+
+class MockAzure:
+    def __init__(self, dim: int = 1536, embed_latency: str = "lognormal:80:0.3",
+                 chat_latency: str = "lognormal:800:0.4", throttle_rate: float = 0.0,
+                 rpm: int = 0, retry_after_ms: int = 500, seed: int = 0):
+        self.dim = dim
+        self.embed_latency = parse_latency(embed_latency)
+        self.chat_latency = parse_latency(chat_latency)
+        self.throttle_rate = throttle_rate
+        self.rpm = rpm
+        self.retry_after_ms = retry_after_ms
+        self.rng = random.Random(seed)
+        self.recent = deque()
+        self.counters = {"embeddings": 0, "chat": 0, "throttled": 0, "inputs": 0}
+
+    def throttle(self):
+        """
+        Returns a 429 response when this request is throttled, None otherwise.
+        """
+        now = time.monotonic()
+        while self.recent and now - self.recent[0] > 60:
+            self.recent.popleft()
+        over_quota = self.rpm and len(self.recent) >= self.rpm
+        if over_quota or self.rng.random() < self.throttle_rate:
+            self.counters["throttled"] += 1
+            retry_after_ms = self.retry_after_ms
+            if over_quota:
+                retry_after_ms = max(retry_after_ms, int((60 - (now - self.recent[0])) * 1000))
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after-ms": str(retry_after_ms), "retry-after": str(max(1, retry_after_ms // 1000))},
+                content={"error": {"code": "429", "message": "Rate limit is exceeded (mock)."}}
+            )
+        self.recent.append(now)
+        return None
+
+    def embeddings(self, deployment: str, body: dict):
+        inputs = body["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        self.counters["embeddings"] += 1
+        self.counters["inputs"] += len(inputs)
+        tokens = sum(count_tokens(value) for value in inputs)
+        return {
+            "object": "list",
+            "model": deployment,
+            "data": [
+                {"object": "embedding", "index": i, "embedding": embedding(value, self.dim)}
+                for i, value in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def chat(self, deployment: str, body: dict):
+        self.counters["chat"] += 1
+        prompt = body["messages"][-1]["content"]
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            paragraphs = re.split(r"^Paragraph \d+:\n", prompt, flags=re.M)[1:]
+            content = json.dumps({"results": [
+                {"id": number, "comment": comment_for(paragraph)}
+                for number, paragraph in enumerate(paragraphs, start=1)
+            ]})
+        else:
+            content = comment_for(prompt.split("Here is the paragraph to check:")[-1])
+        prompt_tokens = sum(count_tokens(message["content"]) for message in body["messages"])
+        completion_tokens = count_tokens(content)
+        return {
+            "id": f"chatcmpl-mock-{stable_hash(prompt):x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+def create_app(mock: MockAzure) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/openai/deployments/{deployment}/embeddings")
+    async def embeddings(deployment: str, request: Request):
+        throttled = mock.throttle()
+        if throttled is not None:
+            return throttled
+        body = await request.json()
+        await asyncio.sleep(mock.embed_latency(mock.rng))
+        return mock.embeddings(deployment, body)
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        throttled = mock.throttle()
+        if throttled is not None:
+            return throttled
+        body = await request.json()
+        await asyncio.sleep(mock.chat_latency(mock.rng))
+        return mock.chat(deployment, body)
+
+    @app.get("/mock/stats")
+    async def stats():
+        return mock.counters
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--dim", type=int, default=1536, help="embedding dimension, must match the corpus")
+    parser.add_argument("--embed-latency", default="lognormal:80:0.3")
+    parser.add_argument("--chat-latency", default="lognormal:800:0.4")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--rpm", type=int, default=0, help="429 above this many requests per minute (0 = off)")
+    parser.add_argument("--retry-after-ms", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    mock = MockAzure(args.dim, args.embed_latency, args.chat_latency, args.throttle_rate,
+                     args.rpm, args.retry_after_ms, args.seed)
+    uvicorn.run(create_app(mock), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Batched chat calls: grouping chunks by shared rules, merging their rule
+sections, and parsing the model's JSON answer, including the malformed
+answers that send chunks back to single-chunk calls.
+"""
+import json
+from utils.chat_batching import group_by_rules, merge_sections, parse_batch_response
+
+def response(*entries):
+    return json.dumps({"results": [{"id": number, "comment": comment} for number, comment in entries]})
+
+def test_parse_complete_response():
+    assert parse_batch_response(response((1, "<p>a</p>"), (2, "<p>b</p>")), 2) == {0: "<p>a</p>", 1: "<p>b</p>"}
+    # A ```json fence and a bare list are accepted
+    fenced = "```json\n" + json.dumps([{"id": "1", "comment": "a"}]) + "\n```"
+    assert parse_batch_response(fenced, 1) == {0: "a"}
+
+def test_parse_leaves_out_missing_and_extra_entries():
+    # Paragraph 2 is missing, 3 does not exist, the second entry for 1 is ignored
+    content = response((1, "a"), (3, "c"), (1, "again"))
+    assert parse_batch_response(content, 2) == {0: "a"}
+    # Entries without a usable id or comment are skipped
+    content = json.dumps({"results": [{"id": "x", "comment": "a"}, {"id": 2}, {"id": 2, "comment": None}, "text"]})
+    assert parse_batch_response(content, 2) == {}
+
+def test_parse_non_json_output():
+    assert parse_batch_response("", 2) == {}
+    assert parse_batch_response(None, 2) == {}
+    assert parse_batch_response("All criteria met.", 2) == {}
+    assert parse_batch_response(json.dumps({"results": "none"}), 2) == {}
+
+def test_group_by_rules():
+    rule_ids = {0: [1, 2], 1: [2, 1], 2: [1, 2, 3], 3: [7, 8], 4: [7], 5: []}
+    groups = group_by_rules(range(6), rule_ids, max_size=4, min_overlap=0.6)
+    # 2 shares two of its three rules (0.67), 3 shares none, a chunk without rules always fits
+    assert groups == [[0, 1, 2], [3, 4, 5]]
+    assert group_by_rules(range(6), rule_ids, max_size=2, min_overlap=0.6) == [[0, 1], [2], [3, 4], [5]]
+    assert group_by_rules([], rule_ids, max_size=4, min_overlap=0.6) == []
+
+def test_merge_sections_keeps_each_rule_once():
+    retrievals = [
+        {"rule_ids": [3, 1], "sections": ["rule 3", "rule 1"]},
+        {"rule_ids": [1, 5], "sections": ["rule 1", "rule 5"]},
+    ]
+    assert merge_sections(retrievals) == ([3, 1, 5], "rule 3\n\nrule 1\n\nrule 5")
@@ -0,0 +1,52 @@
+"""
+ContextBuilder: score cutoff, deduplication of overlapping rule sections and
+the token budget. Budgets are derived from the builder's own token counts,
+so the tests hold with tiktoken and with the offline estimate alike.
+"""
+from utils.context_builder import ContextBuilder, overlap
+
+DOC_TEXTS = [
+    "Past performance is not a reliable indicator of future results and must be shown next to any return.",
+    "Past performance is not a reliable indicator of future results and must be shown next to any return figure.",
+    "Fees and charges reduce the return of the fund and must be disclosed in full.",
+    "Risk warnings must be as prominent as the benefits described in the promotion.",
+]
+FILE_NAMES = ["rules.pdf"] * len(DOC_TEXTS)
+
+def neighbours(*pairs):
+    return [{"rule_id": rule_id, "score": score} for rule_id, score in pairs]
+
+def section_tokens(builder, rule_id, score):
+    return builder.count_tokens(builder.format_section(rule_id, score, FILE_NAMES[rule_id], DOC_TEXTS[rule_id])) + 2
+
+def test_overlap():
+    assert overlap(DOC_TEXTS[0], DOC_TEXTS[1]) == 1.0
+    assert overlap(DOC_TEXTS[0], DOC_TEXTS[2]) == 0.0
+    assert overlap("", DOC_TEXTS[0]) == 0.0
+
+def test_low_scores_and_duplicates_are_dropped():
+    builder = ContextBuilder(min_score=0.8, token_budget=10000)
+    result = builder.build(neighbours((0, 0.9), (1, 0.88), (2, 0.85), (3, 0.7)), DOC_TEXTS, FILE_NAMES)
+    assert result["rule_ids"] == [0, 2]
+    assert result["dropped"] == {"low_score": 1, "duplicate": 1, "budget": 0}
+    assert "[Source: rules.pdf | section 2 | similarity 0.85]" in result["context"]
+    # min_keep keeps the best neighbour even below the cutoff
+    assert builder.build(neighbours((3, 0.5)), DOC_TEXTS, FILE_NAMES)["rule_ids"] == [3]
+
+def test_sections_stop_at_the_token_budget():
+    builder = ContextBuilder(min_score=0.0)
+    budget = section_tokens(builder, 0, 0.9) + section_tokens(builder, 2, 0.8)
+    builder.token_budget = budget
+    result = builder.build(neighbours((0, 0.9), (2, 0.8), (3, 0.7)), DOC_TEXTS, FILE_NAMES)
+    assert result["rule_ids"] == [0, 2]
+    assert result["tokens"] == budget
+    assert result["dropped"]["budget"] == 1
+    assert not result["truncated"]
+
+def test_best_section_is_cut_to_a_small_budget():
+    builder = ContextBuilder(min_score=0.0, token_budget=10)
+    result = builder.build(neighbours((0, 0.9), (2, 0.8)), DOC_TEXTS, FILE_NAMES)
+    assert result["rule_ids"] == [0]
+    assert result["truncated"]
+    assert result["tokens"] <= 10 + 2
+    assert result["dropped"]["budget"] == 1
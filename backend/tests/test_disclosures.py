@@ -0,0 +1,67 @@
+"""
+Disclosure presence: passages found in the rule corpus, and their status in
+documents scanned whole or page by page.
+"""
+from utils.disclosures import DisclosureIndex, disclosure_note, extract_disclosures
+
+PAST_PERFORMANCE = (
+    "Past performance is not a reliable indicator of future results and investors may not get back "
+    "the amount originally invested."
+)
+CAPITAL_AT_RISK = (
+    "The value of investments and the income from them can fall as well as rise and you may lose "
+    "some or all of your capital."
+)
+DOC_TEXTS = [
+    f'Every promotion that shows past returns must state: "{PAST_PERFORMANCE}"',
+    f"Risk warnings must be prominent.\nRequired disclosure: {CAPITAL_AT_RISK}\n\nOther text.",
+    'Short quotes such as "capital at risk" are not disclosures.',
+    f"Repeated in another rule: '{PAST_PERFORMANCE}' and “{PAST_PERFORMANCE.upper()}”",
+]
+FILE_NAMES = ["a.pdf", "b.pdf", "c.pdf", "d.pdf"]
+
+def test_extract_disclosures():
+    disclosures = extract_disclosures(DOC_TEXTS, FILE_NAMES, min_words=12)
+    # Quoted and labelled passages, each once (case-insensitively), short quotes left out
+    assert [(d["disclosure_id"], d["rule_id"], d["file_name"]) for d in disclosures] == [(0, 0, "a.pdf"), (1, 1, "b.pdf")]
+    assert disclosures[0]["text"] == PAST_PERFORMANCE
+    assert disclosures[1]["text"] == CAPITAL_AT_RISK
+
+def index():
+    return DisclosureIndex.from_corpus(DOC_TEXTS, FILE_NAMES, min_words=12, shingle=5)
+
+def test_statuses_of_a_whole_document():
+    scanner = index().scanner()
+    truncated = " ".join(CAPITAL_AT_RISK.split()[:15])
+    # Line breaks and case from PDF extraction do not matter
+    scanner.feed(f"Fund overview.\n{PAST_PERFORMANCE.upper().replace(' the ', chr(10) + 'the ')}\n{truncated}.")
+    scanner.finish()
+    statuses = {entry["disclosure_id"]: entry["status"] for entry in scanner.for_rules([0, 1, 2])}
+    assert statuses == {0: "present", 1: "near"}
+    report = scanner.report()
+    assert [entry["disclosure_id"] for entry in report["present"]] == [0]
+    assert report["absent"] == 0
+
+def test_disclosure_split_across_pages():
+    scanner = index().scanner()
+    split = PAST_PERFORMANCE.split()
+    pages = list(scanner.feed_pages(["Intro. " + " ".join(split[:9]), " ".join(split[9:]) + " More text."]))
+    assert len(pages) == 2 and scanner.finished
+    assert scanner.entry(0)["status"] == "present"
+    assert scanner.entry(1)["status"] == "absent"
+
+def test_disclosure_text_and_notes():
+    scanner = index().scanner()
+    scanner.feed(PAST_PERFORMANCE)
+    assert scanner.is_disclosure_text(PAST_PERFORMANCE, 0.9)
+    assert not scanner.is_disclosure_text(f"The fund returned 5% last year. {PAST_PERFORMANCE[:40]}", 0.9)
+    # Disclosure text the document does not contain in full is still checked
+    assert not scanner.is_disclosure_text(CAPITAL_AT_RISK, 0.9)
+
+    entries = scanner.for_rules([0, 1])
+    disclosures = scanner.index.disclosures
+    assert "Present in the document" in disclosure_note(entries, disclosures, finished=False)
+    # Until the scan is finished an absent disclosure may still come
+    assert "Not found" not in disclosure_note(entries, disclosures, finished=False)
+    assert "Not found in the document" in disclosure_note(entries, disclosures, finished=True)
+    assert disclosure_note([], disclosures) == ""
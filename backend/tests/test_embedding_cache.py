@@ -0,0 +1,51 @@
+"""
+EmbeddingCache: normalised keys, float16 round trips and least-recently-used
+eviction under the byte cap.
+"""
+import numpy as np
+from utils.embedding_cache import CachedEmbeddings, EmbeddingCache, embedding_key, normalize_text
+
+def test_keys_ignore_whitespace_and_unicode_forms():
+    assert normalize_text("  Past  performance\nis not\ta guide ") == "Past performance is not a guide"
+    # NFKC folds the "fi" ligature PDF extraction produces
+    assert embedding_key("ﬁnancial  advice", "ada") == embedding_key("financial advice", "ada")
+    assert embedding_key("financial advice", "ada") != embedding_key("financial advice", "other")
+
+def test_round_trip(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    vector = np.linspace(-1, 1, 8, dtype="float32")
+    cache.put("Some text", vector, "ada")
+    found = cache.get_many(["Some  text", "Other text"], "ada")
+    assert np.allclose(found[0], vector, atol=1e-3)
+    assert found[0].dtype == np.float32
+    assert found[1] is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    # float16 vectors of 8 values are 16 bytes, the cache holds four of them
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_bytes=64)
+    vectors = np.eye(8, dtype="float32")
+    for i in range(4):
+        cache.put(f"text {i}", vectors[i], "ada")
+    # Touch the oldest entry so it is the most recently used
+    assert cache.get("text 0", "ada") is not None
+    cache.put("text 4", vectors[4], "ada")
+    stats = cache.stats()
+    assert stats["bytes"] <= 0.9 * 64
+    assert stats["evictions"] == 2
+    assert cache.get("text 0", "ada") is not None
+    assert cache.get("text 1", "ada") is None and cache.get("text 2", "ada") is None
+
+def test_cached_embeddings_only_embed_misses(tmp_path):
+    class Model:
+        calls = []
+        def embed_documents(self, texts):
+            self.calls.append(list(texts))
+            return [[float(len(text)), 1.0] for text in texts]
+
+    model = Model()
+    embeddings = CachedEmbeddings(model, EmbeddingCache(str(tmp_path / "cache.sqlite")), "ada")
+    embeddings.embed_documents(["one", "three"])
+    vectors = embeddings.embed_documents(["one", "three", "fifteen"])
+    assert model.calls == [["one", "three"], ["fifteen"]]
+    assert vectors == [[3.0, 1.0], [5.0, 1.0], [7.0, 1.0]]
@@ -0,0 +1,83 @@
+"""
+Scheduler building blocks: Retry-After parsing, token buckets and the
+adaptive concurrency limit.
+"""
+import asyncio
+import threading
+from types import SimpleNamespace
+import pytest
+from utils.llm_scheduler import AdaptiveLimiter, TokenBucket, retry_after
+
+def error(headers):
+    return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+def test_retry_after():
+    assert retry_after(error({"retry-after-ms": "1500", "retry-after": "9"})) == 1.5
+    assert retry_after(error({"retry-after": "2"})) == 2.0
+    assert retry_after(error({})) is None
+    # The HTTP-date form is left to our own backoff
+    assert retry_after(error({"retry-after": "Wed, 21 Oct 2026 07:28:00 GMT"})) is None
+    assert retry_after(ValueError("no response")) is None
+
+def test_token_bucket_waits_once_the_minute_is_used():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.reserve(60) == 0.0
+    # One unit a second: the next 30 units are 30 seconds away
+    assert bucket.reserve(30) == pytest.approx(30, abs=0.1)
+    # Requests larger than the whole budget are capped to it
+    assert bucket.reserve(1000) == pytest.approx(90, abs=0.1)
+
+def test_token_bucket_pause_and_disabled_bucket():
+    bucket = TokenBucket(per_minute=600)
+    bucket.pause(5)
+    assert bucket.reserve(1) == pytest.approx(5, abs=0.1)
+    assert TokenBucket(per_minute=0).reserve(10 ** 6) == 0.0
+
+def test_limiter_halves_on_throttle_and_recovers():
+    limiter = AdaptiveLimiter(max_limit=8, min_limit=2, cooldown=60)
+    limiter.on_throttle()
+    assert limiter.limit == 4
+    # A second 429 within the cooldown comes from the same burst
+    limiter.on_throttle()
+    assert limiter.limit == 4
+    limiter._last_decrease = 0.0
+    limiter.on_throttle()
+    limiter._last_decrease = 0.0
+    limiter.on_throttle()
+    assert limiter.limit == 2
+    # One more slot after `limit` consecutive successes
+    for _ in range(2):
+        limiter.on_success()
+    assert limiter.limit == 3
+
+def test_limiter_blocks_threads_at_the_limit():
+    limiter = AdaptiveLimiter(max_limit=1)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def worker():
+        limiter.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert not acquired.wait(0.1)
+    limiter.release()
+    assert acquired.wait(1)
+    thread.join()
+    assert limiter.in_flight == 1
+
+def test_limiter_blocks_tasks_at_the_limit():
+    limiter = AdaptiveLimiter(max_limit=1)
+
+    async def main():
+        await limiter.aacquire()
+        waiting = asyncio.create_task(limiter.aacquire())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        # Released from another thread, as a blocking call would
+        await asyncio.to_thread(limiter.release)
+        await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(main())
+    assert limiter.in_flight == 1
@@ -0,0 +1,53 @@
+"""
+Near-duplicate reuse: masked shingles, MinHash banding within a scope, and
+the rewriting of reused comments.
+"""
+from utils.near_duplicates import NearDuplicateStore, adapt_comment, jaccard, shingles
+
+CHUNK = (
+    "The Alpha Global Equity Fund returned 6.2% in the twelve months to March 2024, "
+    "ahead of its benchmark, the MSCI World Index, which returned 5.1% over the same period."
+)
+VARIANT = CHUNK.replace("Alpha", "Beta").replace("6.2%", "7.9%").replace("March", "June")
+OTHER = "Investors should read the key information document before making any decision to invest in the fund."
+
+def test_figures_and_months_are_masked():
+    assert jaccard(shingles(CHUNK), shingles(CHUNK.replace("6.2%", "8.4%").replace("March", "May"))) == 1.0
+    assert 0.8 <= jaccard(shingles(CHUNK), shingles(VARIANT)) < 1.0
+    assert jaccard(shingles(CHUNK), shingles(OTHER)) == 0.0
+
+def test_similar_chunks_share_band_keys_within_a_scope(tmp_path):
+    store = NearDuplicateStore(str(tmp_path / "near.sqlite"))
+    scope = NearDuplicateStore.scope("prompt", "gpt-4o", [4, 2])
+    keys = store.band_keys(scope, shingles(CHUNK))
+    assert len(keys) == store.bands
+    assert set(keys) & set(store.band_keys(scope, shingles(VARIANT)))
+    assert not set(keys) & set(store.band_keys(scope, shingles(OTHER)))
+    other_scope = NearDuplicateStore.scope("prompt", "gpt-4o", [4, 3])
+    assert not set(keys) & set(store.band_keys(other_scope, shingles(CHUNK)))
+    # Only the set of rules matters, not their retrieval order
+    assert NearDuplicateStore.scope("prompt", "gpt-4o", [2, 4]) == scope
+
+def test_get_put_and_dedupe(tmp_path):
+    store = NearDuplicateStore(str(tmp_path / "near.sqlite"), threshold=0.8, max_entries=3)
+    scope = NearDuplicateStore.scope("prompt", "gpt-4o", [1])
+    store.put(CHUNK, scope, "first")
+    # The same chunk again replaces its comment instead of adding an entry
+    store.put_many([(CHUNK, scope, "second"), ("  " + CHUNK, scope, "third")])
+    assert store.stats()["entries"] == 1
+    match = store.get(VARIANT, scope)
+    assert match["comment"] == "third" and match["chunk"] == CHUNK
+    assert store.get(OTHER, scope) is None
+    assert store.get(VARIANT, NearDuplicateStore.scope("prompt", "gpt-4o", [2])) is None
+    # Capped at max_entries, the oldest entries go first
+    store.put_many([(f"{OTHER} Version {i} of this paragraph.", scope, "c") for i in range(3)])
+    assert store.stats()["entries"] <= 3
+    assert store.get(VARIANT, scope) is None
+
+def test_adapt_comment():
+    comment = "<li>The Alpha Global Equity Fund should name the period ending March 2024.</li>"
+    adapted, replacements = adapt_comment(comment, CHUNK, VARIANT)
+    assert adapted == "<li>The Beta Global Equity Fund should name the period ending June 2024.</li>"
+    assert replacements == 2
+    # Text the comment does not quote is left alone
+    assert adapt_comment("<li>Add a risk warning.</li>", CHUNK, VARIANT) == ("<li>Add a risk warning.</li>", 0)
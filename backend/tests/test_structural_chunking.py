@@ -0,0 +1,75 @@
+"""
+Structural chunking of a real PDF: the extractor marks bold lines as
+**headings** and create_structural_chunks starts a chunk at each of them.
+"""
+from utils.extractors import PDFTextExtractor
+from utils.text_processing import create_structural_chunks
+
+def make_pdf(pages):
+    """
+    Minimal PDF with one text line per (bold, text) item of each page,
+    in Helvetica or Helvetica-Bold.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>",
+    ]
+    kids = []
+    for lines in pages:
+        operators = ["BT", "14 TL", "72 700 Td"]
+        for bold, text in lines:
+            escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            operators += [f"/{'F2' if bold else 'F1'} 10 Tf", f"({escaped}) Tj T*"]
+        operators.append("ET")
+        stream = "\n".join(operators).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objects)} 0 R "
+            "/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> >>".encode()
+        )
+        kids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>".encode()
+    pdf, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+SECTIONS = ["Investment objective", "Risk factors", "Fees and charges"]
+
+def sample_pdf():
+    pages = []
+    for number, heading in enumerate(SECTIONS):
+        lines = [(True, heading)]
+        lines += [(False, f"Sentence {i} of section {number} describes the fund in some detail.") for i in range(30)]
+        pages.append(lines)
+    return make_pdf(pages)
+
+def test_pdf_headings_are_marked():
+    text = PDFTextExtractor().extract_structured_text(sample_pdf())
+    for heading in SECTIONS:
+        assert f"**{heading}**" in text.split("\n")
+    # Body lines are not headings
+    assert "**Sentence" not in text
+
+def test_pdf_is_chunked_by_section():
+    text = PDFTextExtractor().extract_structured_text(sample_pdf())
+    chunks = create_structural_chunks(text, min_chars=200, max_chars=1500)
+    assert len(chunks) >= len(SECTIONS)
+    assert all(len(chunk) <= 1500 for chunk in chunks)
+    starts = [chunk for chunk in chunks if chunk.startswith("**")]
+    assert [chunk.split("**")[1] for chunk in starts] == SECTIONS
+
+def test_unpunctuated_text_is_split_to_max_chars():
+    table = "**Holdings**\n" + "\n".join(f"Company {i} Equity 1.{i % 10}%" for i in range(400))
+    run_on = "**Notes**\n" + " ".join(f"word{i}" for i in range(2000))
+    for text in (table, run_on, "x" * 5000):
+        chunks = create_structural_chunks(text, min_chars=200, max_chars=1500)
+        assert chunks and all(len(chunk) <= 1500 for chunk in chunks)
+        assert "".join(chunks).replace(" ", "").replace("\n", "") == text.replace(" ", "").replace("\n", "")
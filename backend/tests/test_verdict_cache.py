@@ -0,0 +1,35 @@
+"""
+VerdictCache: what the key depends on, and eviction at max_entries.
+"""
+from utils.verdict_cache import VerdictCache, verdict_key
+
+def test_key_normalises_the_chunk_only():
+    key = verdict_key("prompt", "gpt-4o", [3, 1], "The fund  aims\nto grow.")
+    assert key == verdict_key("prompt", "gpt-4o", [3, 1], " The fund aims to grow. ")
+    # Anything that changes the prompt changes the key
+    assert key != verdict_key("prompt", "gpt-4o", [1, 3], "The fund aims to grow.")
+    assert key != verdict_key("prompt", "gpt-4o-mini", [3, 1], "The fund aims to grow.")
+    assert key != verdict_key("other prompt", "gpt-4o", [3, 1], "The fund aims to grow.")
+    assert key != verdict_key("prompt", "gpt-4o", [3, 1], "The fund aims to shrink.")
+
+def test_put_replaces_and_counts_entries(tmp_path):
+    cache = VerdictCache(str(tmp_path / "verdicts.sqlite"))
+    cache.put("a", "first")
+    cache.put("a", "second")
+    cache.put("b", "other")
+    assert cache.get("a") == "second"
+    assert cache.get("missing") is None
+    assert cache.stats()["entries"] == 2
+    # The count survives a restart
+    assert VerdictCache(str(tmp_path / "verdicts.sqlite")).stats()["entries"] == 2
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = VerdictCache(str(tmp_path / "verdicts.sqlite"), max_entries=3)
+    for key in "abc":
+        cache.put(key, f"comment {key}")
+    # Using "a" makes "b" the least recently used entry
+    assert cache.get("a") == "comment a"
+    cache.put("d", "comment d")
+    assert cache.stats()["entries"] <= 3
+    assert cache.get("b") is None
+    assert cache.get("a") == "comment a" and cache.get("d") == "comment d"
@@ -0,0 +1,137 @@
+import json
+import re
+import threading
+
+BATCH_INSTRUCTIONS = (
+    "Review each of the numbered paragraphs below separately against the compliance context, "
+    "following your instructions for every paragraph on its own. "
+    "Respond with a JSON object of the form "
+    '{"results": [{"id": <paragraph number>, "comment": "<your full HTML response for that paragraph>"}]} '
+    "with exactly one entry per paragraph."
+)
+
+def rule_overlap(rule_ids, group_rule_ids) -> float:
+    """
+    Share of a chunk's rule ids that are already in the group's prompt.
+    """
+    rule_ids = set(rule_ids)
+    if not rule_ids:
+        return 1.0
+    return len(rule_ids & group_rule_ids) / len(rule_ids)
+
+def group_by_rules(indices, rule_ids, max_size: int, min_overlap: float):
+    """
+    Groups chunks (in document order) that can share one prompt. A chunk
+    joins the current group while at least min_overlap of its retrieved rule
+    ids are already in the group and the group has fewer than max_size
+    chunks; otherwise it starts a new group. Returns lists of chunk indices.
+    """
+    groups = []
+    group, group_rule_ids = [], set()
+    for index in indices:
+        if group and len(group) < max_size and rule_overlap(rule_ids[index], group_rule_ids) >= min_overlap:
+            group.append(index)
+            group_rule_ids.update(rule_ids[index])
+            continue
+        if group:
+            groups.append(group)
+        group, group_rule_ids = [index], set(rule_ids[index])
+    if group:
+        groups.append(group)
+    return groups
+
+def merge_sections(retrievals):
+    """
+    Union of the rule sections of several retrievals, each section once,
+    in first-seen order. Returns (rule_ids, context).
+    """
+    seen = set()
+    rule_ids, sections = [], []
+    for retrieval in retrievals:
+        for rule_id, section in zip(retrieval["rule_ids"], retrieval["sections"]):
+            if rule_id in seen:
+                continue
+            seen.add(rule_id)
+            rule_ids.append(rule_id)
+            sections.append(section)
+    return rule_ids, "\n\n".join(sections)
+
+def build_batch_message(context: str, chunk_texts) -> str:
+    paragraphs = "\n\n".join(
+        f"Paragraph {number}:\n{chunk_text}" for number, chunk_text in enumerate(chunk_texts, start=1)
+    )
+    return (
+        f"The relevant compliance context from the rules: {context}\n\n"
+        f"{BATCH_INSTRUCTIONS}\n\n"
+        f"Here are the paragraphs to check:\n\n{paragraphs}"
+    )
+
+def parse_batch_response(content: str, count: int):
+    """
+    Parses the structured response of a batched call. Returns a dict of
+    paragraph position (0-based) to comment for every well-formed entry;
+    paragraphs missing from the response are left out.
+    """
+    if not content:
+        return {}
+    # Tolerate a ```json fence around the object
+    content = re.sub(r"^\s*```(?:json)?\s*|\s*```\s*$", "", content)
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return {}
+    entries = data.get("results") if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        return {}
+    comments = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get("comment"), str):
+            continue
+        try:
+            position = int(entry.get("id")) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= position < count and position not in comments:
+            comments[position] = entry["comment"]
+    return comments
+
+class ChatBatchStats:
+    """
+    Counts chat calls and input tokens, against what one call per chunk
+    would have used. Unbatched input tokens of a batched call are estimated
+    from its reported prompt tokens, scaled by the length of the single-chunk
+    prompts it replaced.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.calls = 0
+        self.batched_calls = 0
+        self.fallback_chunks = 0
+        self.input_tokens = 0
+        self.unbatched_input_tokens = 0
+
+    def record(self, chunks: int, input_tokens: int, unbatched_input_tokens: int, batched: bool = False):
+        with self._lock:
+            self.chunks += chunks
+            self.calls += 1
+            self.batched_calls += int(batched)
+            self.input_tokens += input_tokens
+            self.unbatched_input_tokens += unbatched_input_tokens
+
+    def record_fallback(self, chunks: int):
+        with self._lock:
+            self.fallback_chunks += chunks
+
+    def stats(self):
+        with self._lock:
+            return {
+                "chunks": self.chunks,
+                "calls": self.calls,
+                "batched_calls": self.batched_calls,
+                "calls_saved": self.chunks - self.calls,
+                "fallback_chunks": self.fallback_chunks,
+                "input_tokens": self.input_tokens,
+                "unbatched_input_tokens": self.unbatched_input_tokens,
+                "input_tokens_saved": self.unbatched_input_tokens - self.input_tokens,
+            }
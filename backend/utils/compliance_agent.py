@@ -1,4 +1,10 @@
-from openai import AzureOpenAI
+import asyncio
+
+import contextvars
+
+import threading
+
+from openai import AzureOpenAI, AsyncAzureOpenAI
 
 import numpy as np
 
@@ -6,6 +12,24 @@ from tqdm import tqdm
 
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from utils.verdict_cache import verdict_key
+
+from utils.llm_scheduler import LLMScheduler, estimate_tokens
+
+from utils.metrics import CHUNKS, TRIAGE_ROUTES, record_usage, stage, timed_iter
+
+from utils.triage import trim_retrieval
+
+from utils.disclosures import DisclosureIndex, disclosure_note, merge_notes
+
+from utils.near_duplicates import NearDuplicateStore, adapt_comment
+
+from utils.chat_batching import (
+
+    ChatBatchStats, group_by_rules, merge_sections, build_batch_message, parse_batch_response
+
+)
+
  
 
 class ComplianceAgent:
@@ -44,7 +68,45 @@ class ComplianceAgent:
 
                  embeddings_manager,
 
-                 text_processor):
+                 text_processor,
+
+                 max_concurrency: int = 32,
+
+                 embedding_batch_size: int = 256,
+
+                 reuse_sentence_embeddings: bool = True,
+
+                 embedding_cache=None,
+
+                 verdict_cache=None,
+
+                 context_builder=None,
+
+                 chat_batch_size: int = 1,
+
+                 chat_batch_min_overlap: float = 0.6,
+
+                 scheduler=None,
+
+                 stream_window_chars: int = 20000,
+
+                 stream_queue_size: int = 64,
+
+                 stream_max_in_flight: int = None,
+
+                 client=None,
+
+                 async_client=None,
+
+                 triage=None,
+
+                 disclosure_options: dict = None,
+
+                 disclosure_bypass: float = 0.9,
+
+                 near_duplicates=None,
+
+                 near_duplicate_adapt: bool = True):
 
         self.azure_endpoint = azure_endpoint
 
@@ -64,39 +126,297 @@ class ComplianceAgent:
 
  
 
-        # Initialize Azure client
+        # Initialize Azure clients (or share the app's). Retries are left to the scheduler.
+
+        self.client = client or AzureOpenAI(
+
+            azure_endpoint=self.azure_endpoint,
+
+            api_key=self.api_key,
+
+            api_version=self.api_version,
+
+            max_retries=0
+
+        )
 
-        self.client = AzureOpenAI(
+
+
+        # Async client for the event-loop path
+
+        self.async_client = async_client or AsyncAzureOpenAI(
 
             azure_endpoint=self.azure_endpoint,
 
             api_key=self.api_key,
 
-            api_version=self.api_version
+            api_version=self.api_version,
+
+            max_retries=0
 
         )
 
+
+
+        # Every embedding/chat call goes through the scheduler: RPM/TPM
+
+        # budgets, retries with backoff and an adaptive cap on calls in flight
+
+        self.max_concurrency = max_concurrency
+
+        self.scheduler = scheduler or LLMScheduler(max_concurrency=max_concurrency)
+
+
+
+        # Page-streaming pipeline: chunker window, chunks queued between the
+
+        # chunker and the checker, and chunks being checked at once
+
+        self.stream_window_chars = stream_window_chars
+
+        self.stream_queue_size = stream_queue_size
+
+        self.stream_max_in_flight = stream_max_in_flight or 2 * max_concurrency
+
+
+
+        # Chunk embeddings are sent in batches of this many inputs, and the
+
+        # chunker's sentence vectors are reused when available
+
+        self.embedding_batch_size = embedding_batch_size
+
+        self.reuse_sentence_embeddings = reuse_sentence_embeddings
+
+
+
+        # Optional persistent EmbeddingCache shared with the TextProcessor
+
+        self.embedding_cache = embedding_cache
+
+
+
+        # Optional persistent VerdictCache, unchanged chunks reuse their comment
+
+        self.verdict_cache = verdict_cache
+
+
+
+        # Optional ContextBuilder; without it the context is the plain
+
+        # concatenation of all retrieved sections
+
+        self.context_builder = context_builder
+
+
+
+        # Chunks whose retrieved rules overlap are checked together, up to
+
+        # chat_batch_size chunks per call (1 sends every chunk on its own)
+
+        self.chat_batch_size = max(1, chat_batch_size)
+
+        self.chat_batch_min_overlap = chat_batch_min_overlap
+
+        self.chat_stats = ChatBatchStats()
+
+
+
+        # Optional ChunkTriage: trivial chunks skip the model, short and weakly
+
+        # matching ones get a cheaper check
+
+        self.triage = triage
+
+
+
+        # Optional disclosure-presence index over the corpus (options of
+
+        # DisclosureIndex.from_corpus, None disables it), built once per index
+
+        # snapshot. Chunks that are only disclosure text present in full in the
+
+        # document (disclosure_bypass of their words, 0 disables) skip the model.
+
+        self.disclosure_options = disclosure_options
+
+        self.disclosure_bypass = disclosure_bypass
+
+        self._disclosures = (None, None)
+
+        self._disclosure_lock = threading.Lock()
+
+
+
+        # Optional NearDuplicateStore: chunks that differ from an already
+
+        # checked one (same rules) only by names, dates or figures reuse its
+
+        # comment, with those differences replaced when near_duplicate_adapt
+
+        self.near_duplicates = near_duplicates
+
+        self.near_duplicate_adapt = near_duplicate_adapt
+
    
 
+    def _cache_lookup(self, chunks):
+
+        if self.embedding_cache is None:
+
+            return [None] * len(chunks)
+
+        return self.embedding_cache.get_many(chunks, self.embedding_model)
+
+
+
+    def _cache_store(self, chunks, embeddings):
+
+        if self.embedding_cache is not None and chunks:
+
+            self.embedding_cache.put_many(chunks, embeddings, self.embedding_model)
+
+
+
     def create_embedding(self, chunk: str):
 
-        response = self.client.embeddings.create(
+        cached = self._cache_lookup([chunk])[0]
+
+        if cached is not None:
+
+            return cached
+
+        response = self.scheduler.call(
+
+            lambda: self.client.embeddings.create(
 
-            input=chunk,
+                input=chunk,
 
-            model=self.embedding_model
+                model=self.embedding_model
+
+            ),
+
+            self.embedding_model,
+
+            estimate_tokens([chunk]),
+
+            stage_name="embedding"
 
         )
 
+        record_usage(self.embedding_model, getattr(response, "usage", None))
+
         embedding = response.data[0].embedding
 
+        self._cache_store([chunk], [embedding])
+
         return embedding
 
+
+
+    def create_embeddings(self, chunks):
+
+        """
+
+        Embeds a list of texts in as few requests as possible,
+
+        embedding_batch_size inputs per request. Cached texts are not sent.
+
+        Returns vectors in input order.
+
+        """
+
+        embeddings = self._cache_lookup(chunks)
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+        for start in range(0, len(missing), self.embedding_batch_size):
+
+            batch = missing[start:start + self.embedding_batch_size]
+
+            texts = [chunks[i] for i in batch]
+
+            response = self.scheduler.call(
+
+                lambda: self.client.embeddings.create(
+
+                    input=texts,
+
+                    model=self.embedding_model
+
+                ),
+
+                self.embedding_model,
+
+                estimate_tokens(texts),
+
+                stage_name="embedding"
+
+            )
+
+            record_usage(self.embedding_model, getattr(response, "usage", None))
+
+            fresh = [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+            self._cache_store([chunks[i] for i in batch], fresh)
+
+            for i, embedding in zip(batch, fresh):
+
+                embeddings[i] = embedding
+
+        return embeddings
+
+
+
+    def _split_chunk_embeddings(self, chunk_pairs):
+
+        chunks = [chunk for chunk, _ in chunk_pairs]
+
+        if self.reuse_sentence_embeddings:
+
+            embeddings = [embedding for _, embedding in chunk_pairs]
+
+        else:
+
+            embeddings = [None] * len(chunks)
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+        return chunks, embeddings, missing
+
+
+
+    def embed_chunks(self, chunk_pairs):
+
+        """
+
+        Batched embedding stage. Takes the (chunk, embedding) pairs from
+
+        TextProcessor.chunk_document, keeps the vectors the
+
+        chunker already produced and embeds the rest in batched requests.
+
+        Returns (chunks, embeddings).
+
+        """
+
+        chunks, embeddings, missing = self._split_chunk_embeddings(chunk_pairs)
+
+        if missing:
+
+            fresh = self.create_embeddings([chunks[i] for i in missing])
+
+            for i, embedding in zip(missing, fresh):
+
+                embeddings[i] = embedding
+
+        return chunks, embeddings
+
  
 
-    def prompt_model(self, content: str, chunk_text: str):
+    def build_prompt(self, content: str, chunk_text: str):
 
-        chat_prompt = [
+        return [
 
             {
 
@@ -116,15 +436,17 @@ class ComplianceAgent:
 
         ]
 
- 
 
-        completion = self.client.chat.completions.create(
 
-            model=self.chat_model,
+    def chat_params(self, chat_prompt, cheap: bool = False):
+
+        return dict(
+
+            model=self.triage.cheap_model if cheap else self.chat_model,
 
             messages=chat_prompt,
 
-            max_tokens=10000,
+            max_tokens=self.triage.cheap_max_tokens if cheap else 10000,
 
             temperature=0.7,
 
@@ -140,146 +462,1650 @@ class ComplianceAgent:
 
         )
 
- 
 
-        return completion.choices[0].message.content
 
-   
+    @staticmethod
 
-    def process_chunk(self, chunk_text:str):
+    def chat_budget(params):
 
-        """
+        # Azure counts max_tokens against the TPM quota when admitting a request
 
-        Process a single chunk by:
+        return estimate_tokens(message["content"] for message in params["messages"]) + params["max_tokens"]
 
-            1. Creating Embedding
 
-            2. Performing vector search for compliance context
 
-            3. Promting the model for a response
+    def chat(self, params):
 
-        Returns a dict with { chunk: <str>, comment: <str> }
+        completion = self.scheduler.call(
 
-        """
+            lambda: self.client.chat.completions.create(**params),
 
-        embedding = self.create_embedding(chunk_text)
+            params["model"],
 
-        compliance_context = self.embeddings_manager.vector_search(embedding)
+            self.chat_budget(params),
 
-        response = self.prompt_model(compliance_context, chunk_text)
+            stage_name="llm_generation"
 
-        return {
+        )
 
-            "chunk": chunk_text,
+        record_usage(params["model"], getattr(completion, "usage", None))
 
-            "comment": response
+        return completion
 
-        }
 
- 
 
-    def compliance_check(self, text: str):
+    async def achat(self, params):
 
-        """
+        completion = await self.scheduler.acall(
 
-        Main method to run compliance check on the input text.
+            lambda: self.async_client.chat.completions.create(**params),
 
-        1. Split text into chunks
+            params["model"],
 
-        2. For each chunk:
+            self.chat_budget(params),
 
-           - Create embedding
+            stage_name="llm_generation"
 
-           - Retrieve relevant compliance context from FAISS
+        )
 
-           - Prompt the model
+        record_usage(params["model"], getattr(completion, "usage", None))
 
-        Returns a list of (chunk, comment) dicts.
+        return completion
 
-        """
 
-        chunks = self.text_processor.create_chunks(text)
 
-        results = []
+    def build_batch_prompt(self, chunk_texts, retrievals):
 
- 
+        _, content = merge_sections(retrievals)
 
-        for chunk_obj in tqdm(chunks, desc="Checking compliance"):
+        notes = [retrieval["disclosure_note"] for retrieval in retrievals if retrieval.get("disclosure_note")]
 
-            chunk_text = chunk_obj
+        if notes:
 
-            embedding = self.create_embedding(chunk_text)
+            content += "\n\n" + merge_notes(notes)
 
-            compliance_context = self.embeddings_manager.vector_search(embedding)
+        return [
 
-            response = self.prompt_model(compliance_context, chunk_text)
+            {
 
-            results.append({
+                "role": "system",
 
-                "chunk": chunk_text,
+                "content": self.system_prompt
 
-                "comment": response
+            },
 
-            })
+            {
 
-        return results
+                "role": "user",
 
- 
+                "content": build_batch_message(content, chunk_texts)
 
-    def compliance_check1(self, text: str, max_workers = 32):
+            },
 
-        """
+        ]
 
-        Main method to run compliance check on the input text in parallel.
 
-        1. Split text into chunks
 
-        2. For each chunk:
+    def batch_chat_params(self, chat_prompt, cheap: bool = False):
 
-           - Create embedding
+        params = self.chat_params(chat_prompt, cheap)
 
-           - Retrieve relevant compliance context from FAISS
+        params["response_format"] = {"type": "json_object"}
 
-           - Prompt the model
+        return params
+
+
+
+    @staticmethod
+
+    def prompt_tokens(completion, chat_prompt):
+
+        usage = getattr(completion, "usage", None)
+
+        if usage is not None and usage.prompt_tokens is not None:
+
+            return usage.prompt_tokens
+
+        # Rough estimate when the response carries no usage
+
+        return sum(len(message["content"]) for message in chat_prompt) // 4
 
-        Returns a list of (chunk, comment) dicts.
 
-        """
 
-        chunks = self.text_processor.create_chunks(text)
+    def record_batch(self, completion, chat_prompt, chunk_texts, retrievals, comments):
 
-        results = [None] * len(chunks)
+        tokens = self.prompt_tokens(completion, chat_prompt)
+
+        batch_chars = sum(len(message["content"]) for message in chat_prompt)
+
+        single_chars = sum(
+
+            len(message["content"])
+
+            for position in comments
+
+            for message in self.build_prompt(retrievals[position]["context"], chunk_texts[position])
+
+        )
+
+        self.chat_stats.record(len(comments), tokens, round(tokens * single_chars / batch_chars), batched=True)
+
+        if len(comments) < len(chunk_texts):
+
+            self.chat_stats.record_fallback(len(chunk_texts) - len(comments))
+
+
+
+    def prompt_model(self, content: str, chunk_text: str, cheap: bool = False):
+
+        chat_prompt = self.build_prompt(content, chunk_text)
 
  
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        completion = self.chat(self.chat_params(chat_prompt, cheap))
+
+        tokens = self.prompt_tokens(completion, chat_prompt)
 
-            # Start operations
+        self.chat_stats.record(1, tokens, tokens)
 
-            future_to_index = {
+ 
 
-                executor.submit(self.process_chunk, chunk): i
+        return completion.choices[0].message.content
 
-                for i, chunk in enumerate(chunks)
 
-            }
 
-            for future in tqdm(as_completed(future_to_index),
+    def prompt_model_batch(self, chunk_texts, retrievals):
 
-                                total=len(future_to_index),
+        """
 
-                                desc="Checking Compliance"):
+        Checks several chunks in one call, with the union of their rule
 
-                index = future_to_index[future]
+        sections as context. Returns {position in chunk_texts: comment} for
 
-                try:
+        the chunks the response could be parsed for.
 
-                    results[index] = future.result()
+        """
 
-                except Exception as exc:
+        chat_prompt = self.build_batch_prompt(chunk_texts, retrievals)
 
-                    print(f"Chunk '{chunk[:30]}...' generated an execption: {exc}")
+        completion = self.chat(self.batch_chat_params(chat_prompt, self.is_cheap(retrievals[0])))
+
+        comments = parse_batch_response(completion.choices[0].message.content, len(chunk_texts))
+
+        self.record_batch(completion, chat_prompt, chunk_texts, retrievals, comments)
+
+        return comments
 
    
 
-        return results
\ No newline at end of file
+    def retrieve_batch(self, embeddings):
+
+        """
+
+        Retrieves the compliance context for every chunk of a document with one
+
+        batched FAISS search. Rule ids and texts are read from the same index
+
+        snapshot, so an index swap in the middle of a document cannot mix them.
+
+        Returns one {rule_ids, sections, context, best_score} dict per chunk (plus
+
+        the token count and dropped neighbours when a ContextBuilder is set);
+
+        best_score is the top similarity before any cutoff, None without neighbours.
+
+        """
+
+        snapshot = self.embeddings_manager.snapshot
+
+        with stage("faiss_search"):
+
+            neighbours = snapshot.batch_search(embeddings)
+
+        retrievals = []
+
+        with stage("context_build"):
+
+            for chunk_neighbours in neighbours:
+
+                if self.context_builder is not None:
+
+                    retrieval = self.context_builder.build(chunk_neighbours, snapshot.doc_texts, snapshot.file_names)
+
+                else:
+
+                    rule_ids = [neighbour["rule_id"] for neighbour in chunk_neighbours]
+
+                    retrieval = {
+
+                        "rule_ids": rule_ids,
+
+                        "sections": [snapshot.doc_texts[rule_id] for rule_id in rule_ids],
+
+                        "context": snapshot.get_context(rule_ids)
+
+                    }
+
+                retrieval["best_score"] = chunk_neighbours[0]["score"] if chunk_neighbours else None
+
+                retrievals.append(retrieval)
+
+        return retrievals
+
+
+
+    def retrieve_rules(self, chunk_text: str, embedding, retrieval=None):
+
+        """
+
+        Vector search for the chunk (skipped when the retrieval comes from
+
+        retrieve_batch), followed by a verdict cache lookup.
+
+        Returns (retrieval, verdict_key, cached_comment); the key and the
+
+        comment are None when there is no verdict cache or no stored verdict.
+
+        """
+
+        if retrieval is None:
+
+            retrieval = self.retrieve_batch([embedding])[0]
+
+        if self.verdict_cache is None:
+
+            return retrieval, None, None
+
+        key = verdict_key(
+
+            self.system_prompt, self.verdict_model(retrieval), retrieval["rule_ids"], chunk_text, retrieval["context"]
+
+        )
+
+        cached_comment = self.verdict_cache.get(key)
+
+        if cached_comment is not None:
+
+            CHUNKS.inc(outcome="cached")
+
+        return retrieval, key, cached_comment
+
+
+
+    def store_verdict(self, key, comment):
+
+        if key is not None and comment is not None:
+
+            self.verdict_cache.put(key, comment)
+
+
+
+    def verdict_model(self, retrieval) -> str:
+
+        """
+
+        Model a chunk is checked with: the triage's cheap model for cheap checks.
+
+        """
+
+        return self.triage.cheap_model if self.is_cheap(retrieval) else self.chat_model
+
+
+
+    def near_duplicate_scope(self, retrieval) -> bytes:
+
+        return NearDuplicateStore.scope(self.system_prompt, self.verdict_model(retrieval), retrieval["rule_ids"])
+
+
+
+    def reuse_near_duplicate(self, chunk_text: str, retrieval):
+
+        """
+
+        Result reusing the comment of the most similar chunk checked against
+
+        the same rules, when one is at or above the store's threshold;
+
+        otherwise None.
+
+        """
+
+        if self.near_duplicates is None:
+
+            return None
+
+        with stage("near_duplicate_lookup"):
+
+            match = self.near_duplicates.get(chunk_text, self.near_duplicate_scope(retrieval))
+
+        if match is None:
+
+            return None
+
+        comment, replacements = match["comment"], 0
+
+        if self.near_duplicate_adapt:
+
+            comment, replacements = adapt_comment(comment, match["chunk"], chunk_text)
+
+        CHUNKS.inc(outcome="near_duplicate")
+
+        return self.with_records({
+
+            "chunk": chunk_text,
+
+            "comment": comment,
+
+            "cached": True,
+
+            "near_duplicate": {"similarity": match["similarity"], "adapted": replacements}
+
+        }, retrieval)
+
+
+
+    def store_near_duplicate(self, chunk_text: str, retrieval, comment):
+
+        if self.near_duplicates is not None and comment is not None:
+
+            self.near_duplicates.put(chunk_text, self.near_duplicate_scope(retrieval), comment)
+
+
+
+    @staticmethod
+
+    def is_cheap(retrieval) -> bool:
+
+        return retrieval.get("triage", {}).get("route") == "cheap"
+
+
+
+    @staticmethod
+
+    def with_records(result, retrieval):
+
+        """
+
+        Adds the chunk's triage and disclosure records, when those are on,
+
+        to its result.
+
+        """
+
+        for name in ("triage", "disclosures"):
+
+            if name in retrieval:
+
+                result[name] = retrieval[name]
+
+        return result
+
+
+
+    def disclosure_index(self, snapshot=None):
+
+        """
+
+        DisclosureIndex of the snapshot's corpus (default: the current one),
+
+        None when disabled.
+
+        """
+
+        if self.disclosure_options is None:
+
+            return None
+
+        snapshot = snapshot or self.embeddings_manager.snapshot
+
+        with self._disclosure_lock:
+
+            if self._disclosures[0] is not snapshot:
+
+                index = DisclosureIndex.from_corpus(snapshot.doc_texts, snapshot.file_names, **self.disclosure_options)
+
+                self._disclosures = (snapshot, index)
+
+            return self._disclosures[1]
+
+
+
+    def scan_disclosures(self, text: str = None):
+
+        """
+
+        DisclosureScanner of a document, fed with its whole text when given
+
+        (otherwise the caller feeds it), None when the index is disabled.
+
+        """
+
+        index = self.disclosure_index()
+
+        if index is None:
+
+            return None
+
+        scanner = index.scanner()
+
+        if text is not None:
+
+            scanner.feed(text)
+
+            scanner.finish()
+
+        return scanner
+
+
+
+    def annotate_disclosures(self, chunks, retrievals, disclosures, skipped):
+
+        """
+
+        Records the presence of each chunk's rule disclosures in its
+
+        retrieval and adds it to the prompt context. disclosures is the
+
+        DisclosureScanner of the document, or a list with one per chunk when
+
+        the chunks come from several documents. Returns {chunk index: result}
+
+        for the chunks that are only present disclosure text, which are not
+
+        sent to the model: their comment says so and disclosure_text is set.
+
+        """
+
+        bypassed = {}
+
+        if not isinstance(disclosures, list):
+
+            disclosures = [disclosures] * len(chunks)
+
+        for index, (chunk_text, scanner) in enumerate(zip(chunks, disclosures)):
+
+            if index in skipped or scanner is None:
+
+                continue
+
+            retrieval = retrievals[index]
+
+            entries = scanner.for_rules(retrieval["rule_ids"])
+
+            retrieval["disclosures"] = entries
+
+            note = disclosure_note(entries, scanner.index.disclosures, scanner.finished)
+
+            if note:
+
+                retrieval["disclosure_note"] = note
+
+                retrieval["context"] += "\n\n" + note
+
+            if self.disclosure_bypass and scanner.is_disclosure_text(chunk_text, self.disclosure_bypass):
+
+                CHUNKS.inc(outcome="disclosure")
+
+                bypassed[index] = self.with_records({
+
+                    "chunk": chunk_text,
+
+                    "comment": "Disclosure text, not checked.",
+
+                    "cached": False,
+
+                    "disclosure_text": True
+
+                }, retrieval)
+
+        return bypassed
+
+
+
+    def triage_chunks(self, chunks, retrievals):
+
+        """
+
+        Pre-triage (see triage.ChunkTriage) of chunks that have their
+
+        retrieval: records each decision in the retrieval and keeps only the
+
+        best sections for cheap checks. Returns {chunk index: result} for the
+
+        skipped chunks, which are not sent to the model (comment None).
+
+        """
+
+        skipped = {}
+
+        if self.triage is None:
+
+            return skipped
+
+        for index, chunk_text in enumerate(chunks):
+
+            decision = self.triage.decide(chunk_text, retrievals[index]["best_score"])
+
+            TRIAGE_ROUTES.inc(route=decision["route"])
+
+            if decision["route"] == "cheap":
+
+                retrievals[index] = trim_retrieval(retrievals[index], self.triage.cheap_sections)
+
+            retrievals[index]["triage"] = decision
+
+            if decision["route"] == "skip":
+
+                CHUNKS.inc(outcome="skipped")
+
+                skipped[index] = {
+
+                    "chunk": chunk_text,
+
+                    "comment": None,
+
+                    "cached": False,
+
+                    "triage": decision
+
+                }
+
+        return skipped
+
+
+
+    def plan_batches(self, chunks, retrievals, disclosures=None):
+
+        """
+
+        Triages the chunks, adds the presence of their disclosures (when
+
+        DisclosureScanners are given, see annotate_disclosures), looks up
+
+        stored verdicts and near-duplicate comments for the ones to check and
+
+        groups the rest into model calls (see chat_batching.group_by_rules);
+
+        cheap and full checks are never grouped together.
+
+        Returns (cached, groups, keys): cached maps chunk index to its result
+
+        (stored verdicts, near duplicates, skipped chunks and disclosure
+
+        text), groups are lists of chunk indices, keys are the verdict cache
+
+        keys.
+
+        """
+
+        cached = self.triage_chunks(chunks, retrievals)
+
+        cached.update(self.annotate_disclosures(chunks, retrievals, disclosures, cached))
+
+        keys = []
+
+        for index, (chunk_text, retrieval) in enumerate(zip(chunks, retrievals)):
+
+            if index in cached:
+
+                keys.append(None)
+
+                continue
+
+            _, key, cached_comment = self.retrieve_rules(chunk_text, None, retrieval)
+
+            keys.append(key)
+
+            if cached_comment is not None:
+
+                cached[index] = self.with_records({
+
+                    "chunk": chunk_text,
+
+                    "comment": cached_comment,
+
+                    "cached": True
+
+                }, retrieval)
+
+                continue
+
+            near_duplicate = self.reuse_near_duplicate(chunk_text, retrieval)
+
+            if near_duplicate is not None:
+
+                cached[index] = near_duplicate
+
+        pending = [index for index in range(len(chunks)) if index not in cached]
+
+        rule_ids = [retrieval["rule_ids"] for retrieval in retrievals]
+
+        groups = []
+
+        for cheap in (False, True):
+
+            groups.extend(group_by_rules(
+
+                [index for index in pending if self.is_cheap(retrievals[index]) == cheap],
+
+                rule_ids,
+
+                self.chat_batch_size,
+
+                self.chat_batch_min_overlap
+
+            ))
+
+        return cached, groups, keys
+
+
+
+    def retrieve_and_plan(self, chunks, embeddings, disclosures=None):
+
+        """
+
+        retrieve_batch followed by plan_batches, so the async paths can run
+
+        the FAISS search and the cache lookups in one worker thread hop.
+
+        Returns (retrievals, cached, groups, keys).
+
+        """
+
+        retrievals = self.retrieve_batch(embeddings)
+
+        return (retrievals, *self.plan_batches(chunks, retrievals, disclosures))
+
+
+
+    @staticmethod
+
+    def error_result(chunk_text: str, exc: Exception):
+
+        """
+
+        Result entry for a chunk the model could not be reached for
+
+        (retries exhausted or a non-retryable error).
+
+        """
+
+        return {
+
+            "chunk": chunk_text,
+
+            "comment": None,
+
+            "cached": False,
+
+            "error": f"{type(exc).__name__}: {exc}"
+
+        }
+
+
+
+    def finish_group(self, group, chunks, retrievals, keys, comments):
+
+        """
+
+        comments maps each chunk index of the group to its comment, or to the
+
+        exception its call failed with. Only comments are stored as verdicts.
+
+        """
+
+        results = []
+
+        for index in group:
+
+            if isinstance(comments[index], BaseException):
+
+                CHUNKS.inc(outcome="error")
+
+                results.append((index, self.with_records(
+
+                    self.error_result(chunks[index], comments[index]), retrievals[index]
+
+                )))
+
+                continue
+
+            CHUNKS.inc(outcome="checked")
+
+            self.store_verdict(keys[index], comments[index])
+
+            self.store_near_duplicate(chunks[index], retrievals[index], comments[index])
+
+            results.append((index, self.with_records({
+
+                "chunk": chunks[index],
+
+                "comment": comments[index],
+
+                "cached": False
+
+            }, retrievals[index])))
+
+        return results
+
+
+
+    def process_group(self, group, chunks, retrievals, keys):
+
+        """
+
+        Prompts the model for one group from plan_batches: a single-chunk call
+
+        for a group of one, otherwise one batched call. Chunks the batched
+
+        response has no entry for (or all of them, if the batched call fails)
+
+        fall back to single-chunk calls; a failed single call becomes an
+
+        error entry. Returns [(chunk index, result)].
+
+        """
+
+        comments = {}
+
+        if len(group) > 1:
+
+            try:
+
+                batch = self.prompt_model_batch([chunks[i] for i in group], [retrievals[i] for i in group])
+
+                comments = {group[position]: comment for position, comment in batch.items()}
+
+            except Exception as exc:
+
+                print(f"Batched check of chunks {group} failed, checking them one by one: {exc}")
+
+                self.chat_stats.record_fallback(len(group))
+
+        cheap = self.is_cheap(retrievals[group[0]])
+
+        for index in group:
+
+            if index not in comments:
+
+                try:
+
+                    comments[index] = self.prompt_model(retrievals[index]["context"], chunks[index], cheap)
+
+                except Exception as exc:
+
+                    comments[index] = exc
+
+        return self.finish_group(group, chunks, retrievals, keys, comments)
+
+   
+
+    def compliance_check(self, text: str, chunking: str = None):
+
+        """
+
+        Main method to run compliance check on the input text.
+
+        1. Split text into chunks (chunking: "semantic" or "structural",
+
+           default: the TextProcessor's mode)
+
+        2. Embed all chunks in batched requests
+
+        3. Retrieve relevant compliance context for all chunks with one FAISS search
+
+        4. Triage the chunks (when enabled), then reuse the stored verdict or
+
+           prompt the model for each chunk to check
+
+        Returns a list of (chunk, comment, cached) dicts; chunks that could not be
+
+        checked have comment None and an "error". With triage on, every result
+
+        has its "triage" record and skipped chunks have comment None.
+
+        """
+
+        chunk_pairs = self.text_processor.chunk_document(text, chunking)
+
+        chunks, embeddings = self.embed_chunks(chunk_pairs)
+
+        retrievals = self.retrieve_batch(embeddings)
+
+        cached, groups, keys = self.plan_batches(chunks, retrievals, self.scan_disclosures(text))
+
+        results = [cached.get(i) for i in range(len(chunks))]
+
+ 
+
+        for group in tqdm(groups, desc="Checking compliance"):
+
+            for index, result in self.process_group(group, chunks, retrievals, keys):
+
+                results[index] = result
+
+        return results
+
+ 
+
+    def compliance_check1(self, text: str, max_workers = 32, chunking: str = None):
+
+        """
+
+        Main method to run compliance check on the input text in parallel.
+
+        1. Split text into chunks (chunking: "semantic" or "structural",
+
+           default: the TextProcessor's mode)
+
+        2. Embed all chunks in batched requests
+
+        3. Retrieve relevant compliance context for all chunks with one FAISS search
+
+        4. Triage the chunks (when enabled), then reuse the stored verdict or
+
+           prompt the model for each chunk to check
+
+        Returns a list of (chunk, comment, cached) dicts; chunks that could not be
+
+        checked have comment None and an "error". With triage on, every result
+
+        has its "triage" record and skipped chunks have comment None.
+
+        """
+
+        chunk_pairs = self.text_processor.chunk_document(text, chunking)
+
+        chunks, embeddings = self.embed_chunks(chunk_pairs)
+
+        retrievals = self.retrieve_batch(embeddings)
+
+        cached, groups, keys = self.plan_batches(chunks, retrievals, self.scan_disclosures(text))
+
+        results = [cached.get(i) for i in range(len(chunks))]
+
+ 
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+            # Start operations. The scheduler bounds the calls actually in flight.
+
+            future_to_group = {
+
+                executor.submit(self.process_group, group, chunks, retrievals, keys): group
+
+                for group in groups
+
+            }
+
+            for future in tqdm(as_completed(future_to_group),
+
+                                total=len(future_to_group),
+
+                                desc="Checking Compliance"):
+
+                group = future_to_group[future]
+
+                try:
+
+                    for index, result in future.result():
+
+                        results[index] = result
+
+                except Exception as exc:
+
+                    print(f"Chunks {group} generated an exception: {exc}")
+
+                    for index in group:
+
+                        results[index] = self.with_records(self.error_result(chunks[index], exc), retrievals[index])
+
+   
+
+        return results
+
+
+
+    async def acreate_embedding(self, chunk: str):
+
+        return (await self.acreate_embeddings([chunk]))[0]
+
+
+
+    async def acreate_embeddings(self, chunks):
+
+        # Cache reads and writes are SQLite calls, kept off the event loop
+
+        embeddings = await asyncio.to_thread(self._cache_lookup, chunks)
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+        batches = [
+
+            missing[start:start + self.embedding_batch_size]
+
+            for start in range(0, len(missing), self.embedding_batch_size)
+
+        ]
+
+
+
+        async def embed_batch(batch):
+
+            texts = [chunks[i] for i in batch]
+
+            response = await self.scheduler.acall(
+
+                lambda: self.async_client.embeddings.create(
+
+                    input=texts,
+
+                    model=self.embedding_model
+
+                ),
+
+                self.embedding_model,
+
+                estimate_tokens(texts),
+
+                stage_name="embedding"
+
+            )
+
+            record_usage(self.embedding_model, getattr(response, "usage", None))
+
+            fresh = [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+            await asyncio.to_thread(self._cache_store, texts, fresh)
+
+            for i, embedding in zip(batch, fresh):
+
+                embeddings[i] = embedding
+
+
+
+        await asyncio.gather(*(embed_batch(batch) for batch in batches))
+
+        return embeddings
+
+
+
+    async def aembed_chunks(self, chunk_pairs):
+
+        chunks, embeddings, missing = self._split_chunk_embeddings(chunk_pairs)
+
+        if missing:
+
+            fresh = await self.acreate_embeddings([chunks[i] for i in missing])
+
+            for i, embedding in zip(missing, fresh):
+
+                embeddings[i] = embedding
+
+        return chunks, embeddings
+
+
+
+    async def aprompt_model(self, content: str, chunk_text: str, cheap: bool = False):
+
+        chat_prompt = self.build_prompt(content, chunk_text)
+
+        completion = await self.achat(self.chat_params(chat_prompt, cheap))
+
+        tokens = self.prompt_tokens(completion, chat_prompt)
+
+        self.chat_stats.record(1, tokens, tokens)
+
+        return completion.choices[0].message.content
+
+
+
+    async def aprompt_model_batch(self, chunk_texts, retrievals):
+
+        chat_prompt = self.build_batch_prompt(chunk_texts, retrievals)
+
+        completion = await self.achat(self.batch_chat_params(chat_prompt, self.is_cheap(retrievals[0])))
+
+        comments = parse_batch_response(completion.choices[0].message.content, len(chunk_texts))
+
+        self.record_batch(completion, chat_prompt, chunk_texts, retrievals, comments)
+
+        return comments
+
+
+
+    async def aprocess_group(self, group, chunks, retrievals, keys):
+
+        """
+
+        Async version of process_group, fallback calls run concurrently.
+
+        """
+
+        comments = {}
+
+        if len(group) > 1:
+
+            try:
+
+                batch = await self.aprompt_model_batch([chunks[i] for i in group], [retrievals[i] for i in group])
+
+                comments = {group[position]: comment for position, comment in batch.items()}
+
+            except Exception as exc:
+
+                print(f"Batched check of chunks {group} failed, checking them one by one: {exc}")
+
+                self.chat_stats.record_fallback(len(group))
+
+        missing = [index for index in group if index not in comments]
+
+        cheap = self.is_cheap(retrievals[group[0]])
+
+        fallback = await asyncio.gather(*(
+
+            self.aprompt_model(retrievals[index]["context"], chunks[index], cheap) for index in missing
+
+        ), return_exceptions=True)
+
+        comments.update(zip(missing, fallback))
+
+        # Stores the verdicts and near duplicates (SQLite writes) in a worker thread
+
+        return await asyncio.to_thread(self.finish_group, group, chunks, retrievals, keys, comments)
+
+
+
+    async def acompliance_check(self, text: str, chunking: str = None):
+
+        """
+
+        Asyncio-native compliance check, safe to await from request handlers.
+
+        1. Split text into chunks (in a worker thread, the chunker is sync)
+
+        2. Embed all chunks in batched requests
+
+        3. Retrieve relevant compliance context for all chunks with one FAISS search
+
+        4. Triage the chunks (when enabled), reuse stored verdicts and check the
+
+           remaining chunks (batched when chat_batch_size > 1) concurrently,
+
+           bounded by the scheduler
+
+        Returns a list of (chunk, comment, cached) dicts in document order;
+
+        chunks that could not be checked have comment None and an "error".
+
+        With triage on, every result has its "triage" record.
+
+        """
+
+        chunk_pairs = await asyncio.to_thread(self.text_processor.chunk_document, text, chunking)
+
+        chunks, embeddings = await self.aembed_chunks(chunk_pairs)
+
+        disclosures = await asyncio.to_thread(self.scan_disclosures, text)
+
+        # FAISS search (it can page in a memory-mapped index) and SQLite lookups, off the event loop
+
+        retrievals, cached, groups, keys = await asyncio.to_thread(
+
+            self.retrieve_and_plan, chunks, embeddings, disclosures
+
+        )
+
+        results = [cached.get(i) for i in range(len(chunks))]
+
+        for group_results in await asyncio.gather(*(
+
+            self.aprocess_group(group, chunks, retrievals, keys) for group in groups
+
+        )):
+
+            for index, result in group_results:
+
+                results[index] = result
+
+        return results
+
+
+
+    async def astream_compliance_check(self, text: str, chunking: str = None):
+
+        """
+
+        Same pipeline as acompliance_check, but an async generator of events:
+
+            {"type": "progress", "stage": "chunking"}
+
+            {"type": "progress", "stage": "embedding", "total": <n_chunks>}
+
+            {"type": "progress", "stage": "checking", "total": <n_chunks>}
+
+            {"type": "result", "index": <i>, "chunk": ..., "comment": ..., "cached": ...}
+
+        Results are yielded as soon as each chunk finishes, so they can arrive
+
+        out of order; "index" is the chunk's position in the document.
+
+        Closing the generator cancels the chunks still in flight.
+
+        """
+
+        yield {"type": "progress", "stage": "chunking"}
+
+        chunk_pairs = await asyncio.to_thread(self.text_processor.chunk_document, text, chunking)
+
+        yield {"type": "progress", "stage": "embedding", "total": len(chunk_pairs)}
+
+        chunks, embeddings = await self.aembed_chunks(chunk_pairs)
+
+        disclosures = await asyncio.to_thread(self.scan_disclosures, text)
+
+        retrievals, cached, groups, keys = await asyncio.to_thread(
+
+            self.retrieve_and_plan, chunks, embeddings, disclosures
+
+        )
+
+        yield {"type": "progress", "stage": "checking", "total": len(chunks)}
+
+
+
+        for index, result in cached.items():
+
+            yield {"type": "result", "index": index, **result}
+
+
+
+        tasks = [
+
+            asyncio.create_task(self.aprocess_group(group, chunks, retrievals, keys))
+
+            for group in groups
+
+        ]
+
+        try:
+
+            for next_done in asyncio.as_completed(tasks):
+
+                for index, result in await next_done:
+
+                    yield {"type": "result", "index": index, **result}
+
+        finally:
+
+            for task in tasks:
+
+                task.cancel()
+
+
+
+    def dedup_batch(self, documents, retrievals_of, scanners):
+
+        """
+
+        Check units of a multi-document batch. documents holds the chunk
+
+        texts of each document, retrievals_of(text) the retrieval of a chunk
+
+        text. Chunks with the same text (up to whitespace) are one unit, unless
+
+        the presence of their rule disclosures differs between their documents.
+
+        Returns (units, occurrences): units are (chunk text, retrieval copy,
+
+        scanner) in first-seen order, occurrences maps each document's chunks
+
+        to their unit index.
+
+        """
+
+        units, unit_ids, occurrences = [], {}, []
+
+        for chunk_texts, scanner in zip(documents, scanners):
+
+            document_units = []
+
+            for chunk_text in chunk_texts:
+
+                retrieval = retrievals_of(chunk_text)
+
+                key = " ".join(chunk_text.split())
+
+                if scanner is not None:
+
+                    entries = scanner.for_rules(retrieval["rule_ids"])
+
+                    key = (
+
+                        key,
+
+                        disclosure_note(entries, scanner.index.disclosures, scanner.finished),
+
+                        bool(self.disclosure_bypass) and scanner.is_disclosure_text(chunk_text, self.disclosure_bypass)
+
+                    )
+
+                if key not in unit_ids:
+
+                    unit_ids[key] = len(units)
+
+                    units.append((chunk_text, dict(retrieval), scanner))
+
+                document_units.append(unit_ids[key])
+
+            occurrences.append(document_units)
+
+        return units, occurrences
+
+
+
+    async def acompliance_check_batch(self, texts, chunking: str = None):
+
+        """
+
+        Compliance check of several related documents (e.g. the fact sheets of
+
+        a fund family) that share most of their paragraphs:
+
+        1. Chunk all documents concurrently (worker threads)
+
+        2. Embed and search each distinct chunk text once
+
+        3. Check each distinct chunk once (see dedup_batch), with the same
+
+           triage, verdict cache and batching as acompliance_check
+
+        4. Fan the results back out to every document; repeats of a chunk
+
+           already seen in the batch have "duplicate": True
+
+        Returns (results, stats): one result list per document in document
+
+        order, and the chunk counts, dedup ratio and calls saved.
+
+        """
+
+        chunked = await asyncio.gather(*(
+
+            asyncio.to_thread(self.text_processor.chunk_document, text, chunking) for text in texts
+
+        ))
+
+        scanners = await asyncio.gather(*(asyncio.to_thread(self.scan_disclosures, text) for text in texts))
+
+
+
+        # One embedding and search per distinct chunk text, reusing a chunker vector when any occurrence has one
+
+        unique = {}
+
+        for chunk_pairs in chunked:
+
+            for chunk_text, embedding in chunk_pairs:
+
+                key = " ".join(chunk_text.split())
+
+                if key not in unique or unique[key][1] is None:
+
+                    unique[key] = (unique[key][0] if key in unique else chunk_text, embedding)
+
+        unique_texts, embeddings = await self.aembed_chunks(list(unique.values()))
+
+        documents = [[chunk_text for chunk_text, _ in chunk_pairs] for chunk_pairs in chunked]
+
+
+
+        def plan():
+
+            retrievals = dict(zip(unique, self.retrieve_batch(embeddings)))
+
+            units, occurrences = self.dedup_batch(
+
+                documents, lambda chunk_text: retrievals[" ".join(chunk_text.split())], scanners
+
+            )
+
+            unit_chunks = [chunk_text for chunk_text, _, _ in units]
+
+            unit_retrievals = [retrieval for _, retrieval, _ in units]
+
+            return (units, occurrences, unit_chunks, unit_retrievals,
+
+                    *self.plan_batches(unit_chunks, unit_retrievals, [scanner for _, _, scanner in units]))
+
+
+
+        # FAISS search and SQLite lookups in one worker thread hop, off the event loop
+
+        units, occurrences, unit_chunks, unit_retrievals, cached, groups, keys = await asyncio.to_thread(plan)
+
+        unit_results = [cached.get(i) for i in range(len(units))]
+
+        for group_results in await asyncio.gather(*(
+
+            self.aprocess_group(group, unit_chunks, unit_retrievals, keys) for group in groups
+
+        )):
+
+            for index, result in group_results:
+
+                unit_results[index] = result
+
+
+
+        results, seen = [], set()
+
+        for chunk_texts, document_units in zip(documents, occurrences):
+
+            document_results = []
+
+            for chunk_text, unit in zip(chunk_texts, document_units):
+
+                result = {**unit_results[unit], "chunk": chunk_text}
+
+                if unit in seen:
+
+                    result["duplicate"] = True
+
+                seen.add(unit)
+
+                document_results.append(result)
+
+            results.append(document_results)
+
+
+
+        total = sum(len(chunk_texts) for chunk_texts in documents)
+
+        to_embed = sum(1 for chunk_pairs in chunked for _, embedding in chunk_pairs
+
+                       if embedding is None or not self.reuse_sentence_embeddings)
+
+        unique_to_embed = sum(1 for _, embedding in unique.values()
+
+                              if embedding is None or not self.reuse_sentence_embeddings)
+
+        stats = {
+
+            "documents": len(texts),
+
+            "chunks": total,
+
+            "unique_chunks": len(unique),
+
+            "checked_chunks": len(units),
+
+            "dedup_ratio": round(1 - len(units) / total, 3) if total else 0.0,
+
+            "calls_saved": {
+
+                # Embedding inputs (sent in batched requests) and chunk checks
+
+                # (one model call each unless triaged, cached or batched)
+
+                "embedding_inputs": to_embed - unique_to_embed,
+
+                "checks": total - len(units),
+
+                "total": (to_embed - unique_to_embed) + (total - len(units)),
+
+            },
+
+            "searches_saved": total - len(unique),
+
+        }
+
+        return results, stats
+
+
+
+    async def astream_compliance_check_pages(self, pages, chunking: str = None):
+
+        """
+
+        Page-streaming version of astream_compliance_check, for documents too
+
+        large to extract and chunk up front. `pages` is an iterable of page
+
+        texts (e.g. extractor.iter_pages(file_bytes)), consumed in a worker
+
+        thread together with TextProcessor.iter_chunks_with_embeddings.
+
+        The stages are connected by bounded queues:
+
+            pages -> chunker -> [stream_queue_size chunks] -> embed/retrieve
+
+              -> [stream_max_in_flight chunks being checked] -> results
+
+        A chunk holds its in-flight slot until its result has been consumed
+
+        from this generator, so when the checker or the reader falls behind,
+
+        the queue fills up and the extraction thread blocks. Memory stays
+
+        bounded and the first results arrive while later pages are still
+
+        being extracted.
+
+        Yields the same events as astream_compliance_check; the "checking"
+
+        progress event is sent with total None when the first chunks are
+
+        checked and again with the final total once chunking is done.
+
+        """
+
+        loop = asyncio.get_running_loop()
+
+        chunk_queue = asyncio.Queue(maxsize=self.stream_queue_size)
+
+        events = asyncio.Queue()
+
+        in_flight = asyncio.Semaphore(self.stream_max_in_flight)
+
+        # Chunks are taken off the queue in batches for the embedding request
+
+        batch_size = min(self.embedding_batch_size, self.stream_max_in_flight)
+
+        group_tasks = []
+
+        stop = threading.Event()
+
+        done = object()
+
+        # Fed with the pages as they are extracted, statuses are final once
+
+        # the last page has been read
+
+        disclosures = self.scan_disclosures()
+
+
+
+        def put(item):
+
+            if not stop.is_set():
+
+                asyncio.run_coroutine_threadsafe(chunk_queue.put(item), loop).result()
+
+
+
+        def produce():
+
+            try:
+
+                page_texts = timed_iter(pages, "extraction")
+
+                if disclosures is not None:
+
+                    page_texts = disclosures.feed_pages(page_texts)
+
+                chunk_pairs = self.text_processor.iter_chunks_with_embeddings(
+
+                    page_texts, self.stream_window_chars, mode=chunking
+
+                )
+
+                for chunk_pair in chunk_pairs:
+
+                    if stop.is_set():
+
+                        return
+
+                    put(chunk_pair)
+
+                put(done)
+
+            except Exception as exc:
+
+                put(exc)
+
+
+
+        async def check_group(group, chunks, retrievals, keys, offset):
+
+            for index, result in await self.aprocess_group(group, chunks, retrievals, keys):
+
+                events.put_nowait({"type": "result", "index": offset + index, **result})
+
+
+
+        async def consume():
+
+            total = 0
+
+            finished = False
+
+            while not finished:
+
+                batch = [await chunk_queue.get()]
+
+                # Embed whatever else is already waiting in the same request
+
+                while len(batch) < batch_size and not chunk_queue.empty():
+
+                    batch.append(chunk_queue.get_nowait())
+
+                if isinstance(batch[-1], Exception):
+
+                    raise batch[-1]
+
+                if batch[-1] is done:
+
+                    finished = True
+
+                    batch.pop()
+
+                if not batch:
+
+                    continue
+
+                # Wait for room before taking on more chunks, this is what
+
+                # pushes back on the chunker and the extractor
+
+                for _ in batch:
+
+                    await in_flight.acquire()
+
+                if total == 0:
+
+                    events.put_nowait({"type": "progress", "stage": "embedding", "total": None})
+
+                chunks, embeddings = await self.aembed_chunks(batch)
+
+                retrievals, cached, groups, keys = await asyncio.to_thread(
+
+                    self.retrieve_and_plan, chunks, embeddings, disclosures
+
+                )
+
+                if total == 0:
+
+                    events.put_nowait({"type": "progress", "stage": "checking", "total": None})
+
+                for index, result in cached.items():
+
+                    events.put_nowait({"type": "result", "index": total + index, **result})
+
+                group_tasks.extend(
+
+                    asyncio.create_task(check_group(group, chunks, retrievals, keys, total))
+
+                    for group in groups
+
+                )
+
+                total += len(chunks)
+
+            events.put_nowait({"type": "progress", "stage": "checking", "total": total})
+
+            await asyncio.gather(*group_tasks)
+
+
+
+        async def run():
+
+            try:
+
+                await consume()
+
+                events.put_nowait(done)
+
+            except Exception as exc:
+
+                events.put_nowait(exc)
+
+
+
+        yield {"type": "progress", "stage": "chunking"}
+
+        # Own thread rather than the default executor, it lives as long as the document
+
+        # with this request's context, so its stages count towards the request's timings
+
+        threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True).start()
+
+        consumer = asyncio.create_task(run())
+
+        try:
+
+            while True:
+
+                event = await events.get()
+
+                if event is done:
+
+                    break
+
+                if isinstance(event, Exception):
+
+                    raise event
+
+                yield event
+
+                if event["type"] == "result":
+
+                    in_flight.release()
+
+        finally:
+
+            consumer.cancel()
+
+            for task in group_tasks:
+
+                task.cancel()
+
+            # The producer stops at its next chunk; emptying the queue
+
+            # unblocks a put it may be waiting on
+
+            stop.set()
+
+            while not chunk_queue.empty():
+
+                chunk_queue.get_nowait()
\ No newline at end of file
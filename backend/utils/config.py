@@ -20,4 +20,134 @@ class Config:
 
         self.deployment = os.getenv("AZURE_MODEL_NAME")
 
-        self.api_version = "2024-06-01"
\ No newline at end of file
+        self.api_version = "2024-06-01"
+
+        self.max_concurrency = int(os.getenv("MAX_CONCURRENCY", "32"))
+
+        self.embedding_batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+
+        self.embedding_cache_path = os.getenv("EMBEDDING_CACHE_PATH", "embeddings/embedding_cache.sqlite")
+
+        self.embedding_cache_max_mb = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+
+        self.embedding_cache_dtype = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")
+
+        self.verdict_cache_path = os.getenv("VERDICT_CACHE_PATH", "embeddings/verdict_cache.sqlite")
+
+        self.verdict_cache_max_entries = int(os.getenv("VERDICT_CACHE_MAX_ENTRIES", "200000"))
+
+        self.job_workers = int(os.getenv("JOB_WORKERS", "4"))
+
+        self.job_queue_size = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+
+        self.job_upload_dir = os.getenv("JOB_UPLOAD_DIR", "uploads")
+
+        self.corpus_store_path = os.getenv("CORPUS_STORE_PATH", "embeddings/test_case_2.corpus")
+
+        self.faiss_index_type = os.getenv("FAISS_INDEX_TYPE", "flat")
+
+        self.faiss_nprobe = int(os.getenv("FAISS_NPROBE", "16"))
+
+        self.faiss_ef_search = int(os.getenv("FAISS_EF_SEARCH", "128"))
+
+        self.faiss_mmap = os.getenv("FAISS_MMAP", "false").lower() == "true"
+
+        self.admin_token = os.getenv("ADMIN_TOKEN")
+
+        # Seconds between checks for an index saved by another worker (rule additions, rebuilds)
+
+        self.index_reload_interval = float(os.getenv("INDEX_RELOAD_INTERVAL", "1.0"))
+
+        self.context_min_score = float(os.getenv("CONTEXT_MIN_SCORE", "0.75"))
+
+        self.context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+
+        self.context_overlap_threshold = float(os.getenv("CONTEXT_OVERLAP_THRESHOLD", "0.8"))
+
+        self.chat_batch_size = int(os.getenv("CHAT_BATCH_SIZE", "1"))
+
+        self.chat_batch_min_overlap = float(os.getenv("CHAT_BATCH_MIN_OVERLAP", "0.6"))
+
+        self.min_concurrency = int(os.getenv("MIN_CONCURRENCY", "1"))
+
+        self.llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", "6"))
+
+        self.chat_rpm = int(os.getenv("CHAT_RPM", "0"))
+
+        self.chat_tpm = int(os.getenv("CHAT_TPM", "0"))
+
+        self.embedding_rpm = int(os.getenv("EMBEDDING_RPM", "0"))
+
+        self.embedding_tpm = int(os.getenv("EMBEDDING_TPM", "0"))
+
+        self.pdf_extract_workers = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+
+        self.pdf_parallel_min_pages = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+
+        self.stream_window_chars = int(os.getenv("STREAM_WINDOW_CHARS", "20000"))
+
+        self.stream_queue_size = int(os.getenv("STREAM_QUEUE_SIZE", "64"))
+
+        self.stream_max_in_flight = int(os.getenv("STREAM_MAX_IN_FLIGHT", "0")) or None
+
+        self.chunking_mode = os.getenv("CHUNKING_MODE", "semantic")
+
+        self.structural_min_chars = int(os.getenv("STRUCTURAL_MIN_CHARS", "200"))
+
+        self.structural_max_chars = int(os.getenv("STRUCTURAL_MAX_CHARS", "1500"))
+
+        self.embedding_check_ctx_length = os.getenv("EMBEDDING_CHECK_CTX_LENGTH", "true").lower() == "true"
+
+        self.max_upload_mb = int(os.getenv("MAX_UPLOAD_MB", "200"))
+
+        self.upload_spool_dir = os.getenv("UPLOAD_SPOOL_DIR", "")
+
+        self.startup_warmup = os.getenv("STARTUP_WARMUP", "false").lower() == "true"
+
+        self.triage = os.getenv("TRIAGE", "false").lower() == "true"
+
+        self.triage_min_words = int(os.getenv("TRIAGE_MIN_WORDS", "4"))
+
+        # Similarities of text-embedding-ada-002, which puts even unrelated text around 0.7-0.75;
+
+        # retune both scores for another embedding model
+
+        self.triage_skip_score = float(os.getenv("TRIAGE_SKIP_SCORE", "0.75"))
+
+        self.triage_numeric_density = float(os.getenv("TRIAGE_NUMERIC_DENSITY", "0.1"))
+
+        self.triage_cheap_max_chars = int(os.getenv("TRIAGE_CHEAP_MAX_CHARS", "200"))
+
+        self.triage_full_min_score = float(os.getenv("TRIAGE_FULL_MIN_SCORE", "0.8"))
+
+        # Deployment of a cheaper chat model (e.g. gpt-4o-mini); cheap routing is off while unset
+
+        self.triage_cheap_model = os.getenv("TRIAGE_CHEAP_MODEL", "")
+
+        self.triage_cheap_max_tokens = int(os.getenv("TRIAGE_CHEAP_MAX_TOKENS", "800"))
+
+        self.triage_cheap_sections = int(os.getenv("TRIAGE_CHEAP_SECTIONS", "3"))
+
+        self.disclosure_index = os.getenv("DISCLOSURE_INDEX", "false").lower() == "true"
+
+        self.disclosure_min_words = int(os.getenv("DISCLOSURE_MIN_WORDS", "12"))
+
+        self.disclosure_shingle = int(os.getenv("DISCLOSURE_SHINGLE", "5"))
+
+        self.disclosure_present = float(os.getenv("DISCLOSURE_PRESENT", "0.9"))
+
+        self.disclosure_near = float(os.getenv("DISCLOSURE_NEAR", "0.5"))
+
+        self.disclosure_bypass = float(os.getenv("DISCLOSURE_BYPASS", "0.9"))
+
+        self.batch_max_files = int(os.getenv("BATCH_MAX_FILES", "100"))
+
+        self.batch_extract_concurrency = int(os.getenv("BATCH_EXTRACT_CONCURRENCY", "4"))
+
+        self.near_duplicate_path = os.getenv("NEAR_DUPLICATE_PATH", "")
+
+        self.near_duplicate_threshold = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+
+        self.near_duplicate_max_entries = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "2000000"))
+
+        self.near_duplicate_adapt = os.getenv("NEAR_DUPLICATE_ADAPT", "true").lower() == "true"
\ No newline at end of file
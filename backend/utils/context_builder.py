@@ -0,0 +1,131 @@
+import re
+from functools import lru_cache
+
+def get_encoding(model: str):
+    """
+    The model's tiktoken encoding, or None when tiktoken is not installed or
+    its encoding file cannot be loaded (it is downloaded on first use, which
+    fails offline); token counts are then estimated from the text length.
+    """
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # gpt-4o family tokenizer
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as exc:
+        print(f"No tokenizer for {model}, estimating token counts: {type(exc).__name__}: {exc}")
+        return None
+
+@lru_cache(maxsize=8192)
+def _shingles(text: str, size: int = 5):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return frozenset([" ".join(words)]) if words else frozenset()
+    return frozenset(" ".join(words[i:i + size]) for i in range(len(words) - size + 1))
+
+def overlap(text_a: str, text_b: str) -> float:
+    """
+    Share of the smaller text's word 5-gram shingles found in the other one.
+    1.0 for duplicates and for a section contained in another.
+    """
+    a, b = _shingles(text_a), _shingles(text_b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+class ContextBuilder:
+    """
+    Assembles the compliance context for one chunk from its FAISS neighbours:
+      1. drops neighbours whose similarity is below min_score (keeping at least min_keep)
+      2. drops sections that overlap an already selected, higher scoring one
+      3. adds sections in score order, each with a source label, until
+         token_budget tokens (counted with the chat model's tokenizer) are used;
+         the best section is always kept, cut to token_budget if it is longer
+    The tokenizer is loaded on first use.
+    """
+    def __init__(self, chat_model: str = "gpt-4o", min_score: float = 0.75, token_budget: int = 3000,
+                 overlap_threshold: float = 0.8, min_keep: int = 1):
+        self.chat_model = chat_model
+        self._encoding = None
+        self.min_score = min_score
+        self.token_budget = token_budget
+        self.overlap_threshold = overlap_threshold
+        self.min_keep = min_keep
+        self._count_tokens = lru_cache(maxsize=8192)(self._measure)
+
+    @property
+    def encoding(self):
+        if self._encoding is None:
+            # Kept in a tuple so a missing tokenizer (None) is only looked up once
+            self._encoding = (get_encoding(self.chat_model),)
+        return self._encoding[0]
+
+    def _measure(self, text: str) -> int:
+        if self.encoding is None:
+            # ~4 characters per token
+            return len(text) // 4 + 1
+        return len(self.encoding.encode(text))
+
+    def count_tokens(self, text: str) -> int:
+        return self._count_tokens(text)
+
+    def truncate(self, text: str, tokens: int) -> str:
+        """
+        The start of text, at most `tokens` tokens long.
+        """
+        if self.encoding is None:
+            return text[:max(0, tokens - 1) * 4]
+        return self.encoding.decode(self.encoding.encode(text)[:tokens])
+
+    @staticmethod
+    def format_section(rule_id: int, score: float, file_name: str, text: str) -> str:
+        return f"[Source: {file_name} | section {rule_id} | similarity {score:.2f}]\n{text.strip()}"
+
+    def build(self, neighbours, doc_texts, file_names):
+        """
+        Takes one chunk's neighbours ({"rule_id", "score"} sorted by score) and the
+        corpus texts. Returns {rule_ids, context, tokens, dropped, truncated}, where dropped
+        counts the neighbours removed by the score cutoff, deduplication and budget,
+        and truncated tells whether the best section was cut to fit the budget.
+        """
+        candidates = [
+            neighbour for i, neighbour in enumerate(neighbours)
+            if neighbour["score"] >= self.min_score or i < self.min_keep
+        ]
+        dropped = {"low_score": len(neighbours) - len(candidates), "duplicate": 0, "budget": 0}
+
+        selected_ids, selected_texts, sections = [], [], []
+        tokens = 0
+        truncated = False
+        for neighbour in candidates:
+            rule_id = neighbour["rule_id"]
+            text = doc_texts[rule_id]
+            if any(overlap(text, kept) >= self.overlap_threshold for kept in selected_texts):
+                dropped["duplicate"] += 1
+                continue
+            section = self.format_section(rule_id, neighbour["score"], file_names[rule_id], text)
+            # +2 for the blank line between sections
+            section_tokens = self.count_tokens(section) + 2
+            if not sections and section_tokens > self.token_budget:
+                # Never send a chunk without any rule, keep the start of the best section
+                section = self.truncate(section, max(1, self.token_budget - 2))
+                section_tokens = self.count_tokens(section) + 2
+                truncated = True
+            elif tokens + section_tokens > self.token_budget:
+                dropped["budget"] += 1
+                continue
+            tokens += section_tokens
+            selected_ids.append(rule_id)
+            selected_texts.append(text)
+            sections.append(section)
+
+        return {
+            "rule_ids": selected_ids,
+            "sections": sections,
+            "context": "\n\n".join(sections),
+            "tokens": tokens,
+            "dropped": dropped,
+            "truncated": truncated,
+        }
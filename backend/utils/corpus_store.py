@@ -0,0 +1,258 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+
+TEXT_FIELDS = ["doc_texts", "chunk_summaries", "file_names"]
+JSON_KEYS = {"doc_texts": "doc_text", "chunk_summaries": "chunk_summary", "file_names": "file_name"}
+
+class MappedTexts:
+    """
+    Read-only, list-like view over an offset-indexed UTF-8 blob.
+    `<name>.bin` holds the concatenated strings and `<name>.offsets.npy`
+    the n+1 byte offsets; both are memory-mapped, so strings are decoded on
+    access and the pages are shared between processes through the page cache.
+    With `count`, only the first count strings are visible.
+    """
+    def __init__(self, blob_path: str, offsets_path: str, count: int = None):
+        self._offsets = np.load(offsets_path, mmap_mode="r")
+        if count is not None:
+            self._offsets = self._offsets[:count + 1]
+        if os.path.getsize(blob_path) > 0:
+            self._blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            self._blob = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("text index out of range")
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return self._blob[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+def write_texts(texts, blob_path: str, offsets_path: str):
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    with open(blob_path, "wb") as f:
+        for i, text in enumerate(texts):
+            encoded = text.encode("utf-8")
+            f.write(encoded)
+            offsets[i + 1] = offsets[i] + len(encoded)
+    np.save(offsets_path, offsets)
+
+def write_corpus_store(store_path: str, embeddings, doc_texts, chunk_summaries, file_names, source: dict = None):
+    """
+    Writes a corpus store directory:
+        vectors.npy                      float32 (n x dim) embedding matrix
+        <field>.bin / <field>.offsets.npy  doc_texts, chunk_summaries, file_names
+        meta.json                        row count, dimension, source file fingerprint
+    An existing store is replaced by renaming a fully written directory
+    over it, files that are still memory-mapped are never truncated.
+    """
+    final_path = store_path
+    store_path = f"{final_path}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(store_path)
+    vectors = np.asarray(embeddings, dtype="float32")
+    np.save(os.path.join(store_path, "vectors.npy"), vectors)
+    fields = {"doc_texts": doc_texts, "chunk_summaries": chunk_summaries, "file_names": file_names}
+    for name, texts in fields.items():
+        write_texts(
+            texts,
+            os.path.join(store_path, f"{name}.bin"),
+            os.path.join(store_path, f"{name}.offsets.npy")
+        )
+    meta = {
+        "count": int(vectors.shape[0]),
+        "dimension": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+        "dtype": "float32",
+        "source": source,
+    }
+    # Written last, a store without meta.json is incomplete
+    with open(os.path.join(store_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    old_path = None
+    if os.path.exists(final_path):
+        old_path = f"{final_path}.old-{uuid.uuid4().hex}"
+        os.rename(final_path, old_path)
+    os.rename(store_path, final_path)
+    if old_path:
+        # Unlinking keeps existing mappings of the old files valid
+        shutil.rmtree(old_path, ignore_errors=True)
+
+def _write_meta(store_path: str, meta: dict):
+    tmp_file = os.path.join(store_path, "meta.json.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, os.path.join(store_path, "meta.json"))
+
+def _append_vectors(vectors_path: str, vectors, count: int):
+    """
+    Appends rows to the (count x dim) vectors.npy in place: anything past
+    the first count rows (left by an interrupted append) is dropped, the rows
+    are written at the end and the header is rewritten with the new shape.
+    numpy pads .npy headers so the first dimension can grow without changing
+    the header's length; when it would change, the file is rewritten instead.
+    """
+    with open(vectors_path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+        data_offset = f.tell()
+        header = io.BytesIO()
+        descriptor = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False,
+                      "shape": (count + len(vectors), shape[1])}
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(header, descriptor)
+        else:
+            np.lib.format.write_array_header_2_0(header, descriptor)
+        if len(header.getvalue()) == data_offset:
+            f.truncate(data_offset + count * shape[1] * dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(vectors, dtype=dtype).tobytes())
+            f.flush()
+            f.seek(0)
+            f.write(header.getvalue())
+            return
+    existing = np.load(vectors_path, mmap_mode="r")[:count]
+    tmp_file = f"{vectors_path}.tmp.npy"
+    np.save(tmp_file, np.concatenate([existing, vectors.astype(existing.dtype)]))
+    del existing
+    os.replace(tmp_file, vectors_path)
+
+def append_corpus_store(store_path: str, embeddings, doc_texts, chunk_summaries, file_names) -> dict:
+    """
+    Appends rows to a corpus store without rewriting it: the vectors and the
+    text blobs are appended to, the offsets files (8 bytes per row) replaced.
+    meta.json is replaced last and its count is what readers see, so a store
+    opened during or after an interrupted append is the previous version.
+    Rows keep their positions, and mappings of the store stay valid.
+    The JSON file the store was converted from is not updated: the rows
+    are lost if the store is converted again from a changed JSON file.
+    Returns the new meta.
+    """
+    with open(os.path.join(store_path, "meta.json"), "r") as f:
+        meta = json.load(f)
+    count = meta["count"]
+    vectors = np.asarray(embeddings, dtype="float32")
+    if vectors.ndim != 2 or vectors.shape[1] != meta["dimension"]:
+        raise ValueError(f"Expected embeddings of dimension {meta['dimension']}, got shape {vectors.shape}")
+    _append_vectors(os.path.join(store_path, "vectors.npy"), vectors, count)
+
+    fields = {"doc_texts": doc_texts, "chunk_summaries": chunk_summaries, "file_names": file_names}
+    for name, texts in fields.items():
+        offsets_path = os.path.join(store_path, f"{name}.offsets.npy")
+        offsets = np.load(offsets_path)[:count + 1]
+        added = np.zeros(len(texts), dtype=np.int64)
+        with open(os.path.join(store_path, f"{name}.bin"), "r+b") as f:
+            f.truncate(int(offsets[-1]))
+            f.seek(0, os.SEEK_END)
+            end = int(offsets[-1])
+            for i, text in enumerate(texts):
+                encoded = text.encode("utf-8")
+                f.write(encoded)
+                end += len(encoded)
+                added[i] = end
+        tmp_file = f"{offsets_path}.tmp.npy"
+        np.save(tmp_file, np.concatenate([offsets, added]))
+        os.replace(tmp_file, offsets_path)
+
+    digest = hashlib.sha256(corpus_hash(meta).encode("utf-8"))
+    digest.update(vectors.tobytes())
+    for texts in fields.values():
+        for text in texts:
+            digest.update(text.encode("utf-8") + b"\0")
+    meta = {**meta, "count": count + len(vectors), "hash": digest.hexdigest()}
+    _write_meta(store_path, meta)
+    return meta
+
+def corpus_hash(meta: dict) -> str:
+    """
+    Fingerprint of the store's rows: the source file's sha256, chained with
+    the rows appended since the conversion.
+    """
+    return meta.get("hash") or meta["source"]["sha256"]
+
+def convert_json_corpus(json_path: str, store_path: str):
+    """
+    Converts the JSON embeddings corpus (a list of {embedding, chunk_summary,
+    doc_text, file_name} items) to a corpus store. The JSON file's sha256,
+    size and mtime are kept in meta.json as the corpus fingerprint.
+    """
+    stat = os.stat(json_path)
+    with open(json_path, "rb") as f:
+        raw = f.read()
+    source = {
+        "path": os.path.abspath(json_path),
+        "sha256": hashlib.sha256(raw).hexdigest(),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+    data = json.loads(raw)
+    del raw
+    fields = {name: [item[key] for item in data] for name, key in JSON_KEYS.items()}
+    embeddings = np.array([item["embedding"] for item in data], dtype="float32")
+    del data
+    write_corpus_store(store_path, embeddings, source=source, **fields)
+
+def corpus_store_exists(store_path: str) -> bool:
+    return os.path.isfile(os.path.join(store_path, "meta.json"))
+
+def corpus_store_is_current(store_path: str, json_path: str) -> bool:
+    """
+    True when the store exists and was converted from the JSON file as it is
+    now (same size and mtime). Without the JSON file the store is the corpus.
+    """
+    if not corpus_store_exists(store_path):
+        return False
+    if not json_path or not os.path.isfile(json_path):
+        return True
+    with open(os.path.join(store_path, "meta.json"), "r") as f:
+        source = json.load(f).get("source") or {}
+    stat = os.stat(json_path)
+    return source.get("size") == stat.st_size and source.get("mtime_ns") == stat.st_mtime_ns
+
+class CorpusStore:
+    """
+    Memory-mapped corpus: `vectors` is an np.memmap'd (n x dim) float32 array
+    and `doc_texts`, `chunk_summaries`, `file_names` are MappedTexts.
+    Opening a store only maps the files, nothing is parsed or copied.
+    """
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        with open(os.path.join(store_path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        count = self.meta["count"]
+        # The files can hold rows of an append that has not been committed to meta.json yet
+        self.vectors = np.load(os.path.join(store_path, "vectors.npy"), mmap_mode="r")[:count]
+        for name in TEXT_FIELDS:
+            setattr(self, name, MappedTexts(
+                os.path.join(store_path, f"{name}.bin"),
+                os.path.join(store_path, f"{name}.offsets.npy"),
+                count
+            ))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a JSON embeddings corpus to a memory-mapped corpus store.")
+    parser.add_argument("json_path", help="e.g. embeddings/test_case_2.json")
+    parser.add_argument("store_path", help="output directory, e.g. embeddings/test_case_2.corpus")
+    args = parser.parse_args()
+    convert_json_corpus(args.json_path, args.store_path)
+    store = CorpusStore(args.store_path)
+    print(f"Wrote {store.meta['count']} rows of dimension {store.meta['dimension']} to {args.store_path}")
@@ -0,0 +1,279 @@
+import re
+import threading
+import unicodedata
+import numpy as np
+from utils.metrics import stage
+
+STATUSES = ["present", "near", "absent"]
+
+_WORD = re.compile(r"\w+")
+# Quoted passages (straight or curly quotes) and "Disclosure:" style labels
+_QUOTED = re.compile(r"[\"“”]([^\"“”]+)[\"“”]")
+_LABELLED = re.compile(r"(?:required\s+)?(?:disclosure|disclaimer|legend)\s*:\s*(.+?)(?:\n\s*\n|$)",
+                       re.IGNORECASE | re.DOTALL)
+# Odd 64-bit base of the rolling hash (arithmetic wraps modulo 2**64)
+_BASE = np.uint64(0x9E3779B97F4A7C15)
+
+def words(text: str):
+    """
+    Lowercased words of NFKC-normalized text, so case, punctuation, line
+    breaks and ligatures from PDF extraction do not matter.
+    """
+    return _WORD.findall(unicodedata.normalize("NFKC", text).lower())
+
+def extract_disclosures(doc_texts, file_names, min_words: int = 12):
+    """
+    Finds the disclosure passages in the rule sections of the corpus: quoted
+    passages and text after a "Disclosure:" / "Disclaimer:" / "Legend:"
+    label, of at least min_words words. Returns
+    [{"disclosure_id", "rule_id", "file_name", "text"}], each text once.
+    """
+    disclosures, seen = [], set()
+    for rule_id, doc_text in enumerate(doc_texts):
+        candidates = [match.group(1) for match in _QUOTED.finditer(doc_text)]
+        candidates += [match.group(1) for match in _LABELLED.finditer(doc_text)]
+        for candidate in candidates:
+            text = " ".join(candidate.split())
+            key = " ".join(words(text))
+            if len(key.split()) < min_words or key in seen:
+                continue
+            seen.add(key)
+            disclosures.append({
+                "disclosure_id": len(disclosures),
+                "rule_id": rule_id,
+                "file_name": file_names[rule_id],
+                "text": text,
+            })
+    return disclosures
+
+class DisclosureIndex:
+    """
+    Shingled word n-gram index over disclosure passages. Every run of
+    `shingle` consecutive words of a disclosure is hashed (a polynomial
+    rolling hash over word ids); scanning a text hashes all its word runs
+    with numpy and looks them up at once, so a scan is linear in the text
+    and does not depend on the number of disclosures.
+
+    A disclosure's coverage is the share of its distinct shingles found in
+    the scanned text: present at >= present_threshold, near (reworded,
+    truncated or split) at >= near_threshold, absent below.
+    """
+    def __init__(self, disclosures, shingle: int = 5, present_threshold: float = 0.9,
+                 near_threshold: float = 0.5):
+        self.disclosures = disclosures
+        self.shingle = shingle
+        self.present_threshold = present_threshold
+        self.near_threshold = near_threshold
+        self.vocabulary = {}
+        self.by_rule = {}
+        self.postings = {}
+        self.shingle_counts = np.zeros(len(disclosures), dtype=np.int64)
+        for disclosure in disclosures:
+            ids = [self.vocabulary.setdefault(word, len(self.vocabulary) + 1) for word in words(disclosure["text"])]
+            hashes = np.unique(self._hashes(np.array(ids, dtype=np.uint64)))
+            disclosure_id = disclosure["disclosure_id"]
+            self.shingle_counts[disclosure_id] = len(hashes)
+            self.by_rule.setdefault(disclosure["rule_id"], []).append(disclosure_id)
+            for value in hashes.tolist():
+                self.postings.setdefault(value, []).append(disclosure_id)
+        self.shingle_hashes = np.array(sorted(self.postings), dtype=np.uint64)
+
+    @classmethod
+    def from_corpus(cls, doc_texts, file_names, min_words: int = 12, **options):
+        return cls(extract_disclosures(doc_texts, file_names, min_words), **options)
+
+    def _hashes(self, ids):
+        """
+        Hash of every run of `shingle` word ids (all of them if fewer).
+        """
+        size = min(self.shingle, len(ids))
+        if size == 0:
+            return np.zeros(0, dtype=np.uint64)
+        count = len(ids) - size + 1
+        hashes = np.zeros(count, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for offset in range(size):
+                hashes = hashes * _BASE + ids[offset:offset + count]
+        return hashes
+
+    def _text_hashes(self, text: str):
+        """
+        Hashes of the word runs of a text that only contain words of some
+        disclosure (other runs cannot match), and the number of runs.
+        """
+        ids = np.fromiter((self.vocabulary.get(word, 0) for word in words(text)), dtype=np.uint64)
+        if len(ids) < self.shingle:
+            # A text shorter than a shingle is a single run
+            known = np.full(min(1, len(ids)), not (ids == 0).any())
+        else:
+            unknown = np.concatenate(([0], np.cumsum(ids == 0)))
+            known = (unknown[self.shingle:] - unknown[:-self.shingle]) == 0
+        return self._hashes(ids)[known], len(known)
+
+    def matches(self, text: str):
+        """
+        Distinct disclosure shingles found in text, and the share of the
+        text's word runs that belong to some disclosure.
+        """
+        hashes, total = self._text_hashes(text)
+        found = hashes[np.isin(hashes, self.shingle_hashes)]
+        return set(found.tolist()), len(found) / max(1, total)
+
+    def scanner(self):
+        return DisclosureScanner(self)
+
+    def status(self, coverage: float) -> str:
+        if coverage >= self.present_threshold:
+            return "present"
+        if coverage >= self.near_threshold:
+            return "near"
+        return "absent"
+
+class DisclosureScanner:
+    """
+    Presence of the indexed disclosures in one document. Text is fed whole
+    or piece by piece (pages as they are extracted, from another thread);
+    until finish() is called, absent only means "not found so far".
+    """
+    def __init__(self, index: DisclosureIndex):
+        self.index = index
+        self.matched = np.zeros(len(index.disclosures), dtype=np.int64)
+        self.finished = False
+        self._seen = set()
+        self._carry = ""
+        self._lock = threading.Lock()
+
+    def feed(self, text: str):
+        """
+        Adds the next piece of the document. The last words of the previous
+        piece are carried over, so a disclosure split across pages still matches.
+        """
+        text = f"{self._carry} {text}"
+        self._carry = " ".join(words(text)[-(self.index.shingle - 1):]) if self.index.shingle > 1 else ""
+        with stage("disclosure_scan"):
+            found, _ = self.index.matches(text)
+        with self._lock:
+            for value in found - self._seen:
+                for disclosure_id in self.index.postings[value]:
+                    self.matched[disclosure_id] += 1
+            self._seen |= found
+
+    def feed_pages(self, pages):
+        """
+        Passes pages through, feeding each one; finishes after the last.
+        """
+        for page in pages:
+            self.feed(page)
+            yield page
+        self.finish()
+
+    def finish(self):
+        self.finished = True
+
+    def coverage(self, disclosure_id: int) -> float:
+        with self._lock:
+            return float(self.matched[disclosure_id] / max(1, self.index.shingle_counts[disclosure_id]))
+
+    def entry(self, disclosure_id: int) -> dict:
+        disclosure = self.index.disclosures[disclosure_id]
+        coverage = self.coverage(disclosure_id)
+        return {
+            "disclosure_id": disclosure_id,
+            "rule_id": disclosure["rule_id"],
+            "file_name": disclosure["file_name"],
+            "status": self.index.status(coverage),
+            "coverage": round(coverage, 3),
+        }
+
+    def is_disclosure_text(self, text: str, threshold: float) -> bool:
+        """
+        Whether at least `threshold` of text's word runs are disclosure text,
+        and the disclosures it contains at least half of are present in the
+        document (so a truncated copy is still checked). Such a chunk is
+        boilerplate the model has nothing to add to.
+        """
+        found, share = self.index.matches(text)
+        if share < threshold:
+            return False
+        hits = {}
+        for value in found:
+            for disclosure_id in self.index.postings[value]:
+                hits[disclosure_id] = hits.get(disclosure_id, 0) + 1
+        contained = [
+            disclosure_id for disclosure_id, count in hits.items()
+            if count >= 0.5 * self.index.shingle_counts[disclosure_id]
+        ]
+        return bool(contained) and all(
+            self.index.status(self.coverage(disclosure_id)) == "present" for disclosure_id in contained
+        )
+
+    def for_rules(self, rule_ids):
+        """
+        Entries of the disclosures that come from the given rule sections.
+        """
+        return [
+            self.entry(disclosure_id)
+            for rule_id in rule_ids
+            for disclosure_id in self.index.by_rule.get(rule_id, [])
+        ]
+
+    def report(self, include_absent: bool = False) -> dict:
+        """
+        Present and near disclosures of the whole document (with their
+        text), and the absent ones (ids only unless include_absent).
+        """
+        entries = {status: [] for status in STATUSES}
+        for disclosure_id in range(len(self.index.disclosures)):
+            entry = self.entry(disclosure_id)
+            if entry["status"] != "absent" or include_absent:
+                entry["text"] = self.index.disclosures[disclosure_id]["text"]
+            entries[entry["status"]].append(entry)
+        return {
+            "disclosures": len(self.index.disclosures),
+            "present": entries["present"],
+            "near": entries["near"],
+            "absent": entries["absent"] if include_absent else len(entries["absent"]),
+        }
+
+def disclosure_note(entries, disclosures, finished: bool = True, preview_words: int = 15) -> str:
+    """
+    Prompt text telling the model which disclosures of its rule sections
+    were found word for word in the document, so it does not have to
+    compare boilerplate itself. Until the whole document has been scanned
+    (finished False), absent disclosures are left out: they may come later
+    in the document, and the model would ask for them.
+    """
+    if not finished:
+        entries = [entry for entry in entries if entry["status"] != "absent"]
+    if not entries:
+        return ""
+    scope = "the whole document" if finished else "the document so far"
+    lines = [f"Required disclosures from these rules, compared word for word with {scope}:"]
+    for entry in entries:
+        text = disclosures[entry["disclosure_id"]]["text"].split()
+        preview = " ".join(text[:preview_words]) + (" ..." if len(text) > preview_words else "")
+        if entry["status"] == "present":
+            lines.append(f'- Present in the document: "{preview}". Do not ask for it.')
+        elif entry["status"] == "near":
+            lines.append(
+                f'- Partially present ({entry["coverage"]:.0%} of its wording): "{preview}". '
+                "Point out the missing or changed wording."
+            )
+        else:
+            lines.append(f'- Not found in the document: "{preview}".')
+    return "\n".join(lines)
+
+def merge_notes(notes) -> str:
+    """
+    One note for a batched prompt: the header once, then each line once.
+    """
+    lines, seen = [], set()
+    for note in notes:
+        header, *entries = note.split("\n")
+        if not lines:
+            lines.append(header)
+        for entry in entries:
+            if entry not in seen:
+                seen.add(entry)
+                lines.append(entry)
+    return "\n".join(lines)
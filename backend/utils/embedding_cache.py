@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text before hashing so that whitespace and unicode
+    variations of the same sentence share a cache entry.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split())
+
+def embedding_key(text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed embedding cache backed by SQLite.
+    Entries are keyed by sha256(model + normalized text), vectors are stored
+    as raw float16/float32 blobs, and the total blob size is capped with
+    least-recently-used eviction. Safe to share between threads; several
+    processes can point at the same file.
+    """
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024, dtype: str = "float16"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " dtype TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_many(self, texts, model: str):
+        """
+        Looks up a list of texts. Returns a list of float32 vectors,
+        with None for every text that is not cached.
+        """
+        keys = [embedding_key(text, model) for text in texts]
+        found = {}
+        with self._lock:
+            unique_keys = list(set(keys))
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, dtype, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=dtype).astype("float32")
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+            vectors = [found.get(key) for key in keys]
+            hits = sum(vector is not None for vector in vectors)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return vectors
+
+    def get(self, text: str, model: str):
+        return self.get_many([text], model)[0]
+
+    def put_many(self, texts, vectors, model: str):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=self.dtype).tobytes()
+            rows.append((embedding_key(text, model), model, self.dtype.name, blob, now))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for row in rows:
+                previous = self._conn.execute(
+                    "SELECT LENGTH(vector) FROM embeddings WHERE key = ?", (row[0],)
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, model, dtype, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                    row
+                )
+                self._total_bytes += len(row[3]) - (previous[0] if previous else 0)
+            self._conn.execute("COMMIT")
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def put(self, text: str, vector, model: str):
+        self.put_many([text], [vector], model)
+
+    def _evict(self):
+        """
+        Drops least recently used entries until the cache is back under 90%
+        of max_bytes, so a full cache does not evict on every insert.
+        """
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        if self._total_bytes <= target:
+            return
+        self._conn.execute("BEGIN")
+        evicted = []
+        for key, size in self._conn.execute(
+            "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used ASC"
+        ):
+            if self._total_bytes <= target:
+                break
+            evicted.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        self._conn.execute("COMMIT")
+        self.evictions += len(evicted)
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+class CachedEmbeddings(Embeddings):
+    """
+    LangChain Embeddings wrapper that serves vectors from an EmbeddingCache
+    and only sends the misses to the wrapped model.
+    """
+    def __init__(self, embedding_model, cache: EmbeddingCache, model_name: str):
+        self.embedding_model = embedding_model
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        vectors = self.cache.get_many(texts, self.model_name)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            fresh = self.embedding_model.embed_documents([texts[i] for i in missing])
+            self.cache.put_many([texts[i] for i in missing], fresh, self.model_name)
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+        return [np.asarray(vector, dtype="float32").tolist() for vector in vectors]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
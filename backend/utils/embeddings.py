@@ -1,9 +1,25 @@
+import hashlib
+
 import json
 
+import os
+
+import threading
+
+import time
+
+from contextlib import contextmanager
+
 import faiss
 
 import numpy as np
 
+from utils.corpus_store import (
+
+    CorpusStore, append_corpus_store, convert_json_corpus, corpus_hash, corpus_store_is_current
+
+)
+
  
 
 def load_embeddings_from_json(file_path: str):
@@ -46,7 +62,73 @@ def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
 
  
 
-def create_faiss_index(embeddings: np.ndarray):
+INDEX_TYPES = ["flat", "ivf_flat", "hnsw", "ivf_pq", "ivf_sq"]
+
+
+
+def _ivf_nlist(n_vectors: int, nlist=None):
+
+    # ~4*sqrt(n) lists, with at least ~39 training points per list as FAISS recommends
+
+    if nlist is None:
+
+        nlist = int(4 * np.sqrt(n_vectors))
+
+    return max(1, min(nlist, n_vectors // 39))
+
+
+
+def configure_faiss_search(faiss_index, nprobe=None, ef_search=None):
+
+    """
+
+    Sets query-time parameters on any of the INDEX_TYPES, including the
+
+    IVF/HNSW index wrapped inside an IndexRefineFlat.
+
+    """
+
+    params = faiss.ParameterSpace()
+
+    if nprobe is not None and faiss.try_extract_index_ivf(faiss_index) is not None:
+
+        params.set_index_parameter(faiss_index, "nprobe", nprobe)
+
+    if ef_search is not None:
+
+        base = faiss.downcast_index(faiss_index.base_index) if isinstance(faiss_index, faiss.IndexRefine) else faiss_index
+
+        if isinstance(base, faiss.IndexHNSW):
+
+            base.hnsw.efSearch = ef_search
+
+
+
+def create_faiss_index(embeddings: np.ndarray, index_type: str = "flat", nlist=None, nprobe: int = 16,
+
+                       hnsw_m: int = 32, ef_construction: int = 200, ef_search: int = 128,
+
+                       pq_m: int = 64, refine_k_factor: float = 4.0):
+
+    """
+
+    Builds an inner-product index over the normalized embeddings.
+
+        flat      exact linear scan (IndexFlatIP)
+
+        ivf_flat  inverted lists, nprobe of nlist lists scanned per query
+
+        hnsw      HNSW graph with hnsw_m links per node
+
+        ivf_pq    IVF with product quantization (pq_m sub-quantizers), exact re-ranking
+
+        ivf_sq    IVF with 8-bit scalar quantization, exact re-ranking
+
+    The quantized types are wrapped in IndexRefineFlat, which re-scores
+
+    refine_k_factor * k candidates against the full vectors.
+
+    """
 
     embeddings = embeddings.astype('float32')
 
@@ -54,26 +136,190 @@ def create_faiss_index(embeddings: np.ndarray):
 
     dimension = embeddings.shape[1]
 
-    faiss_index = faiss.IndexFlatIP(dimension)
+    metric = faiss.METRIC_INNER_PRODUCT
+
+    if index_type == "flat":
+
+        faiss_index = faiss.IndexFlatIP(dimension)
+
+    elif index_type == "hnsw":
+
+        faiss_index = faiss.IndexHNSWFlat(dimension, hnsw_m, metric)
+
+        faiss_index.hnsw.efConstruction = ef_construction
+
+    elif index_type in ("ivf_flat", "ivf_pq", "ivf_sq"):
+
+        nlist = _ivf_nlist(len(embeddings), nlist)
+
+        quantizer = faiss.IndexFlatIP(dimension)
+
+        if index_type == "ivf_flat":
+
+            faiss_index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+
+        elif index_type == "ivf_pq":
+
+            # PQ needs dimension % pq_m == 0 and 2**8 training points per centroid
+
+            while dimension % pq_m:
+
+                pq_m -= 1
+
+            nbits = 8 if len(embeddings) >= 256 * 39 else 4
+
+            faiss_index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, nbits, metric)
+
+        else:
+
+            faiss_index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, faiss.ScalarQuantizer.QT_8bit, metric)
+
+        faiss_index.train(embeddings)
+
+        if index_type != "ivf_flat":
+
+            faiss_index = faiss.IndexRefineFlat(faiss_index)
+
+            faiss_index.k_factor = refine_k_factor
+
+    else:
+
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
 
     faiss_index.add(embeddings)
 
+    configure_faiss_search(faiss_index, nprobe=nprobe, ef_search=ef_search)
+
     return faiss_index
 
  
 
 def save_faiss_index(faiss_index, index_file: str):
 
-    faiss.write_index(faiss_index, index_file)
+    # Write next to the target and rename, readers never see a partial file
+
+    tmp_file = f"{index_file}.tmp"
+
+    faiss.write_index(faiss_index, tmp_file)
+
+    os.replace(tmp_file, index_file)
 
  
 
-def load_faiss_index(index_file: str):
+def load_faiss_index(index_file: str, mmap: bool = False):
+
+    """
+
+    With mmap the index is memory-mapped read-only instead of read into
+
+    memory, so processes loading the same file share its pages through the
+
+    page cache. This covers the vectors and codes of all INDEX_TYPES (flat
+
+    storage, IVF inverted lists, refine vectors); only small structures
+
+    such as the HNSW graph are still read in. A mapped index cannot be
+
+    added to, not even through faiss.clone_index; load a copy without mmap.
+
+    """
+
+    if mmap:
+
+        return faiss.read_index(index_file, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
 
     return faiss.read_index(index_file)
 
+
+
+@contextmanager
+
+def file_lock(lock_path: str):
+
+    """
+
+    Exclusive lock across processes (e.g. uvicorn workers starting together),
+
+    a no-op where fcntl is not available.
+
+    """
+
+    try:
+
+        import fcntl
+
+    except ImportError:
+
+        yield
+
+        return
+
+    with open(lock_path, "w") as f:
+
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+        try:
+
+            yield
+
+        finally:
+
+            fcntl.flock(f, fcntl.LOCK_UN)
+
  
 
+def file_sha256(file_path: str) -> str:
+
+    digest = hashlib.sha256()
+
+    with open(file_path, 'rb') as f:
+
+        for block in iter(lambda: f.read(1 << 20), b''):
+
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+
+def manifest_path(index_file: str) -> str:
+
+    return f"{index_file}.manifest.json"
+
+
+
+def read_manifest(index_file: str):
+
+    """
+
+    Returns the manifest saved next to a FAISS index, or None.
+
+    """
+
+    try:
+
+        with open(manifest_path(index_file), 'r') as f:
+
+            return json.load(f)
+
+    except (OSError, ValueError):
+
+        return None
+
+
+
+def write_manifest(index_file: str, manifest: dict):
+
+    tmp_file = f"{manifest_path(index_file)}.tmp"
+
+    with open(tmp_file, 'w') as f:
+
+        json.dump(manifest, f, indent=2)
+
+    os.replace(tmp_file, manifest_path(index_file))
+
+
+
 def search_faiss_index(faiss_index, query_embedding, k=5):
 
     query_embedding = np.array(query_embedding).astype('float32')
@@ -86,6 +332,100 @@ def search_faiss_index(faiss_index, query_embedding, k=5):
 
     return distances, indices
 
+
+
+def search_faiss_index_batch(faiss_index, query_embeddings, k=5):
+
+    """
+
+    Searches an (n_queries x dim) matrix of query embeddings in a single
+
+    FAISS call. The queries are copied into one float32 array and normalized
+
+    in place, instead of once per query.
+
+    """
+
+    queries = np.array(query_embeddings, dtype='float32')
+
+    if queries.ndim == 1:
+
+        queries = queries.reshape(1, -1)
+
+    faiss.normalize_L2(queries)
+
+    distances, indices = faiss_index.search(queries, k)
+
+    return distances, indices
+
+ 
+
+class IndexSnapshot:
+
+    """
+
+    One immutable version of the corpus and its FAISS index.
+
+    Readers take a reference to the current snapshot and keep using it,
+
+    so swapping in a new one never affects searches already in flight.
+
+    """
+
+    def __init__(self, faiss_index, embeddings, chunk_summaries, doc_texts, file_names, manifest: dict):
+
+        self.faiss_index = faiss_index
+
+        self.embeddings = embeddings
+
+        self.chunk_summaries = chunk_summaries
+
+        self.doc_texts = doc_texts
+
+        self.file_names = file_names
+
+        self.manifest = manifest
+
+
+
+    def search(self, query_embedding, k=15):
+
+        distances, indices = search_faiss_index(self.faiss_index, query_embedding, k)
+
+        keep = indices[0] >= 0
+
+        return distances[0][keep], indices[0][keep]
+
+
+
+    def batch_search(self, query_embeddings, k=15):
+
+        if len(query_embeddings) == 0:
+
+            return []
+
+        distances, indices = search_faiss_index_batch(self.faiss_index, query_embeddings, k)
+
+        return [
+
+            [
+
+                {"rule_id": int(idx), "score": float(score)}
+
+                for score, idx in zip(row_scores, row_indices) if idx >= 0
+
+            ]
+
+            for row_scores, row_indices in zip(distances, indices)
+
+        ]
+
+
+
+    def get_context(self, rule_ids):
+
+        return "".join(self.doc_texts[idx] for idx in rule_ids)
+
  
 
 class EmbeddingsManager:
@@ -94,23 +434,275 @@ class EmbeddingsManager:
 
     Manages embeddings data and the FAISS index.
 
+    The index is saved with a manifest (corpus hash, dimension, row count,
+
+    index type, version) and rebuilt whenever it does not match the corpus.
+
+    Rebuilds and added rule sections produce a new IndexSnapshot that is
+
+    swapped in atomically. Other processes serving the same files (uvicorn
+
+    workers) notice the new manifest version on their next snapshot access,
+
+    at most every reload_interval seconds, and load it.
+
+    With mmap_index (and a corpus_store_path) nothing large is private to the
+
+    process: the index, vectors and texts are all memory-mapped, so several
+
+    workers on one host share a single copy. Conversion and index builds are
+
+    serialized across processes with a lock file next to the index.
+
     """
 
-    def __init__(self, embeddings_file_path: str, faiss_index_path: str):
+    def __init__(self, embeddings_file_path: str, faiss_index_path: str, corpus_store_path: str = None,
+
+                 index_type: str = "flat", index_params: dict = None, mmap_index: bool = False,
+
+                 reload_interval: float = 1.0):
 
         self.embeddings_file_path = embeddings_file_path
 
         self.faiss_index_path = faiss_index_path
 
-        self.embeddings = None
+        self.corpus_store_path = corpus_store_path
+
+        self.mmap_index = mmap_index
+
+        # One of INDEX_TYPES, index_params are passed to create_faiss_index
+
+        self.index_type = index_type
+
+        self.index_params = index_params or {}
+
+        self._snapshot = None
+
+        self.reload_interval = reload_interval
+
+        self._manifest_checked = 0.0
+
+        self._manifest_stat = None
+
+        # Serializes rebuilds and additions, searches never take it
+
+        self._update_lock = threading.Lock()
+
+        self.rebuild_status = {"state": "idle", "started": None, "finished": None, "error": None}
+
+
+
+    @property
+
+    def snapshot(self):
+
+        """
+
+        The current IndexSnapshot. Reloaded first when another process saved
+
+        a newer index version; a search that arrives while this process is
+
+        already updating gets the current snapshot.
+
+        """
+
+        snapshot = self._snapshot
+
+        if snapshot is None or time.monotonic() - self._manifest_checked < self.reload_interval:
 
-        self.chunk_summaries = None
+            return snapshot
 
-        self.doc_texts = None
+        self._manifest_checked = time.monotonic()
 
-        self.file_names = None
+        if self._saved_version_changed(snapshot) and self._update_lock.acquire(blocking=False):
 
-        self.faiss_index = None
+            try:
+
+                print(f"FAISS index {self.faiss_index_path} was updated by another process, reloading")
+
+                self._load_data_and_index()
+
+            finally:
+
+                self._update_lock.release()
+
+        return self._snapshot
+
+
+
+    @snapshot.setter
+
+    def snapshot(self, snapshot):
+
+        self._snapshot = snapshot
+
+
+
+    def _saved_version_changed(self, snapshot) -> bool:
+
+        # The manifest is only parsed when its file changed
+
+        try:
+
+            stat = os.stat(manifest_path(self.faiss_index_path))
+
+        except OSError:
+
+            return False
+
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        if key == self._manifest_stat:
+
+            return False
+
+        self._manifest_stat = key
+
+        saved = read_manifest(self.faiss_index_path)
+
+        return saved is not None and saved.get("version") != snapshot.manifest.get("version")
+
+
+
+    @property
+
+    def faiss_index(self):
+
+        return self.snapshot.faiss_index if self.snapshot else None
+
+
+
+    @property
+
+    def embeddings(self):
+
+        return self.snapshot.embeddings if self.snapshot else None
+
+
+
+    @property
+
+    def chunk_summaries(self):
+
+        return self.snapshot.chunk_summaries if self.snapshot else None
+
+
+
+    @property
+
+    def doc_texts(self):
+
+        return self.snapshot.doc_texts if self.snapshot else None
+
+
+
+    @property
+
+    def file_names(self):
+
+        return self.snapshot.file_names if self.snapshot else None
+
+
+
+    @property
+
+    def manifest(self):
+
+        return self.snapshot.manifest if self.snapshot else None
+
+
+
+    def _load_corpus(self):
+
+        """
+
+        Loads the corpus, from the memory-mapped store when corpus_store_path
+
+        is set (re-converted when the JSON file changed) or from JSON.
+
+        Returns (embeddings, chunk_summaries, doc_texts, file_names, corpus_hash).
+
+        """
+
+        if self.corpus_store_path:
+
+            if not corpus_store_is_current(self.corpus_store_path, self.embeddings_file_path):
+
+                convert_json_corpus(self.embeddings_file_path, self.corpus_store_path)
+
+            store = CorpusStore(self.corpus_store_path)
+
+            return store.vectors, store.chunk_summaries, store.doc_texts, store.file_names, corpus_hash(store.meta)
+
+        embeddings, chunk_summaries, doc_texts, file_names = load_embeddings_from_json(self.embeddings_file_path)
+
+        return embeddings, chunk_summaries, doc_texts, file_names, file_sha256(self.embeddings_file_path)
+
+
+
+    def _expected_manifest(self, embeddings, corpus_hash: str, index_type: str):
+
+        return {
+
+            "corpus_hash": corpus_hash,
+
+            "dimension": int(embeddings.shape[1]),
+
+            "count": int(embeddings.shape[0]),
+
+            "index_type": index_type,
+
+        }
+
+
+
+    def _save_index(self, faiss_index, manifest: dict):
+
+        """
+
+        Saves the index and its manifest. Returns (index, manifest): the
+
+        index to serve, which is the saved file mapped back in with mmap_index.
+
+        """
+
+        previous = read_manifest(self.faiss_index_path) or {}
+
+        manifest = {**manifest, "version": previous.get("version", 0) + 1, "created": time.time()}
+
+        save_faiss_index(faiss_index, self.faiss_index_path)
+
+        write_manifest(self.faiss_index_path, manifest)
+
+        if self.mmap_index:
+
+            faiss_index = self._configure(load_faiss_index(self.faiss_index_path, mmap=True))
+
+        return faiss_index, manifest
+
+
+
+    def _file_lock(self):
+
+        # Held while the corpus store, the JSON corpus or the index files are written
+
+        return file_lock(f"{self.faiss_index_path}.lock")
+
+
+
+    def _configure(self, faiss_index):
+
+        configure_faiss_search(
+
+            faiss_index,
+
+            nprobe=self.index_params.get("nprobe"),
+
+            ef_search=self.index_params.get("ef_search")
+
+        )
+
+        return faiss_index
 
  
 
@@ -118,50 +710,252 @@ class EmbeddingsManager:
 
         """
 
-        Loads embedding data from JSON and either loads or creates a FAISS index.
+        Loads embedding data and either loads or creates a FAISS index.
+
+        With a corpus_store_path the data is memory-mapped from the binary
+
+        corpus store (converted from the JSON file on first use), otherwise
+
+        it is parsed from JSON. The saved index is only used when its manifest
+
+        matches the corpus, otherwise it is rebuilt.
 
         """
 
-        import os
+        with self._update_lock:
 
- 
+            self._load_data_and_index()
+
+
+
+    def _load_data_and_index(self):
 
-        # Load embeddings data
+        # The first worker to start converts and builds, the others wait and load its files
 
-        self.embeddings, self.chunk_summaries, self.doc_texts, self.file_names = load_embeddings_from_json(self.embeddings_file_path)
+        with self._file_lock():
+
+            embeddings, chunk_summaries, doc_texts, file_names, corpus_hash = self._load_corpus()
+
+            expected = self._expected_manifest(embeddings, corpus_hash, self.index_type)
+
+            manifest = read_manifest(self.faiss_index_path)
 
  
 
-        # Check if FAISS index file exists
+            # Check if FAISS index file exists and was built from this corpus
 
-        if os.path.isfile(self.faiss_index_path):
+            faiss_index = None
 
-            self.faiss_index = load_faiss_index(self.faiss_index_path)
+            if (os.path.isfile(self.faiss_index_path) and manifest is not None
 
-        else:
+                    and all(manifest.get(key) == value for key, value in expected.items())):
+
+                faiss_index = self._configure(load_faiss_index(self.faiss_index_path, mmap=self.mmap_index))
+
+                if faiss_index.ntotal != expected["count"]:
+
+                    faiss_index = None
+
+            if faiss_index is None:
 
-            self.faiss_index = create_faiss_index(self.embeddings)
+                if os.path.isfile(self.faiss_index_path):
 
-            save_faiss_index(self.faiss_index, self.faiss_index_path)
+                    print(f"FAISS index {self.faiss_index_path} does not match the corpus, rebuilding")
+
+                faiss_index = create_faiss_index(embeddings, self.index_type, **self.index_params)
+
+                faiss_index, manifest = self._save_index(faiss_index, expected)
 
  
 
-    def vector_search(self, query_embedding, k=15):
+            self.snapshot = IndexSnapshot(faiss_index, embeddings, chunk_summaries, doc_texts, file_names, manifest)
+
+
+
+    def rebuild_index(self, index_type: str = None):
 
         """
 
-        Searches the FAISS index and returns the concatenated doc texts of top-k neighbors.
+        Reloads the corpus, builds a fresh index (optionally of another type),
+
+        saves it and swaps it in. Searches keep running on the previous
+
+        snapshot until the swap. Meant to run in a background thread.
 
         """
 
-        content = ""
+        with self._update_lock, self._file_lock():
 
-        distances, indices = search_faiss_index(self.faiss_index, query_embedding, k)
+            self.rebuild_status = {"state": "running", "started": time.time(), "finished": None, "error": None}
+
+            try:
+
+                index_type = index_type or self.index_type
+
+                embeddings, chunk_summaries, doc_texts, file_names, corpus_hash = self._load_corpus()
+
+                faiss_index = create_faiss_index(embeddings, index_type, **self.index_params)
+
+                faiss_index, manifest = self._save_index(
+
+                    faiss_index, self._expected_manifest(embeddings, corpus_hash, index_type)
+
+                )
+
+                self.index_type = index_type
+
+                self.snapshot = IndexSnapshot(faiss_index, embeddings, chunk_summaries, doc_texts, file_names, manifest)
+
+            except Exception as exc:
+
+                self.rebuild_status.update(state="failed", finished=time.time(), error=str(exc))
+
+                raise
+
+            self.rebuild_status.update(state="idle", finished=time.time())
+
+            return manifest
+
+
+
+    def add_rules(self, items):
+
+        """
+
+        Adds rule sections, given as JSON corpus items ({embedding,
+
+        chunk_summary, doc_text, file_name}), without reloading the corpus:
+
+        the rows are appended to the corpus store (see append_corpus_store)
+
+        and the vectors added to a copy of the saved index (no retraining),
+
+        which is saved and swapped in. Other workers load the new version on
+
+        their next snapshot access. Existing rule ids do not change.
+
+        Needs the corpus store; the JSON corpus file is not updated.
+
+        """
+
+        if not self.corpus_store_path:
+
+            raise ValueError("Adding rules needs the corpus store (CORPUS_STORE_PATH)")
+
+        with self._update_lock, self._file_lock():
+
+            current = self._snapshot
+
+            dimension = current.manifest["dimension"]
+
+            vectors = np.array([item['embedding'] for item in items], dtype='float32').reshape(len(items), -1)
+
+            if vectors.shape[1] != dimension:
+
+                raise ValueError(f"Expected embeddings of dimension {dimension}, got {vectors.shape[1]}")
+
+
+
+            # Start from the saved index rather than this process's snapshot,
+
+            # another worker may have added rules since it was loaded
+
+            faiss_index = self._configure(load_faiss_index(self.faiss_index_path))
 
-        for i in range(len(distances[0])):
+            store = CorpusStore(self.corpus_store_path)
+
+            if faiss_index.ntotal != store.meta["count"]:
+
+                raise RuntimeError(
+
+                    f"FAISS index has {faiss_index.ntotal} rows, the corpus store {store.meta['count']}; rebuild the index"
+
+                )
+
+            append_corpus_store(
+
+                self.corpus_store_path, vectors,
+
+                [item['doc_text'] for item in items],
+
+                [item['chunk_summary'] for item in items],
+
+                [item['file_name'] for item in items]
+
+            )
+
+            store = CorpusStore(self.corpus_store_path)
+
+            faiss_index.add(normalize_embeddings(vectors))
+
+            faiss_index, manifest = self._save_index(
+
+                faiss_index, self._expected_manifest(store.vectors, corpus_hash(store.meta), current.manifest["index_type"])
+
+            )
+
+            self.snapshot = IndexSnapshot(
+
+                faiss_index, store.vectors, store.chunk_summaries, store.doc_texts, store.file_names, manifest
+
+            )
+
+            return manifest
+
+
+
+    def search(self, query_embedding, k=15):
+
+        """
+
+        Searches the FAISS index and returns (scores, rule_ids) of the top-k neighbors.
+
+        Rule ids are row positions in the corpus; FAISS pads with -1 when k > ntotal.
+
+        """
+
+        return self.snapshot.search(query_embedding, k)
+
+
+
+    def batch_search(self, query_embeddings, k=15):
+
+        """
+
+        Searches the FAISS index for all chunks of a document at once.
+
+        Takes an (n_chunks x dim) array (or list of vectors) and returns, per chunk,
+
+        a list of {"rule_id", "score"} neighbours sorted by decreasing score.
+
+        """
+
+        return self.snapshot.batch_search(query_embeddings, k)
+
+
+
+    def get_context(self, rule_ids):
+
+        """
+
+        Returns the concatenated doc texts of the given rule ids.
+
+        """
+
+        return self.snapshot.get_context(rule_ids)
+
+
+
+    def vector_search(self, query_embedding, k=15):
+
+        """
+
+        Searches the FAISS index and returns the concatenated doc texts of top-k neighbors.
+
+        """
 
-            idx = indices[0][i]
+        snapshot = self.snapshot
 
-            content += self.doc_texts[idx]
+        _, rule_ids = snapshot.search(query_embedding, k)
 
-        return content
\ No newline at end of file
+        return snapshot.get_context(rule_ids)
\ No newline at end of file
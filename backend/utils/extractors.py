@@ -1,11 +1,79 @@
 import io
 
+import multiprocessing
+
+import os
+
+import threading
+
+from collections import deque
+
+from concurrent.futures import ProcessPoolExecutor
+
+from multiprocessing import shared_memory
+
 import docx
 
 import pdfplumber
 
  
 
+def is_path(source) -> bool:
+
+    return isinstance(source, (str, os.PathLike))
+
+
+
+def is_file(source) -> bool:
+
+    return hasattr(source, "read")
+
+ 
+
+def open_source(source):
+
+    """
+
+    What pdfplumber and python-docx are opened with: a path or a file object
+
+    as is (the file is read as needed, not loaded whole), bytes wrapped in a
+
+    BytesIO.
+
+    """
+
+    if is_path(source):
+
+        return source
+
+    if is_file(source):
+
+        source.seek(0)
+
+        return source
+
+    return io.BytesIO(source)
+
+ 
+
+def read_source(source) -> bytes:
+
+    if is_path(source):
+
+        with open(source, "rb") as f:
+
+            return f.read()
+
+    if is_file(source):
+
+        source.seek(0)
+
+        return source.read()
+
+    return source
+
+ 
+
 class BaseTextExtractor:
 
     """
@@ -14,141 +82,531 @@ class BaseTextExtractor:
 
     Child classes should override the `extract_text` method.
 
+    A source is the document's bytes, the path of a file holding them or a
+
+    seekable binary file object; uploads are extracted from the file
+
+    Starlette spooled them to, without another copy.
+
     """
 
-    def extract_text(self, file_bytes: bytes) -> str:
+    def extract_text(self, source) -> str:
 
         raise NotImplementedError("This method should be overridden by subclasses.")
 
  
 
+    def iter_pages(self, source):
+
+        """
+
+        Yields the document's text piece by piece (pages for PDFs), so it can
+
+        be chunked while the rest is still being extracted. The pieces joined
+
+        with newlines give extract_text's result. Defaults to a single piece.
+
+        """
+
+        yield self.extract_text(source)
+
+ 
+
+    def iter_structured_pages(self, source):
+
+        """
+
+        Like iter_pages, but with headings marked as **...** lines for the
+
+        structural chunker. Defaults to the plain pages.
+
+        """
+
+        return self.iter_pages(source)
+
+ 
+
+    def iter_pages_for(self, chunking_mode: str, source):
+
+        # The structural chunker needs the heading markup, the semantic one does not
+
+        if chunking_mode == "structural":
+
+            return self.iter_structured_pages(source)
+
+        return self.iter_pages(source)
+
+ 
+
+    def extract_structured_text(self, source) -> str:
+
+        return "\n".join(self.iter_structured_pages(source))
+
+ 
+
+def page_text(page):
+
+    """
+
+    Text of one page, without headers and footers. Returns a list with
+
+    the page's stripped text, or an empty list for an empty page.
+
+    """
+
+    bbox = (0, 50, page.width, page.height-50) # to exclude headers and footers
+
+    cropped_page = page.within_bbox(bbox)
+
+    text = cropped_page.extract_text()
+
+    return [text.strip()] if text else []
+
+ 
+
+def page_lines(page):
+
+    """
+
+    Lines of one page, rebuilt from its words, with bold lines wrapped in ** **.
+
+    """
+
+    main_text = []
+
+    bbox = (0, 50, page.width, page.height-50)  # to exclude headers and footers
+
+    cropped_page = page.within_bbox(bbox)
+
+   
+
+    # Extract words with their font, which pdfplumber only reports when asked
+
+    words = cropped_page.extract_words(extra_attrs=["fontname"])
+
+   
+
+    # Initialize a variable to track the current line
+
+    current_line = []
+
+    previous_bottom = None
+
+    bold_words = 0
+
+   
+
+    def line_text():
+
+        # A line is a heading when all its words are bold
+
+        text = " ".join(current_line)
+
+        if bold_words == len(current_line):
+
+            text = f"**{text}**"
+
+        return text.strip()
+
+   
+
+    for word in words:
+
+        # Determine if we're on a new line
+
+        bottom = word['bottom']
+
+        if previous_bottom is None or abs(bottom - previous_bottom) > 2:  # New line detected
+
+            if current_line:
+
+                main_text.append(line_text())
+
+           
+
+            # Reset for the new line
+
+            current_line = []
+
+            bold_words = 0
+
+       
+
+        # Determine if the font is bold
+
+        font_name = word.get('fontname', '').lower()
+
+        if 'bold' in font_name or 'black' in font_name:  # Common indicators of bold fonts
+
+            bold_words += 1
+
+       
+
+        # Add the current word to the line
+
+        current_line.append(word['text'])
+
+        previous_bottom = bottom
+
+   
+
+    # Add the last line if any
+
+    if current_line:
+
+        main_text.append(line_text())
+
+    return main_text
+
+ 
+
+PAGE_EXTRACTORS = {"text": page_text, "lines": page_lines}
+
+
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+
+class BufferFile(io.RawIOBase):
+
+    """
+
+    Read-only, seekable file over a buffer such as a shared memory block.
+
+    Unlike io.BytesIO it does not copy the buffer; close it before the
+
+    buffer's owner is closed.
+
+    """
+
+    def __init__(self, buffer, size: int):
+
+        self._view = memoryview(buffer)[:size]
+
+        self._position = 0
+
+
+
+    def readable(self):
+
+        return True
+
+
+
+    def seekable(self):
+
+        return True
+
+
+
+    def readinto(self, target):
+
+        count = max(0, min(len(target), len(self._view) - self._position))
+
+        target[:count] = self._view[self._position:self._position + count]
+
+        self._position += count
+
+        return count
+
+
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+
+        self._position = max(0, base + offset)
+
+        return self._position
+
+
+
+    def tell(self):
+
+        return self._position
+
+
+
+    def close(self):
+
+        if not self.closed:
+
+            self._view.release()
+
+        super().close()
+
+ 
+
+def extract_page_range(start: int, end: int, mode: str, path: str = None, shm_name: str = None, size: int = 0):
+
+    """
+
+    Process pool task: opens the PDF from its path, or from the shared
+
+    memory block written by the parent, and extracts pages [start, end).
+
+    Returns one list of text pieces per page.
+
+    """
+
+    extract_page = PAGE_EXTRACTORS[mode]
+
+    if path is not None:
+
+        with pdfplumber.open(path) as pdf:
+
+            return [extract_page(pdf.pages[i]) for i in range(start, end)]
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    try:
+
+        # Read in place, every task shares the parent's one copy of the document
+
+        with BufferFile(shm.buf, size) as source, pdfplumber.open(source) as pdf:
+
+            return [extract_page(pdf.pages[i]) for i in range(start, end)]
+
+    finally:
+
+        shm.close()
+
+ 
+
+_pool = None
+
+_pool_workers = 0
+
+_pool_lock = threading.Lock()
+
+ 
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+
+    """
+
+    Shared process pool for page extraction, created on first use.
+
+    Workers are spawned rather than forked, the server process has threads.
+
+    """
+
+    global _pool, _pool_workers
+
+    with _pool_lock:
+
+        if _pool is None or _pool_workers != workers:
+
+            if _pool is not None:
+
+                _pool.shutdown(wait=False)
+
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+            _pool_workers = workers
+
+        return _pool
+
+ 
+
+def shutdown_process_pool():
+
+    global _pool
+
+    with _pool_lock:
+
+        if _pool is not None:
+
+            _pool.shutdown()
+
+            _pool = None
+
+ 
+
 class PDFTextExtractor(BaseTextExtractor):
 
-    def extract_text(self, file_bytes: bytes) -> str:
+    """
+
+    Page-by-page pdfplumber extraction. With workers > 1, documents of at
+
+    least parallel_min_pages pages are split into page ranges extracted by a
+
+    process pool; every worker opens the same file (or the same bytes from
+
+    shared memory) and the pages are put back in order.
+
+    """
+
+    def __init__(self, workers: int = 1, parallel_min_pages: int = 16, pages_per_task: int = 8):
+
+        self.workers = workers
+
+        self.parallel_min_pages = parallel_min_pages
 
-        main_text = []
+        self.pages_per_task = pages_per_task
+
+ 
 
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+    def extract_text(self, source) -> str:
 
-            for page in pdf.pages:
+        return "\n".join(self.iter_pages(source, "text"))
 
-                bbox = (0, 50, page.width, page.height-50) # to exclude headers and footers
+ 
 
-                cropped_page = page.within_bbox(bbox)
+    def extract_text2(self, source) -> str:
 
-                text = cropped_page.extract_text()
+        return "\n".join(self.iter_pages(source, "lines"))
 
-                if text:
+ 
 
-                    main_text.append(text.strip())
+    def iter_structured_pages(self, source):
 
-        return "\n".join(main_text)
+        return self.iter_pages(source, "lines")
 
  
 
-    def extract_text2(self, file_bytes: bytes) -> str:
+    def iter_pages(self, source, mode: str = "text"):
 
-        main_text = []
+        """
 
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+        Yields the text of every non-empty page in page order, using
 
-            for page in pdf.pages:
+        page_text ("text") or page_lines ("lines") for each page.
 
-                bbox = (0, 50, page.width, page.height-50)  # to exclude headers and footers
+        """
 
-                cropped_page = page.within_bbox(bbox)
+        extract_page = PAGE_EXTRACTORS[mode]
 
-               
+        with pdfplumber.open(open_source(source)) as pdf:
 
-                # Extract words with detailed character information
+            page_count = len(pdf.pages)
 
-                words = cropped_page.extract_words()
+            if self.workers <= 1 or page_count < self.parallel_min_pages:
 
-               
+                for page in pdf.pages:
 
-                # Initialize a variable to track the current line
+                    pieces = extract_page(page)
 
-                current_line = []
+                    # Drop the page's parsed objects, memory stays flat on long documents
 
-                previous_bottom = None
+                    page.close()
 
-                is_bold = False
+                    if pieces:
 
-               
+                        yield "\n".join(pieces)
 
-                for word in words:
+                return
 
-                    # Determine if the font is bold
+        yield from self._iter_parallel(source, page_count, mode)
 
-                    font_name = word.get('fontname', '').lower()
+ 
 
-                    if 'bold' in font_name or 'black' in font_name:  # Common indicators of bold fonts
+    def _iter_parallel(self, source, page_count: int, mode: str):
 
-                        is_bold = True
+        # Ranges small enough to balance the workers, large enough that
 
-                   
+        # re-opening the document per task stays cheap
 
-                    # Determine if we're on a new line
+        per_task = max(self.pages_per_task, -(-page_count // (self.workers * 4)))
 
-                    bottom = word['bottom']
+        ranges = [(start, min(start + per_task, page_count)) for start in range(0, page_count, per_task)]
+
+ 
 
-                    if previous_bottom is None or abs(bottom - previous_bottom) > 2:  # New line detected
+        # Workers open a file themselves, bytes and file objects are shared through shared memory
 
-                        if current_line:
+        shm = None
 
-                            # Join the current line and add to main_text
+        pending = deque()
 
-                            line_text = " ".join(current_line)
+        try:
 
-                            if is_bold:
+            if is_path(source):
 
-                                line_text = f"**{line_text}**"
+                task_source = {"path": os.fspath(source)}
 
-                            main_text.append(line_text.strip())
+            else:
 
-                       
+                size = source.seek(0, os.SEEK_END) if is_file(source) else len(source)
 
-                        # Reset for the new line
+                shm = shared_memory.SharedMemory(create=True, size=max(1, size))
 
-                        current_line = []
+                if is_file(source):
 
-                        is_bold = False
+                    source.seek(0)
 
-                   
+                    position = 0
 
-                    # Add the current word to the line
+                    while position < size:
 
-                    current_line.append(word['text'])
+                        block = source.read(min(COPY_BLOCK_SIZE, size - position))
 
-                    previous_bottom = bottom
+                        if not block:
 
-               
+                            break
 
-                # Add the last line if any
+                        shm.buf[position:position + len(block)] = block
 
-                if current_line:
+                        position += len(block)
 
-                    line_text = " ".join(current_line)
+                else:
 
-                    if is_bold:
+                    shm.buf[:size] = source
 
-                        line_text = f"**{line_text}**"
+                task_source = {"shm_name": shm.name, "size": size}
 
-                    main_text.append(line_text.strip())
+            pool = get_process_pool(self.workers)
+
+            # At most two ranges per worker are submitted ahead of the
+
+            # consumer, so a slow consumer also slows extraction down
+
+            for start, end in ranges:
+
+                pending.append(pool.submit(extract_page_range, start, end, mode, **task_source))
+
+                if len(pending) >= self.workers * 2:
+
+                    yield from self._range_pages(pending.popleft())
+
+            while pending:
+
+                yield from self._range_pages(pending.popleft())
+
+        finally:
+
+            for future in pending:
+
+                future.cancel()
+
+            if shm is not None:
+
+                shm.close()
+
+                shm.unlink()
 
  
 
-        return "\n".join(main_text)
+    @staticmethod
+
+    def _range_pages(future):
+
+        for pieces in future.result():
+
+            if pieces:
+
+                yield "\n".join(pieces)
 
  
 
 class DOCXTextExtractor(BaseTextExtractor):
 
-    def extract_text(self, file_bytes: bytes) -> str:
+    def extract_text(self, source) -> str:
 
         text = ""
 
-        doc = docx.Document(io.BytesIO(file_bytes))
+        doc = docx.Document(open_source(source))
 
         for para in doc.paragraphs:
 
@@ -158,8 +616,76 @@ class DOCXTextExtractor(BaseTextExtractor):
 
  
 
+    def iter_pages(self, source, paragraphs_per_piece: int = 50, structured: bool = False):
+
+        doc = docx.Document(open_source(source))
+
+        if structured:
+
+            # A blank line after every paragraph keeps DOCX paragraph boundaries
+
+            paragraphs = [self.structured_text(para) for para in doc.paragraphs]
+
+            separator = "\n\n"
+
+        else:
+
+            paragraphs = [para.text for para in doc.paragraphs]
+
+            separator = "\n"
+
+        for start in range(0, len(paragraphs), paragraphs_per_piece):
+
+            yield separator.join(paragraphs[start:start + paragraphs_per_piece])
+
+ 
+
+    def iter_structured_pages(self, source):
+
+        return self.iter_pages(source, structured=True)
+
+ 
+
+    @staticmethod
+
+    def is_heading(para) -> bool:
+
+        """
+
+        Heading/Title styles, or a short paragraph whose text is all bold.
+
+        """
+
+        style = (para.style.name if para.style is not None else "") or ""
+
+        if style.startswith("Heading") or style == "Title":
+
+            return True
+
+        runs = [run for run in para.runs if run.text.strip()]
+
+        return bool(runs) and len(para.text) <= 120 and all(run.bold for run in runs)
+
+ 
+
+    @classmethod
+
+    def structured_text(cls, para) -> str:
+
+        # Same heading markup as PDFTextExtractor.extract_text2
+
+        text = para.text.strip()
+
+        if text and cls.is_heading(para):
+
+            return f"**{text}**"
+
+        return text
+
+ 
+
 class TXTTextExtractor(BaseTextExtractor):
 
-    def extract_text(self, file_bytes: bytes) -> str:
+    def extract_text(self, source) -> str:
 
-        return file_bytes.decode("utf-8")
\ No newline at end of file
+        return read_source(source).decode("utf-8")
\ No newline at end of file
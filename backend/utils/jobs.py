@@ -0,0 +1,186 @@
+import asyncio
+import os
+import re
+import shutil
+import time
+import uuid
+from utils.uploads import COPY_CHUNK_SIZE
+
+STAGES = ["extracting", "chunking", "embedding", "checking"]
+
+class Job:
+    """
+    State of one background compliance check. Updated in place by the
+    worker, read by the /jobs endpoints.
+    """
+    def __init__(self, job_id: str, filename: str, upload_path: str, chunking: str = None):
+        self.job_id = job_id
+        self.filename = filename
+        self.upload_path = upload_path
+        self.chunking = chunking
+        self.status = "queued"
+        self.stage = None
+        self.stages = {stage: {"status": "pending", "started": None, "finished": None} for stage in STAGES}
+        self.total_chunks = None
+        self.completed_chunks = 0
+        self.results = []
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def start_stage(self, stage: str):
+        if stage == self.stage:
+            return
+        now = time.time()
+        if self.stage is not None:
+            self.stages[self.stage]["status"] = "done"
+            self.stages[self.stage]["finished"] = now
+        self.stage = stage
+        self.stages[stage]["status"] = "running"
+        self.stages[stage]["started"] = now
+
+    def add_result(self, index: int, result: dict):
+        # Chunks finish out of order, keep the document order
+        if len(self.results) <= index:
+            self.results.extend([None] * (index + 1 - len(self.results)))
+        self.results[index] = result
+        self.completed_chunks += 1
+
+    def finish(self, error: str = None):
+        now = time.time()
+        if self.stage is not None:
+            self.stages[self.stage]["status"] = "failed" if error else "done"
+            self.stages[self.stage]["finished"] = now
+        self.status = "failed" if error else "completed"
+        self.error = error
+        self.finished = now
+
+    def to_dict(self, include_results: bool = True):
+        job = {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "chunking": self.chunking,
+            "status": self.status,
+            "stage": self.stage,
+            "stages": self.stages,
+            "progress": {
+                "total_chunks": self.total_chunks,
+                "completed_chunks": self.completed_chunks,
+            },
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+        if include_results:
+            job["chunks"] = [
+                {"index": i, **result} for i, result in enumerate(self.results) if result is not None
+            ]
+        return job
+
+class JobManager:
+    """
+    In-process job queue. Uploads are written to upload_dir and queued;
+    a fixed pool of asyncio workers runs the extraction -> chunking -> checking pipeline,
+    so HTTP requests return immediately and at most `workers` documents
+    are processed at once (LLM calls are further bounded by the agent).
+    """
+    def __init__(self, compliance_agent, get_extractor, upload_dir: str,
+                 workers: int = 4, max_queued: int = 100, max_history: int = 1000):
+        self.compliance_agent = compliance_agent
+        self.get_extractor = get_extractor
+        self.upload_dir = upload_dir
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_history = max_history
+        self.jobs = {}
+        self._queue = None
+        self._worker_tasks = []
+
+    async def start(self):
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def _store_upload(self, job_id: str, filename: str, file_obj) -> str:
+        job_dir = os.path.join(self.upload_dir, job_id)
+        os.makedirs(job_dir)
+        # The client's file name is only trusted for its extension
+        suffix = os.path.splitext(filename or "")[1].lower()
+        upload_path = os.path.join(job_dir, "upload" + (suffix if re.fullmatch(r"\.[a-z0-9]{1,10}", suffix) else ""))
+        with open(upload_path, "wb") as f:
+            file_obj.seek(0)
+            shutil.copyfileobj(file_obj, f, COPY_CHUNK_SIZE)
+        return upload_path
+
+    async def submit(self, filename: str, file_obj, chunking: str = None) -> Job:
+        """
+        Copies the uploaded file object to upload_dir chunk by chunk and
+        queues it. Raises asyncio.QueueFull when max_queued jobs are
+        already waiting.
+        """
+        if self._queue.full():
+            raise asyncio.QueueFull()
+        job_id = uuid.uuid4().hex
+        upload_path = await asyncio.to_thread(self._store_upload, job_id, filename, file_obj)
+
+        job = Job(job_id, filename, upload_path, chunking)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            shutil.rmtree(os.path.dirname(upload_path), ignore_errors=True)
+            raise
+        self.jobs[job_id] = job
+        self._prune()
+        return job
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def stats(self):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"workers": self.workers, "queued": self._queue.qsize() if self._queue else 0, "jobs": counts}
+
+    def _prune(self):
+        # Forget the oldest finished jobs once the history is full
+        finished = [job for job in self.jobs.values() if job.finished is not None]
+        for job in sorted(finished, key=lambda job: job.finished)[:max(0, len(self.jobs) - self.max_history)]:
+            del self.jobs[job.job_id]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except Exception as exc:
+                job.finish(error=str(exc))
+            finally:
+                shutil.rmtree(os.path.dirname(job.upload_path), ignore_errors=True)
+                self._queue.task_done()
+
+    async def _run(self, job: Job):
+        job.status = "running"
+        job.start_stage("extracting")
+        extractor = self.get_extractor(job.filename)
+
+        # Extraction, chunking and checking overlap, see astream_compliance_check_pages.
+        # Pages are read from the stored upload as they are extracted.
+        chunking = job.chunking or self.compliance_agent.text_processor.chunking_mode
+        pages = extractor.iter_pages_for(chunking, job.upload_path)
+        async for event in self.compliance_agent.astream_compliance_check_pages(pages, chunking):
+            if event["type"] == "progress":
+                job.start_stage(event["stage"])
+                if "total" in event:
+                    job.total_chunks = event["total"]
+            elif event["type"] == "result":
+                result = dict(event)
+                del result["type"], result["index"]
+                job.add_result(event["index"], result)
+        job.finish()
@@ -0,0 +1,287 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+import openai
+from langchain_core.embeddings import Embeddings
+from utils.metrics import record_tokens, stage
+
+# Errors worth retrying: throttling, timeouts, dropped connections and 5xx
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+def retry_after(exc) -> float:
+    """
+    Seconds the service asked us to wait (retry-after-ms / retry-after
+    headers of the error response), or None.
+    """
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # HTTP-date form, fall back to our own backoff
+        return None
+    return None
+
+def estimate_tokens(texts) -> int:
+    # ~4 characters per token, close enough to budget against a quota
+    return sum(len(text) for text in texts) // 4 + 1
+
+class TokenBucket:
+    """
+    Refills at `per_minute` units per minute up to one minute of capacity.
+    reserve() takes the units right away and returns how long the caller has
+    to wait before using them, so concurrent callers queue up fairly.
+    A rate of 0 disables the bucket.
+    """
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        if self.per_minute <= 0:
+            return 0.0
+        # A single request larger than the whole budget still goes through
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.per_minute / 60)
+            self.updated = now
+            self.level -= amount
+            wait = max(0.0, -self.level * 60 / self.per_minute)
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float):
+        """
+        Holds back every caller, e.g. after a 429 with Retry-After.
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit shared by threads and event loops. Halved when the
+    service throttles us (at most once per cooldown) and raised by one after
+    `limit` consecutive successes, between min_limit and max_limit.
+    """
+    def __init__(self, max_limit: int, min_limit: int = 1, cooldown: float = 2.0):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = max_limit
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._waiters = deque()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    async def aacquire(self):
+        while True:
+            with self._cond:
+                if self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                loop = asyncio.get_running_loop()
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            await waiter
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._wake()
+
+    def _wake(self):
+        self._cond.notify_all()
+        while self._waiters:
+            loop, waiter = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(lambda w=waiter: w.done() or w.set_result(None))
+            except RuntimeError:
+                # The waiter's event loop is already closed
+                pass
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._wake()
+
+    def on_throttle(self):
+        with self._cond:
+            self._successes = 0
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit // 2)
+                self._last_decrease = now
+
+class LLMScheduler:
+    """
+    Single gate for every Azure OpenAI call. Each deployment gets a request
+    and a token bucket (its RPM/TPM quota, 0 = unlimited), all calls share
+    an adaptive concurrency limit, and retryable errors are retried up to
+    max_retries times, waiting Retry-After when the service sends one and
+    jittered exponential backoff otherwise.
+    """
+    def __init__(self, limits: dict = None, max_concurrency: int = 32, min_concurrency: int = 1,
+                 max_retries: int = 6, base_delay: float = 0.5, max_delay: float = 60.0):
+        self.limiter = AdaptiveLimiter(max_concurrency, min_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets = {}
+        for deployment, limit in (limits or {}).items():
+            self._buckets[deployment] = (
+                TokenBucket(limit.get("rpm", 0)),
+                TokenBucket(limit.get("tpm", 0))
+            )
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "throttled": 0, "failures": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _reserve(self, deployment: str, tokens: int) -> float:
+        buckets = self._buckets.get(deployment)
+        if buckets is None:
+            return 0.0
+        requests, token_bucket = buckets
+        return max(requests.reserve(1), token_bucket.reserve(tokens))
+
+    def _backoff(self, deployment: str, attempt: int, exc) -> float:
+        """
+        Records a failed attempt and returns the delay before the next one.
+        """
+        self._count("retries")
+        delay = retry_after(exc)
+        if isinstance(exc, openai.RateLimitError):
+            self._count("throttled")
+            self.limiter.on_throttle()
+            if delay is not None and deployment in self._buckets:
+                for bucket in self._buckets[deployment]:
+                    bucket.pause(delay)
+        if delay is None:
+            # Full jitter
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return delay
+
+    def call(self, fn, deployment: str, tokens: int = 0, stage_name: str = None):
+        """
+        Runs fn() (a blocking API call) under the deployment's budgets.
+        Raises the last error once the retries are used up.
+        Time spent waiting for the budgets, a concurrency slot or a retry is
+        recorded as stage llm_queue_wait, the calls themselves as stage_name.
+        """
+        delay = 0.0
+        for attempt in range(self.max_retries + 1):
+            with stage("llm_queue_wait"):
+                time.sleep(delay)
+                time.sleep(self._reserve(deployment, tokens))
+                self.limiter.acquire()
+            try:
+                self._count("calls")
+                with stage(stage_name) if stage_name else nullcontext():
+                    result = fn()
+            except RETRYABLE_ERRORS as exc:
+                if attempt == self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self._backoff(deployment, attempt, exc)
+            else:
+                self.limiter.on_success()
+                return result
+            finally:
+                self.limiter.release()
+
+    async def acall(self, fn, deployment: str, tokens: int = 0, stage_name: str = None):
+        """
+        Async version of call, fn() returns an awaitable.
+        """
+        delay = 0.0
+        for attempt in range(self.max_retries + 1):
+            with stage("llm_queue_wait"):
+                await asyncio.sleep(delay)
+                await asyncio.sleep(self._reserve(deployment, tokens))
+                await self.limiter.aacquire()
+            try:
+                self._count("calls")
+                with stage(stage_name) if stage_name else nullcontext():
+                    result = await fn()
+            except RETRYABLE_ERRORS as exc:
+                if attempt == self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self._backoff(deployment, attempt, exc)
+            else:
+                self.limiter.on_success()
+                return result
+            finally:
+                self.limiter.release()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "concurrency_limit": self.limiter.limit,
+            "in_flight": self.limiter.in_flight,
+            "deployments": {
+                deployment: {
+                    "rpm": requests.per_minute,
+                    "tpm": tokens.per_minute,
+                    "requests_available": round(requests.level),
+                    "tokens_available": round(tokens.level),
+                }
+                for deployment, (requests, tokens) in self._buckets.items()
+            },
+        }
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    LangChain Embeddings wrapper that sends the wrapped model's requests
+    through an LLMScheduler, so the chunker shares the embedding quota.
+    Its tokens are recorded in the token metrics as estimated.
+    """
+    def __init__(self, embedding_model, scheduler: LLMScheduler, deployment: str):
+        self.embedding_model = embedding_model
+        self.scheduler = scheduler
+        self.deployment = deployment
+
+    def embed_documents(self, texts):
+        tokens = estimate_tokens(texts)
+        vectors = self.scheduler.call(
+            lambda: self.embedding_model.embed_documents(texts),
+            self.deployment,
+            tokens
+        )
+        # LangChain does not return the response's usage, record the estimate
+        record_tokens(self.deployment, "prompt", tokens)
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
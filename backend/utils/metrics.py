@@ -0,0 +1,234 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from a FAISS search to a long LLM call or a large PDF
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class Metric:
+    """
+    Base class of the Prometheus metrics below. A metric either holds its
+    own values, or reads them from `function` at scrape time: a number for
+    an unlabelled metric, or a dict of label value tuples to numbers.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra: dict = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def _current_values(self):
+        if self.function is None:
+            with self._lock:
+                return dict(self._values)
+        values = self.function()
+        if not isinstance(values, dict):
+            return {(): values}
+        return {tuple(str(part) for part in key): value for key, value in values.items()}
+
+    def samples(self):
+        for key, value in sorted(self._current_values().items()):
+            yield f"{self.name}{self._labels(key)} {_format_value(value)}"
+
+    def render(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket{self._labels(key, {'le': _format_value(bound)})} {cumulative}"
+            yield f"{self.name}_sum{self._labels(key)} {_format_value(total)}"
+            yield f"{self.name}_count{self._labels(key)} {cumulative}"
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "compliance_stage_seconds",
+    "Time spent in each stage: extraction, chunking (includes chunker_embedding), chunker_embedding, "
+    "embedding, faiss_search, context_build, disclosure_scan, near_duplicate_lookup, llm_generation, "
+    "llm_queue_wait (waiting for the rate limits, a concurrency slot or a retry; not part of embedding "
+    "and llm_generation).",
+    ["stage"]
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "compliance_llm_tokens_total",
+    "Tokens reported in the Azure OpenAI responses (estimated for the chunker's embeddings), by deployment and kind (prompt/completion).",
+    ["deployment", "kind"]
+))
+CHUNKS = REGISTRY.register(Counter(
+    "compliance_chunks_total",
+    "Checked chunks by outcome (checked, cached, near_duplicate, skipped, disclosure, error).",
+    ["outcome"]
+))
+TRIAGE_ROUTES = REGISTRY.register(Counter(
+    "compliance_triage_total",
+    "Chunks routed by the pre-triage, by route (skip, cheap, full).",
+    ["route"]
+))
+
+class RequestTimings:
+    """
+    Per-request breakdown: seconds and calls per stage, and tokens per deployment.
+    Stages run concurrently (chunks are checked in parallel), so stage
+    seconds are summed over all calls and can exceed the wall time.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.tokens = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float):
+        with self._lock:
+            entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            entry["seconds"] += seconds
+            entry["calls"] += 1
+
+    def add_tokens(self, deployment: str, kind: str, count: int):
+        with self._lock:
+            tokens = self.tokens.setdefault(deployment, {})
+            tokens[kind] = tokens.get(kind, 0) + count
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "total_seconds": round(time.perf_counter() - self.started, 4),
+                "stages": {
+                    name: {"seconds": round(entry["seconds"], 4), "calls": entry["calls"]}
+                    for name, entry in self.stages.items()
+                },
+                "tokens": {deployment: dict(tokens) for deployment, tokens in self.tokens.items()},
+            }
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def start_request_timings() -> RequestTimings:
+    """
+    Starts collecting a breakdown for the current request. Tasks and
+    to_thread calls started afterwards inherit it through the context.
+    """
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add_stage(name, elapsed)
+
+def timed_iter(iterable, name: str):
+    """
+    Yields from iterable, timing every next() call as stage `name`
+    (e.g. pages of a lazily extracted document).
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+def record_tokens(deployment: str, kind: str, count: int):
+    """
+    Adds `count` tokens of `kind` to the metrics and the current request's breakdown.
+    """
+    if not count:
+        return
+    LLM_TOKENS.inc(count, deployment=deployment, kind=kind)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add_tokens(deployment, kind, count)
+
+def record_usage(deployment: str, usage):
+    """
+    Adds the token counts of an API response's usage to the metrics and
+    the current request's breakdown.
+    """
+    if usage is None:
+        return
+    for kind in ("prompt", "completion"):
+        record_tokens(deployment, kind, getattr(usage, f"{kind}_tokens", None))
@@ -0,0 +1,248 @@
+import difflib
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+import numpy as np
+from utils.embedding_cache import normalize_text
+
+_WORD = re.compile(r"\w+")
+_TOKEN = re.compile(r"\w(?:[\w.,%/'-]*\w)?")
+_MONTHS = {
+    "january", "february", "march", "april", "may", "june", "july", "august", "september",
+    "october", "november", "december", "jan", "feb", "mar", "apr", "jun", "jul", "aug",
+    "sep", "sept", "oct", "nov", "dec"
+}
+_SHINGLE_BASE = np.uint64(0x9E3779B97F4A7C15)
+_MASK32 = np.uint64(0xFFFFFFFF)
+
+def shingle_words(text: str):
+    """
+    Lowercased words of the text with figures and month names masked, so
+    paragraphs that only differ by a percentage or a date shingle the same.
+    """
+    masked = []
+    for word in _WORD.findall(normalize_text(text).lower()):
+        if any(char.isdigit() for char in word):
+            masked.append("0")
+        elif word in _MONTHS:
+            masked.append("month")
+        else:
+            masked.append(word)
+    return masked
+
+def shingles(text: str, size: int = 3):
+    """
+    Distinct 64-bit hashes of the runs of `size` masked words (stable across
+    processes: words are hashed with crc32, not Python's salted hash).
+    """
+    ids = np.array([zlib.crc32(word.encode("utf-8")) for word in shingle_words(text)], dtype=np.uint64)
+    size = min(size, len(ids))
+    if size == 0:
+        return np.zeros(0, dtype=np.uint64)
+    count = len(ids) - size + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for offset in range(size):
+            hashes = hashes * _SHINGLE_BASE + ids[offset:offset + count]
+    return np.unique(hashes)
+
+def jaccard(a, b) -> float:
+    if len(a) == 0 and len(b) == 0:
+        return 1.0
+    common = len(np.intersect1d(a, b, assume_unique=True))
+    return common / (len(a) + len(b) - common)
+
+def adapt_comment(comment: str, old_chunk: str, new_chunk: str, max_words: int = 4):
+    """
+    Rewrites a comment made on old_chunk for new_chunk: short differences
+    between the two chunks (a fund name, a date, a figure) are replaced in
+    the comment where it quotes them. Returns (comment, replacements made).
+    """
+    old_tokens, new_tokens = _TOKEN.findall(old_chunk), _TOKEN.findall(new_chunk)
+    replacements = 0
+    matcher = difflib.SequenceMatcher(a=old_tokens, b=new_tokens, autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag != "replace" or old_end - old_start > max_words or new_end - new_start > max_words:
+            continue
+        old = " ".join(old_tokens[old_start:old_end])
+        new = " ".join(new_tokens[new_start:new_end])
+        if len(old) < 2 or old in new_chunk:
+            continue
+        comment, count = re.subn(rf"(?<!\w){re.escape(old)}(?!\w)", new.replace("\\", r"\\"), comment)
+        replacements += count
+    return comment, replacements
+
+class NearDuplicateStore:
+    """
+    Persistent MinHash/LSH index of checked chunks and their comments, so a
+    paragraph that differs from an already checked one only by a name, a
+    date or a figure reuses its comment instead of another model call.
+
+    Chunks are compared by the Jaccard similarity of their masked word
+    shingles. Only chunks checked against the same prompt (scope: system
+    prompt, model and rule ids) are compared; a chunk stored again in the
+    same scope replaces its comment instead of adding an entry. The MinHash signature
+    (bands * rows values) is split into bands; a stored chunk is a candidate
+    when one of its band keys equals the chunk's, and candidates are then
+    verified with the exact Jaccard similarity. A lookup is one indexed SQLite
+    query, so it stays fast at millions of stored chunks.
+    Backed by SQLite, capped at max_entries (oldest evicted first).
+    """
+    def __init__(self, path: str, threshold: float = 0.8, max_entries: int = 2000000,
+                 shingle: int = 3, bands: int = 16, rows: int = 4):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.shingle = shingle
+        self.bands = bands
+        self.rows = rows
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Multiply-shift hash family, fixed so signatures are stable across restarts
+        rng = np.random.default_rng(0x5EED)
+        self._multipliers = rng.integers(1, 2**63, size=bands * rows, dtype=np.uint64) | np.uint64(1)
+        self._offsets = rng.integers(0, 2**63, size=bands * rows, dtype=np.uint64)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id INTEGER PRIMARY KEY,"
+            " key BLOB NOT NULL UNIQUE,"
+            " chunk TEXT NOT NULL,"
+            " comment TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bands ("
+            " key INTEGER NOT NULL,"
+            " chunk_id INTEGER NOT NULL,"
+            " PRIMARY KEY (key, chunk_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_bands_chunk ON bands(chunk_id)")
+        self._count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    @staticmethod
+    def scope(system_prompt: str, chat_model: str, rule_ids) -> bytes:
+        """
+        What a comment depends on besides the chunk; comments are only reused
+        within the same scope. The rules are taken in sorted order, a
+        different retrieval order of the same rules is the same scope.
+        """
+        rules = ",".join(str(rule_id) for rule_id in sorted(int(rule_id) for rule_id in rule_ids))
+        return hashlib.blake2b(f"{system_prompt}\0{chat_model}\0{rules}".encode("utf-8"), digest_size=16).digest()
+
+    @staticmethod
+    def chunk_key(chunk_text: str, scope: bytes) -> bytes:
+        return hashlib.blake2b(scope + normalize_text(chunk_text).encode("utf-8"), digest_size=16).digest()
+
+    def signature(self, hashes):
+        """
+        MinHash signature: for each hash function, the smallest (high 32 bits
+        of the) hash over the shingles.
+        """
+        if len(hashes) == 0:
+            return np.zeros(self.bands * self.rows, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            values = (hashes[None, :] * self._multipliers[:, None] + self._offsets[:, None]) >> np.uint64(32)
+        return values.min(axis=1) & _MASK32
+
+    def band_keys(self, scope: bytes, hashes):
+        signature = self.signature(hashes).reshape(self.bands, self.rows)
+        return [
+            int.from_bytes(
+                hashlib.blake2b(scope + bytes([band]) + signature[band].tobytes(), digest_size=8).digest(),
+                "big", signed=True
+            )
+            for band in range(self.bands)
+        ]
+
+    def get(self, chunk_text: str, scope: bytes):
+        """
+        The most similar stored chunk of the scope at or above threshold, as
+        {"chunk", "comment", "similarity"}, or None.
+        """
+        hashes = shingles(chunk_text, self.shingle)
+        keys = self.band_keys(scope, hashes)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, chunk, comment FROM chunks WHERE id IN "
+                f"(SELECT chunk_id FROM bands WHERE key IN ({','.join('?' * len(keys))}))",
+                keys
+            ).fetchall()
+        best = None
+        for _, chunk, comment in rows:
+            similarity = jaccard(hashes, shingles(chunk, self.shingle))
+            if similarity >= self.threshold and (best is None or similarity > best["similarity"]):
+                best = {"chunk": chunk, "comment": comment, "similarity": round(similarity, 4)}
+        with self._lock:
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+
+    def put(self, chunk_text: str, scope: bytes, comment: str):
+        self.put_many([(chunk_text, scope, comment)])
+
+    def put_many(self, items):
+        """
+        Stores [(chunk text, scope, comment)] in one transaction. A chunk
+        already stored in its scope (same text up to whitespace) only gets
+        the new comment.
+        """
+        keyed = [
+            (self.chunk_key(chunk_text, scope), chunk_text, comment,
+             self.band_keys(scope, shingles(chunk_text, self.shingle)))
+            for chunk_text, scope, comment in items
+        ]
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for chunk_key, chunk_text, comment, keys in keyed:
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO chunks (key, chunk, comment, created) VALUES (?, ?, ?, ?)",
+                        (chunk_key, chunk_text, comment, now)
+                    )
+                    if not cursor.rowcount:
+                        self._conn.execute(
+                            "UPDATE chunks SET comment = ?, created = ? WHERE key = ?", (comment, now, chunk_key)
+                        )
+                        continue
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO bands (key, chunk_id) VALUES (?, ?)",
+                        [(key, cursor.lastrowid) for key in keys]
+                    )
+                    self._count += 1
+                if self._count > self.max_entries:
+                    # Evict in slices of 1% so eviction is not paid on every insert
+                    excess = self._count - self.max_entries + max(1, self.max_entries // 100)
+                    oldest = "SELECT id FROM chunks ORDER BY id LIMIT ?"
+                    self._conn.execute(f"DELETE FROM bands WHERE chunk_id IN ({oldest})", (excess,))
+                    self._count -= self._conn.execute(f"DELETE FROM chunks WHERE id IN ({oldest})", (excess,)).rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self._count,
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+            }
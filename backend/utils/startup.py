@@ -0,0 +1,89 @@
+import asyncio
+import time
+import traceback
+from contextlib import asynccontextmanager, suppress
+from fastapi import HTTPException
+
+class Startup:
+    """
+    Loads the app's services (corpus, FAISS index, Azure clients, chunker)
+    in a background thread once the server is up, so the process answers
+    /healthz right away and /readyz once everything is loaded.
+
+    The builder runs in a thread and returns the services; on_loaded hooks
+    (e.g. starting workers, warmup) then run on the event loop before the
+    services are marked ready; on_shutdown hooks run when the server stops
+    and get None if the builder never finished.
+    """
+    def __init__(self):
+        self.state = "starting"
+        self.error = None
+        self.services = None
+        self._built = None
+        self.seconds = {}
+        self._build = None
+        self._on_loaded = []
+        self._on_shutdown = []
+        self._task = None
+
+    def builder(self, function):
+        self._build = function
+        return function
+
+    def on_loaded(self, function):
+        self._on_loaded.append(function)
+        return function
+
+    def on_shutdown(self, function):
+        self._on_shutdown.append(function)
+        return function
+
+    async def _load(self):
+        started = time.perf_counter()
+        try:
+            services = self._built = await asyncio.to_thread(self._build)
+            self.seconds["build"] = round(time.perf_counter() - started, 3)
+            for hook in self._on_loaded:
+                hook_started = time.perf_counter()
+                await hook(services)
+                self.seconds[hook.__name__] = round(time.perf_counter() - hook_started, 3)
+        except Exception as exc:
+            self.state = "failed"
+            self.error = f"{type(exc).__name__}: {exc}"
+            traceback.print_exc()
+            return
+        self.seconds["total"] = round(time.perf_counter() - started, 3)
+        self.services = services
+        self.state = "ready"
+
+    @asynccontextmanager
+    async def lifespan(self, app):
+        self._task = asyncio.create_task(self._load())
+        try:
+            yield
+        finally:
+            # A build still running in its thread is abandoned with the process
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            for hook in self._on_shutdown:
+                await hook(self._built)
+
+    def status(self) -> dict:
+        status = {"status": self.state}
+        if self.error:
+            status["error"] = self.error
+        if self.seconds:
+            status["seconds"] = dict(self.seconds)
+        return status
+
+    def require(self):
+        """
+        FastAPI dependency returning the services, 503 until they are ready.
+        """
+        if self.services is None:
+            detail = "Service is starting, try again shortly."
+            if self.state == "failed":
+                detail = f"Service failed to start: {self.error}"
+            raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+        return self.services
@@ -1,22 +1,372 @@
+import re
+
+import threading
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+
 from langchain_experimental.text_splitter import SemanticChunker
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+from utils.metrics import stage
+
+
+
+CHUNKING_MODES = ["semantic", "structural"]
+
+
+
+# Structural markup: extract_text2 / DOCX headings are wrapped in ** **
+
+HEADING_RE = re.compile(r"^\*\*.+\*\*$")
+
+BULLET_RE = re.compile(r"^([\u2022\u25aa\u25e6\-\u2013*]|\d+[.)]|[a-z][.)])\s")
+
+
+
+class RecordingEmbeddings(Embeddings):
+
+    """
+
+    Wraps the chunker's embedding model and keeps the vectors it returns,
+
+    so the sentence embeddings SemanticChunker computes can be reused
+
+    for the chunks instead of embedding the same text again.
+
+    Recordings are per thread, the TextProcessor is shared across requests.
+
+    """
+
+    def __init__(self, embedding_model):
+
+        self.embedding_model = embedding_model
+
+        self._local = threading.local()
+
+
+
+    def start_recording(self):
+
+        self._local.vectors = []
+
+
+
+    def stop_recording(self):
+
+        vectors = getattr(self._local, "vectors", None)
+
+        self._local.vectors = None
+
+        return vectors
+
+
+
+    def embed_documents(self, texts):
+
+        with stage("chunker_embedding"):
+
+            vectors = self.embedding_model.embed_documents(texts)
+
+        recorded = getattr(self._local, "vectors", None)
+
+        if recorded is not None:
+
+            recorded.extend(vectors)
+
+        return vectors
+
+
+
+    def embed_query(self, text):
+
+        return self.embedding_model.embed_query(text)
+
+
+
+def pool_embeddings(vectors):
+
+    """
+
+    Mean-pools sentence vectors into a single unit-length chunk vector.
+
+    """
+
+    pooled = np.mean(np.asarray(vectors, dtype="float32"), axis=0)
+
+    norm = np.linalg.norm(pooled)
+
+    return pooled / norm if norm else pooled
+
  
 
+def structural_sections(text: str):
+
+    """
+
+    Splits structured text (headings as **...** lines) into sections.
+
+    A paragraph ends at a blank line, at a line ending with . ! ? or :,
+
+    or before a bullet / numbered item; wrapped lines are joined.
+
+    Returns a list of (heading, [paragraph, ...]), heading None before the first one.
+
+    """
+
+    sections = [(None, [])]
+
+    paragraph = []
+
+
+
+    def end_paragraph():
+
+        if paragraph:
+
+            sections[-1][1].append(" ".join(paragraph))
+
+            paragraph.clear()
+
+
+
+    for line in text.split("\n"):
+
+        line = line.strip()
+
+        if not line:
+
+            end_paragraph()
+
+            continue
+
+        if HEADING_RE.match(line):
+
+            end_paragraph()
+
+            heading, paragraphs = sections[-1]
+
+            if heading is not None and not paragraphs:
+
+                # Consecutive heading lines are one heading
+
+                sections[-1] = (f"{heading} {line}", paragraphs)
+
+            else:
+
+                sections.append((line, []))
+
+            continue
+
+        if BULLET_RE.match(line):
+
+            end_paragraph()
+
+        paragraph.append(line)
+
+        if line.endswith((".", "!", "?", ":")):
+
+            end_paragraph()
+
+    end_paragraph()
+
+    return [(heading, paragraphs) for heading, paragraphs in sections if heading or paragraphs]
+
+
+
+def hard_split(text: str, max_chars: int):
+
+    """
+
+    Splits text into pieces of at most max_chars at line boundaries, then at
+
+    word boundaries for lines that are still too long; a single word longer
+
+    than max_chars is cut.
+
+    """
+
+    pieces, current = [], ""
+
+    for line in text.split("\n"):
+
+        units = [line] if len(line) <= max_chars else [
+
+            word[start:start + max_chars] for word in line.split() for start in range(0, len(word), max_chars)
+
+        ]
+
+        separator = "\n" if len(line) <= max_chars else " "
+
+        for unit in units:
+
+            if current and len(current) + 1 + len(unit) > max_chars:
+
+                pieces.append(current)
+
+                current = unit
+
+            else:
+
+                current = f"{current}{separator}{unit}" if current else unit
+
+    if current.strip():
+
+        pieces.append(current)
+
+    return pieces
+
+
+
+def split_sentences(paragraph: str, max_chars: int, split_regex: str = r"(?<=[.?!])\s+"):
+
+    """
+
+    Splits a paragraph longer than max_chars at sentence boundaries.
+
+    Sentences still longer than max_chars (tables, lists or text without
+
+    punctuation) are split with hard_split.
+
+    """
+
+    pieces, current = [], ""
+
+    sentences = []
+
+    for sentence in re.split(split_regex, paragraph):
+
+        sentences.extend(hard_split(sentence, max_chars) if len(sentence) > max_chars else [sentence])
+
+    for sentence in sentences:
+
+        if current and len(current) + 1 + len(sentence) > max_chars:
+
+            pieces.append(current)
+
+            current = sentence
+
+        else:
+
+            current = f"{current} {sentence}" if current else sentence
+
+    if current:
+
+        pieces.append(current)
+
+    return pieces
+
+
+
+def create_structural_chunks(text: str, min_chars: int = 200, max_chars: int = 1500):
+
+    """
+
+    Chunks structured text without any model call:
+
+      1. a heading starts a new chunk and stays with the text below it
+
+      2. paragraphs are packed into chunks of up to max_chars, paragraphs
+
+         longer than that are split at sentence boundaries
+
+      3. chunks shorter than min_chars are merged into the next one
+
+         (the last one into the previous one)
+
+      4. no chunk is longer than max_chars: one that still is after merging
+
+         is split with hard_split
+
+    Returns a list of chunk strings.
+
+    """
+
+    chunks = []
+
+    for heading, paragraphs in structural_sections(text):
+
+        pieces = []
+
+        for paragraph in paragraphs:
+
+            pieces.extend(split_sentences(paragraph, max_chars) if len(paragraph) > max_chars else [paragraph])
+
+        current = heading or ""
+
+        for piece in pieces:
+
+            if len(current) >= min_chars and len(current) + 1 + len(piece) > max_chars:
+
+                chunks.append(current)
+
+                current = piece
+
+            else:
+
+                current = f"{current} {piece}" if current else piece
+
+        if current:
+
+            chunks.append(current)
+
+
+
+    merged = []
+
+    carry = ""
+
+    for chunk in chunks:
+
+        chunk = f"{carry} {chunk}" if carry else chunk
+
+        if len(chunk) < min_chars:
+
+            carry = chunk
+
+            continue
+
+        merged.append(chunk)
+
+        carry = ""
+
+    if carry:
+
+        if merged:
+
+            merged[-1] += " " + carry
+
+        else:
+
+            merged.append(carry)
+
+    return [piece for chunk in merged for piece in (hard_split(chunk, max_chars) if len(chunk) > max_chars else [chunk])]
+
+
+
 class TextProcessor:
 
     """
 
-    Handles splitting of text into chunks.
+    Handles splitting of text into chunks, with the SemanticChunker
+
+    ("semantic", embeds every sentence) or the structural rules
+
+    ("structural", headings/paragraphs/length, no API calls).
 
     """
 
-    def __init__(self, embedding_model, threshold_type="percentile", threshold_amount=88.0):
+    def __init__(self, embedding_model, threshold_type="percentile", threshold_amount=88.0,
+
+                 chunking_mode: str = "semantic", structural_min_chars: int = 200, structural_max_chars: int = 1500):
+
+        self.embedding_model = RecordingEmbeddings(embedding_model)
 
         self.text_splitter = SemanticChunker(
 
-            embedding_model,
+            self.embedding_model,
 
             breakpoint_threshold_type=threshold_type,
 
@@ -24,6 +374,52 @@ class TextProcessor:
 
         )
 
+        if chunking_mode not in CHUNKING_MODES:
+
+            raise ValueError(f"Unknown chunking mode {chunking_mode!r}, expected one of {CHUNKING_MODES}")
+
+        self.chunking_mode = chunking_mode
+
+        self.structural_min_chars = structural_min_chars
+
+        self.structural_max_chars = structural_max_chars
+
+
+
+    def chunk_document(self, text: str, mode: str = None, threshold: int = 55):
+
+        """
+
+        Chunks text with the given mode (default: the processor's mode).
+
+        Returns (chunk_text, embedding) tuples like create_chunks_with_embeddings;
+
+        structural chunks have no embedding, they are embedded in batches later.
+
+        Structural mode expects extract_text2 / structured DOCX text.
+
+        """
+
+        mode = mode or self.chunking_mode
+
+        if mode not in CHUNKING_MODES:
+
+            raise ValueError(f"Unknown chunking mode {mode!r}, expected one of {CHUNKING_MODES}")
+
+        with stage("chunking"):
+
+            if mode == "structural":
+
+                return [
+
+                    (chunk, None)
+
+                    for chunk in create_structural_chunks(text, self.structural_min_chars, self.structural_max_chars)
+
+                ]
+
+            return self.create_chunks_with_embeddings(text, threshold)
+
    
 
     def create_chunks(self, text: str, threshold: int = 55):
@@ -38,22 +434,78 @@ class TextProcessor:
 
         """
 
-        docs = self.text_splitter.create_documents([text])
+        return [chunk for chunk, _ in self.create_chunks_with_embeddings(text, threshold)]
+
+
+
+    def create_chunks_with_embeddings(self, text: str, threshold: int = 55):
+
+        """
+
+        Same chunking as create_chunks, but also returns an embedding per chunk
+
+        built from the sentence vectors the SemanticChunker already computed:
+
+        the sentence's own vector for a one-sentence chunk, the mean of its
+
+        sentence vectors otherwise. The chunker embeds each sentence together
+
+        with its neighbours (buffer_size), so these are contextual vectors.
+
+        Returns a list of (chunk_text, embedding) tuples; embedding is None
+
+        when the chunker did not embed anything (e.g. single sentence input).
+
+        """
+
+        self.embedding_model.start_recording()
+
+        try:
+
+            docs = self.text_splitter.create_documents([text])
+
+        finally:
+
+            sentence_vectors = self.embedding_model.stop_recording()
+
+
+
+        split_regex = self.text_splitter.sentence_split_regex
+
+        if not sentence_vectors or len(sentence_vectors) != len(re.split(split_regex, text)):
+
+            sentence_vectors = None
+
+
 
         combined_docs = []
 
+        combined_spans = []
+
+        position = 0
+
  
 
         for doc in docs:
 
             current_content = doc.page_content.strip()
 
+            # Sentence indices covered by this doc, in the order the chunker saw them
+
+            sentence_count = len(re.split(split_regex, doc.page_content))
+
+            span = list(range(position, position + sentence_count))
+
+            position += sentence_count
+
             if not combined_docs:
 
                 # If combined_docs is empty, just add the first chunk
 
                 combined_docs.append(current_content)
 
+                combined_spans.append(span)
+
             else:
 
                 # Check if the current chunk meets the threshold
@@ -64,22 +516,100 @@ class TextProcessor:
 
                     combined_docs[-1] += " " + current_content
 
+                    combined_spans[-1] += span
+
                 else:
 
                     # Otherwise, add the current chunk as a new entry
 
                     combined_docs.append(current_content)
 
+                    combined_spans.append(span)
+
+
+
+        if sentence_vectors is not None and position != len(sentence_vectors):
+
+            sentence_vectors = None
+
  
 
         # Replace newlines with spaces in the combined chunks
 
         stripped_docs = [doc.replace("\n", " ") for doc in combined_docs]
 
-        return stripped_docs
+        if sentence_vectors is None:
+
+            return [(doc, None) for doc in stripped_docs]
+
+        return [
+
+            (doc, pool_embeddings([sentence_vectors[i] for i in span]))
+
+            for doc, span in zip(stripped_docs, combined_spans)
+
+        ]
 
  
 
+    def iter_chunks_with_embeddings(self, pages, window_chars: int = 20000, threshold: int = 55, mode: str = None):
+
+        """
+
+        Streaming version of chunk_document over an iterable
+
+        of page texts. Pages are collected into a window of about window_chars
+
+        characters, which is chunked; every chunk but the last is yielded and
+
+        the last one is carried over to the start of the next window, since
+
+        it may continue on the next page. Memory stays bounded by the window,
+
+        whatever the document size. Breakpoint percentiles are computed per
+
+        window rather than over the whole document.
+
+        Yields (chunk_text, embedding) tuples.
+
+        """
+
+        buffer = ""
+
+        for page in pages:
+
+            if not page:
+
+                continue
+
+            buffer = f"{buffer}\n{page}" if buffer else page
+
+            if len(buffer) < window_chars:
+
+                continue
+
+            pairs = self.chunk_document(buffer, mode, threshold)
+
+            if len(pairs) > 1:
+
+                yield from pairs[:-1]
+
+                buffer = pairs[-1][0]
+
+            elif len(buffer) >= 2 * window_chars:
+
+                # No breakpoint at all in two windows of text, emit it as is
+
+                yield from pairs
+
+                buffer = ""
+
+        if buffer:
+
+            yield from self.chunk_document(buffer, mode, threshold)
+
+
+
     def create_chunks3(self, text: str, threshold: int = 55):
 
         """
@@ -0,0 +1,115 @@
+import re
+
+_WORD = re.compile(r"\w+")
+_SEGMENT_BREAK = re.compile(r"(?<=[.!?])\s+|\n+")
+_PAGE_LABEL = re.compile(r"(page|slide|p\.)?\s*\d+(\s*(of|/)\s*\d+)?", re.IGNORECASE)
+
+def chunk_features(text: str) -> dict:
+    """
+    Cheap local features of a chunk: characters, words, sentences (or
+    lines, so bullet lists count per item) and numeric density, the share
+    of non-space characters that are digits.
+    """
+    stripped = text.strip()
+    non_space = sum(1 for char in stripped if not char.isspace())
+    return {
+        "chars": len(stripped),
+        "words": len(_WORD.findall(stripped)),
+        "sentences": len([segment for segment in _SEGMENT_BREAK.split(stripped) if segment.strip()]),
+        "numeric_density": round(sum(char.isdigit() for char in stripped) / max(1, non_space), 3),
+        "has_letters": any(char.isalpha() for char in stripped),
+        "page_label": bool(_PAGE_LABEL.fullmatch(stripped)),
+    }
+
+def trim_retrieval(retrieval: dict, max_sections: int) -> dict:
+    """
+    Keeps the max_sections best rule sections of a retrieval from
+    ComplianceAgent.retrieve_batch. Sections assembled by a ContextBuilder
+    are joined by a blank line, plain ones are concatenated as
+    IndexSnapshot.get_context does.
+    """
+    if len(retrieval["rule_ids"]) <= max_sections:
+        return dict(retrieval)
+    separator = "\n\n" if "dropped" in retrieval else ""
+    sections = retrieval["sections"][:max_sections]
+    return {
+        **retrieval,
+        "rule_ids": retrieval["rule_ids"][:max_sections],
+        "sections": sections,
+        "context": separator.join(sections),
+    }
+
+class ChunkTriage:
+    """
+    Routes chunks before any model call, from chunk_features and the best
+    FAISS similarity of the chunk:
+      skip   no letters (numbers, table rules), page labels ("Page 3 of 12"),
+             fragments of fewer than min_words words without figures
+             (headings, labels), or short (one sentence and < cheap_max_chars)
+             chunks without figures that nothing in the rules scores
+             skip_score for; longer prose is never skipped
+      full   chunks with figures (numeric density >= numeric_density, e.g.
+             performance numbers that need disclosures), and longer
+             multi-sentence chunks that match the rules well
+      cheap  the rest: one-sentence or short (< cheap_max_chars) chunks and
+             weak matches (best score < full_min_score), checked on
+             cheap_model with the cheap_sections best sections and a
+             cheap_max_tokens answer; without a cheap_model these get a
+             full check
+    The thresholds are similarities of the embedding model in use and should
+    be tuned on the corpus (e.g. with the triage records in the results).
+    The defaults suit text-embedding-ada-002, whose cosine similarities
+    rarely drop below 0.7 even for unrelated text.
+    """
+    def __init__(self, min_words: int = 4, skip_score: float = 0.75, numeric_density: float = 0.1,
+                 cheap_max_chars: int = 200, full_min_score: float = 0.8, cheap_model: str = "",
+                 cheap_max_tokens: int = 800, cheap_sections: int = 3):
+        self.min_words = min_words
+        self.skip_score = skip_score
+        self.numeric_density = numeric_density
+        self.cheap_max_chars = cheap_max_chars
+        self.full_min_score = full_min_score
+        self.cheap_model = cheap_model
+        self.cheap_max_tokens = cheap_max_tokens
+        self.cheap_sections = max(1, cheap_sections)
+
+    def route(self, features: dict, best_score) -> tuple:
+        """
+        Returns (route, reason) for a chunk's features and best similarity
+        (None when the index returned no neighbour).
+        """
+        has_figures = features["numeric_density"] > 0
+        if not features["has_letters"]:
+            return "skip", "no text"
+        if features["page_label"]:
+            return "skip", "page number"
+        if features["words"] < self.min_words and not has_figures:
+            return "skip", "fragment"
+        is_short = features["sentences"] <= 1 and features["chars"] < self.cheap_max_chars
+        if (best_score is None or best_score < self.skip_score) and not has_figures and is_short:
+            return "skip", "no related rule"
+        if features["numeric_density"] >= self.numeric_density and features["words"] >= self.min_words:
+            return "full", "figures"
+        if features["sentences"] <= 1 or features["chars"] < self.cheap_max_chars:
+            return self.cheap_route(), "short"
+        if best_score is None or best_score < self.full_min_score:
+            return self.cheap_route(), "weak rule match"
+        return "full", "default"
+
+    def cheap_route(self) -> str:
+        # Cheap checks need a cheaper deployment, the same model gains nothing
+        return "cheap" if self.cheap_model else "full"
+
+    def decide(self, chunk_text: str, best_score) -> dict:
+        """
+        The triage record of a chunk: route, reason and the features it was
+        decided on.
+        """
+        features = chunk_features(chunk_text)
+        route, reason = self.route(features, best_score)
+        return {
+            "route": route,
+            "reason": reason,
+            "best_score": None if best_score is None else round(best_score, 4),
+            **features,
+        }
@@ -0,0 +1,110 @@
+import os
+import zipfile
+from starlette.responses import JSONResponse
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+class UploadSizeLimit:
+    """
+    ASGI middleware rejecting request bodies larger than max_bytes with a 413.
+    A Content-Length over the limit is refused before any of the body is
+    read, and an invalid one with a 400; otherwise the body is counted as it
+    arrives and the request is cut off as soon as it goes over, so an
+    oversized upload is never spooled whole. max_bytes 0 disables the limit.
+    """
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def too_large(self):
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Upload larger than {self.max_bytes // (1024 * 1024)} MB."}
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_bytes:
+            return await self.app(scope, receive, send)
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None:
+            try:
+                declared = int(content_length)
+            except ValueError:
+                declared = -1
+            if declared < 0:
+                response = JSONResponse(status_code=400, content={"detail": "Invalid Content-Length header."})
+                return await response(scope, receive, send)
+            if declared > self.max_bytes:
+                return await self.too_large()(scope, receive, send)
+
+        received = 0
+        exceeded = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Looks like a disconnect to the app, which stops reading the body
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def limited_send(message):
+            nonlocal rejected
+            if not exceeded:
+                return await send(message)
+            # Whatever error the app answers the cut-off body with becomes the 413
+            if message["type"] == "http.response.start" and not rejected:
+                rejected = True
+                await self.too_large()(scope, receive, send)
+
+        await self.app(scope, limited_receive, limited_send)
+        if exceeded and not rejected:
+            await self.too_large()(scope, receive, send)
+
+def upload_size(file_obj) -> int:
+    """
+    Size in bytes of a seekable file object (e.g. an upload's spooled file).
+    """
+    size = file_obj.seek(0, os.SEEK_END)
+    file_obj.seek(0)
+    return size
+
+def expand_zip(source, directory: str, max_files: int, max_bytes: int):
+    """
+    Extracts the files of a zip archive (a path or a seekable file object)
+    into `directory` (flattened, in
+    archive order), skipping folders and hidden/system entries such as
+    __MACOSX. Returns [(name, path)]. Raises ValueError for an invalid
+    archive, more than max_files files or more than max_bytes uncompressed
+    (checked on the bytes actually written, not the sizes the archive claims).
+    """
+    try:
+        archive = zipfile.ZipFile(source)
+    except zipfile.BadZipFile:
+        raise ValueError("Invalid zip archive.")
+    files = []
+    written = 0
+    with archive:
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name or name.startswith(".") or "__MACOSX" in info.filename:
+                continue
+            if len(files) >= max_files:
+                raise ValueError(f"More than {max_files} files in the archive.")
+            # Numbered, so members with the same name in different folders do not collide
+            target = os.path.join(directory, f"{len(files)}_{name}")
+            with archive.open(info) as member, open(target, "wb") as out:
+                while True:
+                    block = member.read(COPY_CHUNK_SIZE)
+                    if not block:
+                        break
+                    written += len(block)
+                    if written > max_bytes:
+                        raise ValueError(f"Archive larger than {max_bytes // (1024 * 1024)} MB uncompressed.")
+                    out.write(block)
+            files.append((name, target))
+    return files
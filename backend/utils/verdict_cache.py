@@ -0,0 +1,94 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from utils.embedding_cache import normalize_text
+
+def verdict_key(system_prompt: str, chat_model: str, rule_ids, chunk_text: str, context: str = "") -> str:
+    """
+    A verdict only depends on the system prompt, the model, the rule sections
+    placed in the prompt (in order) and the chunk itself. Rule ids are corpus
+    rows, so the hash of the rule text is included too: a rebuilt corpus
+    that renumbers or edits rules does not serve stale verdicts.
+    """
+    prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    chunk_hash = hashlib.sha256(normalize_text(chunk_text).encode("utf-8")).hexdigest()
+    context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+    rules = ",".join(str(int(rule_id)) for rule_id in rule_ids)
+    return hashlib.sha256(
+        f"{prompt_hash}\0{chat_model}\0{rules}\0{context_hash}\0{chunk_hash}".encode("utf-8")
+    ).hexdigest()
+
+class VerdictCache:
+    """
+    Persistent store of model comments for already checked chunks, so a
+    re-uploaded revision only sends new or edited chunks to the model.
+    Backed by SQLite, capped at max_entries with least-recently-used eviction.
+    """
+    def __init__(self, path: str, max_entries: int = 200000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            " key TEXT PRIMARY KEY,"
+            " comment TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_verdicts_last_used ON verdicts(last_used)")
+        self._count = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT comment FROM verdicts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE verdicts SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, comment: str):
+        now = time.time()
+        with self._lock:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO verdicts (key, comment, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, comment, now, now)
+            ).rowcount
+            if not inserted:
+                self._conn.execute(
+                    "UPDATE verdicts SET comment = ?, created = ?, last_used = ? WHERE key = ?",
+                    (comment, now, now, key)
+                )
+                return
+            self._count += 1
+            if self._count > self.max_entries:
+                # Evict in slices of 1% so eviction is not paid on every insert
+                excess = self._count - self.max_entries + max(1, self.max_entries // 100)
+                self._count -= self._conn.execute(
+                    "DELETE FROM verdicts WHERE key IN "
+                    "(SELECT key FROM verdicts ORDER BY last_used ASC LIMIT ?)",
+                    (excess,)
+                ).rowcount
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self._count,
+                "max_entries": self.max_entries,
+            }
@@ -24,24 +24,14 @@ function App() {
 
     setUploading(true);
     setProgress(0);
-
-    // Simulate a 20-second upload progress bar
-    const interval = setInterval(() => {
-      setProgress((prev) => {
-        if (prev >= 99) {
-          clearInterval(interval);
-          return 99;
-        }
-        return prev + 1;
-      });
-    }, 400);
+    setChunks([]);
 
     try {
       const formData = new FormData();
       formData.append("file", selectedFile);
 
-      // Use your actual backend endpoint here:
-      const response = await fetch("http://localhost:8000/upload", {
+      // Results are streamed back as newline-delimited JSON, one line per event
+      const response = await fetch("http://localhost:8000/upload/stream", {
         method: "POST",
         body: formData,
       });
@@ -52,8 +42,47 @@ function App() {
         return;
       }
 
-      const data = await response.json();
-      setChunks(data.chunks);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let total = 0;
+      let completed = 0;
+
+      const handleEvent = (event) => {
+        if (event.type === "progress") {
+          // Extraction, chunking and embedding take the first 10% of the bar
+          if (event.stage === "chunking") setProgress(5);
+          if (event.stage === "checking") {
+            // total is null until the whole document has been chunked
+            total = event.total;
+            if (total === 0) setProgress(100);
+            else if (total) setProgress(10 + Math.floor((completed / total) * 90));
+            else setProgress(10);
+          }
+        } else if (event.type === "result") {
+          // Chunks can finish out of order, place each one at its index
+          completed += 1;
+          setChunks((prev) => {
+            const next = [...prev];
+            next[event.index] = event;
+            return next;
+          });
+          if (total) setProgress(10 + Math.floor((completed / total) * 90));
+        } else if (event.error) {
+          alert(`An error occurred while checking the file: ${event.error}`);
+        }
+      };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+        lines.filter((line) => line.trim()).forEach((line) => handleEvent(JSON.parse(line)));
+      }
+      if (buffer.trim()) handleEvent(JSON.parse(buffer));
+
       setUploading(false);
     } catch (error) {
       console.error(error);
@@ -80,7 +109,7 @@ function App() {
 
         {uploading && <ProgressBar progress={progress} />}
 
-        {!uploading && chunks.length > 0 && <ChunkList chunks={chunks} />}
+        {chunks.length > 0 && <ChunkList chunks={chunks} />}
       </div>
     </div>
   );
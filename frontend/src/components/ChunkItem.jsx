@@ -6,6 +6,8 @@ import DOMPurify from "dompurify";
  * {
  *   chunk: "Here is some text...",
  *   comment: "<p>This is an HTML comment</p>",
+ *   error: "RateLimitError: ...", // only set when the chunk could not be checked
+ *   triage: { route: "skip", reason: "fragment", ... }, // only set when TRIAGE is on
  *   highlights: [
  *     { start: 5, end: 10, color: "yellow" },
  *     { start: 15, end: 25, color: "lightpink" }
@@ -14,7 +16,7 @@ import DOMPurify from "dompurify";
  */
 
 function ChunkItem({ chunkObj, index }) {
-  const { chunk, comment, highlights = [] } = chunkObj;
+  const { chunk, comment, error, triage, highlights = [] } = chunkObj;
 
   // Apply highlight styles to portions of the text
   const highlightChunk = (text, highlightsArray) => {
@@ -49,7 +51,7 @@ function ChunkItem({ chunkObj, index }) {
     return result;
   };
 
-  const safeHTML = DOMPurify.sanitize(comment);
+  const safeHTML = DOMPurify.sanitize(comment || "");
 
   return (
     <div className="mb-6 p-4 border bg-gray-100 rounded-lg">
@@ -71,7 +73,19 @@ function ChunkItem({ chunkObj, index }) {
           <h2 className="font-bold text-green-800 mb-2">
             Generated Comment
           </h2>
-          <p dangerouslySetInnerHTML={{ __html: safeHTML }} />
+          {/* Chunks the model could not be reached for come back with an error */}
+          {error ? (
+            <p className="text-sm text-red-700">
+              This chunk could not be checked: {error}
+            </p>
+          ) : triage?.route === "skip" ? (
+            /* Headings, page numbers and fragments are not sent to the model */
+            <p className="text-sm text-gray-500">
+              Not checked ({triage.reason}).
+            </p>
+          ) : (
+            <p dangerouslySetInnerHTML={{ __html: safeHTML }} />
+          )}
         </div>
       </div>
     </div>
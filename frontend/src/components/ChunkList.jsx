@@ -4,9 +4,10 @@ import ChunkItem from "./ChunkItem.jsx";
 function ChunkList({ chunks }) {
   return (
     <div className="mt-8">
-      {chunks.map((chunkObj, idx) => (
-        <ChunkItem key={idx} chunkObj={chunkObj} index={idx} />
-      ))}
+      {/* Slots stay empty until their chunk has been streamed back */}
+      {chunks.map((chunkObj, idx) =>
+        chunkObj ? <ChunkItem key={idx} chunkObj={chunkObj} index={idx} /> : null
+      )}
     </div>
   );
 }